@@ -3,5 +3,6 @@
 from mgx_backend.actions.write_prd import WritePRD
 from mgx_backend.actions.write_design import WriteDesign
 from mgx_backend.actions.write_code import WriteCode
+from mgx_backend.actions.revise_design import ReviseDesign
 
-__all__ = ["WritePRD", "WriteDesign", "WriteCode"]
\ No newline at end of file
+__all__ = ["WritePRD", "WriteDesign", "WriteCode", "ReviseDesign"]
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""Revise System Design action."""
+
+from typing import Optional
+from mgx_backend.action import Action
+
+
+class ReviseDesign(Action):
+    """Revise an existing System Design Document for a change request."""
+    
+    name: str = "ReviseDesign"
+    
+    def build_prompt(self, context: str, change_request: str = "") -> str:
+        """Build prompt for revising system design."""
+        return f"""You are a Software Architect. Revise the existing System Design Document below so that it satisfies the change request.
+
+Change Request:
+{change_request}
+
+Existing System Design Document:
+{context}
+
+CRITICAL INSTRUCTIONS:
+- Output the COMPLETE revised design document in markdown format
+- Keep every heading that is not affected by the change EXACTLY as it is, with its content unchanged word for word
+- Only rewrite the sections that the change request actually affects
+- Add new sections only if the change request introduces something new
+- When a change affects code, name the affected files by their path exactly as listed in the File Structure section
+- Do NOT add any explanation before or after the document"""
+    
+    async def run(self, context: str, stream_callback: Optional[callable] = None, change_request: str = "") -> str:
+        """Execute ReviseDesign action."""
+        prompt = self.build_prompt(context, change_request=change_request)
+        design = await self.llm.ask(prompt, stream_callback=stream_callback)
+        return design
@@ -1,6 +1,6 @@
 """Write Code action."""
 
-from typing import Optional
+from typing import Dict, Optional
 from mgx_backend.action import Action
 
 
@@ -131,8 +131,51 @@ IMPORTANT:
 
 Make sure every file is complete and functional. The code should be ready to run and the application should work immediately after installation. The game must be playable with all core mechanics working."""
     
-    async def run(self, context: str, stream_callback: Optional[callable] = None) -> str:
-        """Execute WriteCode action."""
-        prompt = self.build_prompt(context)
+    def build_files_prompt(self, context: str, files: Dict[str, str]) -> str:
+        """Build prompt for regenerating only the given files."""
+        current_files = "\n\n".join(
+            f"FILE: {path}\n---\n{content}\n---" for path, content in files.items()
+        )
+        file_list = "\n".join(f"- {path}" for path in files)
+        return f"""You are a Senior Software Engineer. The System Design changed. Update ONLY the files listed below so they implement the changed design sections. All other project files stay as they are.
+
+Changed System Design Sections:
+{context}
+
+Files to update:
+{file_list}
+
+Current content of these files:
+{current_files}
+
+CRITICAL INSTRUCTIONS:
+- Output EVERY listed file in full (not a diff), including the parts that do not change
+- Do NOT output files that are not listed
+- Keep every existing function, export and name that other files may depend on unless the change requires otherwise
+- Code comments inside files are allowed
+
+OUTPUT FORMAT (STRICT - NO DEVIATIONS):
+FILE: path/to/file.ext
+---
+[complete updated file content]
+---"""
+    
+    async def run(
+        self,
+        context: str,
+        stream_callback: Optional[callable] = None,
+        files: Optional[Dict[str, str]] = None
+    ) -> str:
+        """Execute WriteCode action.
+        
+        Args:
+            context: System design (or only its changed sections when files is given)
+            stream_callback: Optional callback function(chunk: str) for streaming output
+            files: Optional {path: current content}; when given only these files are regenerated
+        """
+        if files:
+            prompt = self.build_files_prompt(context, files)
+        else:
+            prompt = self.build_prompt(context)
         code = await self.llm.ask(prompt, stream_callback=stream_callback)
         return code
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""Per-user admission control and concurrency quotas for generation tasks."""
+
+import json
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from mgx_backend.database import get_async_db_manager, UserModel
+
+
+class TierLimits(BaseModel):
+    """Admission limits of a user tier."""
+    max_running: int = 1  # Tasks running at once; further tasks wait in the queue
+    max_queued: int = 2  # Tasks waiting beyond max_running before requests are rejected
+    max_spend: float = 10.0  # Dollars per spend window
+    spend_window_seconds: int = 24 * 3600
+    weight: float = 1.0  # Share of workers and LLM tokens relative to other users (see scheduler.py)
+
+
+DEFAULT_TIER_LIMITS: Dict[str, TierLimits] = {
+    "free": TierLimits(max_running=1, max_queued=2, max_spend=10.0),
+    "pro": TierLimits(max_running=3, max_queued=10, max_spend=100.0, weight=2.0),
+    "admin": TierLimits(max_running=10, max_queued=100, max_spend=1000.0, weight=4.0),
+}
+
+# Retry-After for requests rejected because the queue is full
+QUEUE_FULL_RETRY_AFTER = int(os.getenv("MGX_QUEUE_FULL_RETRY_AFTER", "60"))
+
+
+def load_tier_limits() -> Dict[str, TierLimits]:
+    """Load tier limits, applying overrides from the MGX_TIER_LIMITS env var.
+    
+    MGX_TIER_LIMITS is JSON such as {"free": {"max_running": 2}, "team": {...}};
+    fields not given keep their defaults.
+    """
+    limits = dict(DEFAULT_TIER_LIMITS)
+    overrides = os.getenv("MGX_TIER_LIMITS")
+    if overrides:
+        for tier, values in json.loads(overrides).items():
+            base = limits.get(tier, TierLimits())
+            limits[tier] = base.model_copy(update=values)
+    return limits
+
+
+tier_limits = load_tier_limits()
+
+
+def get_tier_limits(tier: Optional[str]) -> TierLimits:
+    """Get limits of a tier, falling back to the free tier."""
+    return tier_limits.get(tier or "free", tier_limits["free"])
+
+
+async def admit(user: UserModel, db=None) -> bool:
+    """Check whether a user may start another task.
+    
+    The check alone does not reserve a slot; create_admitted_task() checks
+    and creates the task in one transaction.
+    
+    Args:
+        user: User starting the task
+        db: Database manager or unit of work to query (defaults to the async manager)
+    
+    Returns:
+        True if the task will wait in the queue because the user is at their
+        running limit, False if it can run as soon as a worker is free
+    
+    Raises:
+        HTTPException: 429 with Retry-After when the spend or queue limit is reached
+    """
+    limits = get_tier_limits(user.tier)
+    now = datetime.utcnow()
+    window = timedelta(seconds=limits.spend_window_seconds)
+    usage = await (db or get_async_db_manager()).get_user_task_usage(user.id, since=now - window)
+    
+    if usage["spend"] >= limits.max_spend:
+        if usage["oldest_spend_at"]:
+            # Retry once the oldest spend in the window has expired
+            retry_after = (usage["oldest_spend_at"] + window - now).total_seconds()
+        else:
+            # Nothing spent to expire (a tier with no spend allowance): a full window
+            retry_after = window.total_seconds()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Spend limit of ${limits.max_spend:.2f} per {limits.spend_window_seconds // 3600}h reached",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+    
+    active = usage["running"] + usage["queued"]
+    if active >= limits.max_running + limits.max_queued:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many tasks in progress ({usage['running']} running, {usage['queued']} queued)",
+            headers={"Retry-After": str(QUEUE_FULL_RETRY_AFTER)}
+        )
+    
+    return active >= limits.max_running
+
+
+async def create_admitted_task(user: UserModel, task_id: str, idea: str, investment: float, **fields) -> bool:
+    """Admit a user's task and create it, atomically.
+    
+    The user's usage is counted and the task inserted in one transaction
+    holding the user's lock, so concurrent requests cannot all pass the
+    check before any of their tasks exists.
+    
+    Args:
+        user: User starting the task
+        task_id, idea, investment, **fields: Arguments of DatabaseManager.create_task
+    
+    Returns:
+        Whether the task waits in the queue, as from admit()
+    
+    Raises:
+        HTTPException: 429 with Retry-After when the spend or queue limit is reached
+    """
+    async with get_async_db_manager().transaction() as uow:
+        await uow.lock_user(user.id)
+        queued = await admit(user, uow)
+        await uow.create_task(task_id, idea, investment, user_id=user.id, **fields)
+    return queued
+
+
+async def saturated_users() -> List[int]:
+    """Get ids of users at their running limit, whose queued tasks must wait."""
+    running = await get_async_db_manager().count_running_tasks_by_user()
+    return [
+        user_id
+        for user_id, (count, tier) in running.items()
+        if count >= get_tier_limits(tier).max_running
+    ]
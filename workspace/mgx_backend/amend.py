@@ -0,0 +1,192 @@
+"""Incremental regeneration of a completed project from a change request."""
+
+import difflib
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from mgx_backend.actions import ReviseDesign, WriteCode
+from mgx_backend.cost_manager import current_action
+from mgx_backend.llm import BaseLLM
+from mgx_backend.project_repo import ProjectRepo
+
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+# Names defined in source files (functions, classes, variables) that a design section may refer to
+IDENTIFIER_PATTERN = re.compile(
+    r'\b(?:class|def|function|const|let|var|interface|type|struct|func|fn)\s+([A-Za-z_][A-Za-z0-9_]{3,})'
+)
+
+
+def split_sections(markdown: str) -> Dict[str, str]:
+    """Split a markdown document into sections keyed by heading path.
+    
+    Each section holds only its own body, not its subsections, so a change
+    deep in the document marks just that heading as changed. Text before the
+    first heading is keyed by "".
+    """
+    sections: Dict[str, List[str]] = {"": []}
+    path: List[str] = []
+    key = ""
+    in_code_block = False
+    
+    for line in markdown.split('\n'):
+        if line.strip().startswith('```'):
+            in_code_block = not in_code_block
+        match = None if in_code_block else HEADING_PATTERN.match(line)
+        if match:
+            level = len(match.group(1))
+            path = path[:level - 1] + [match.group(2)]
+            key = " / ".join(path)
+            # Disambiguate repeated headings
+            base_key, n = key, 2
+            while key in sections:
+                key = f"{base_key} ({n})"
+                n += 1
+            sections[key] = []
+        else:
+            sections[key].append(line)
+    
+    return {k: '\n'.join(v).strip() for k, v in sections.items() if k or '\n'.join(v).strip()}
+
+
+def _normalize(text: Optional[str]) -> str:
+    """Collapse whitespace so reflowed text does not count as a change."""
+    return " ".join((text or "").split())
+
+
+def diff_sections(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, str]:
+    """Get sections that were added, changed or removed.
+    
+    Returns:
+        {heading path: section text}, using the revised text for added/changed
+        sections and the old text for removed ones
+    """
+    changed = {}
+    for key, text in new.items():
+        if _normalize(old.get(key)) != _normalize(text):
+            changed[key] = text
+    for key, text in old.items():
+        if key not in new:
+            changed[key] = text
+    return changed
+
+
+def _file_names(path: str, content: str) -> set:
+    """Names by which a design section can refer to a file."""
+    names = {path, Path(path).name}
+    for identifier in IDENTIFIER_PATTERN.findall(content or ""):
+        # Only code-looking names (camelCase, PascalCase, snake_case); plain words like "update" match too much prose
+        if re.search(r'[A-Z_]', identifier[1:]):
+            names.add(identifier)
+    return names
+
+
+def map_sections_to_files(sections: Dict[str, str], files: Dict[str, str]) -> List[str]:
+    """Map changed design sections to the project files they affect.
+    
+    A file is affected when a changed section mentions its path, its file name
+    or one of the identifiers it defines.
+    
+    Args:
+        sections: {heading path: section text} of changed sections
+        files: {path relative to src/: content} of saved project files
+    """
+    text = "\n".join(f"{key}\n{body}" for key, body in sections.items())
+    affected = []
+    for path, content in files.items():
+        for name in _file_names(path, content):
+            if re.search(rf'(?<![\w.-]){re.escape(name)}(?!\w)', text):
+                affected.append(path)
+                break
+    return affected
+
+
+def make_patch(old_files: Dict[str, str], new_files: Dict[str, str], prefix: str = "") -> str:
+    """Build a unified diff between two versions of a set of files."""
+    chunks = []
+    for path in sorted(new_files):
+        chunks.extend(difflib.unified_diff(
+            (old_files.get(path) or "").splitlines(keepends=True),
+            new_files[path].splitlines(keepends=True),
+            fromfile=f"a/{prefix}{path}",
+            tofile=f"b/{prefix}{path}"
+        ))
+    return "".join(line if line.endswith('\n') else line + '\n' for line in chunks)
+
+
+async def amend_project(
+    project_path: str,
+    change_request: str,
+    llm: BaseLLM,
+    progress_callback: Optional[callable] = None
+) -> dict:
+    """Apply a change request to a generated project, regenerating only affected files.
+    
+    Args:
+        project_path: Path of a completed project (with docs/system_design saved)
+        change_request: Description of the requested change
+        llm: LLM used for design revision and code regeneration
+        progress_callback: Optional async callback(update: dict) for progress updates
+    
+    Returns:
+        dict with changed_sections, affected_files and a unified diff patch
+    """
+    async def report(stage: str, **extra):
+        if progress_callback:
+            await progress_callback({"type": "status", "stage": stage, **extra})
+    
+    repo = ProjectRepo(project_path)
+    old_design = await repo.docs.system_design.read("system_design.md")
+    if not old_design:
+        raise ValueError(f"No system design saved for project: {project_path}")
+    
+    # 1. Revise the design and find which sections changed
+    await report("Architect: Revising system design...", progress=20)
+    revise = ReviseDesign()
+    revise.set_llm(llm)
+    current_action.set(revise.name)
+    new_design = await revise.run(old_design, change_request=change_request)
+    changed = diff_sections(split_sections(old_design), split_sections(new_design))
+    print(f"📝 [Amend] Changed design sections: {list(changed)}")
+    
+    # 2. Map changed sections to saved source files
+    await report("Mapping design changes to files...", progress=50)
+    files = {}
+    for path in repo.srcs.all_files:
+        content = await repo.srcs.read(path)
+        if content is not None:
+            files[path] = content
+    affected = map_sections_to_files(changed, files)
+    print(f"📁 [Amend] Affected files: {affected}")
+    
+    # 3. Regenerate only the affected files
+    updated_files: Dict[str, str] = {}
+    if affected:
+        await report(f"Engineer: Regenerating {len(affected)} file(s)...", progress=60)
+        write_code = WriteCode()
+        write_code.set_llm(llm)
+        current_action.set(write_code.name)
+        changed_text = "\n\n".join(f"## {key}\n{body}" if key else body for key, body in changed.items())
+        code = await write_code.run(changed_text, files={path: files[path] for path in affected})
+        for path, content in repo._parse_code_files(code).items():
+            path = repo.normalize_code_path(path)
+            if path in affected:
+                updated_files[path] = content
+    
+    patch = make_patch(
+        {"system_design.md": old_design}, {"system_design.md": new_design}, prefix="docs/system_design/"
+    ) + make_patch(files, updated_files, prefix="src/")
+    
+    # 4. Save revised design and regenerated files
+    await report("Saving amended files...", progress=90)
+    await repo.save_design(new_design)
+    for path, content in updated_files.items():
+        await repo.srcs.save(path, content)
+    
+    return {
+        "changed_sections": list(changed),
+        "affected_files": affected,
+        "updated_files": sorted(updated_files),
+        "patch": patch
+    }
@@ -5,31 +5,43 @@ import os
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks, Depends
+from typing import Callable, Literal, Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
 import shutil
-import json
 import subprocess
-import base64
 import io
 import zipfile
 
-from mgx_backend.software_company import generate_repo
 from mgx_backend.config import Config
 from mgx_backend.context import Context
 from mgx_backend.team import Team
 from mgx_backend.roles import ProductManager, Architect, Engineer
 from mgx_backend.project_repo import ProjectRepo
+from mgx_backend.message import Message
+from mgx_backend.amend import amend_project
+from mgx_backend.task_queue import WorkerPool
+from mgx_backend.worker_process import ProcessExecutor
+from mgx_backend.admission import create_admitted_task, saturated_users
+from mgx_backend.scheduler import FairScheduler, llm_rate_limiter
+from mgx_backend.event_bus import create_event_bus
+from mgx_backend.subscriptions import Subscriber, SSESubscriber, SubscriberRegistry, format_sse
+from mgx_backend.event_log import TERMINAL_EVENTS, EventLog
+from mgx_backend.loop_monitor import LoopLagMonitor
+from mgx_backend.task_state import TaskStateCache
+from mgx_backend.cost_ledger import CostLedger
+from mgx_backend.task_locator import TaskLocator
 from mgx_backend.database import (
-    get_db_manager, UserRegister, UserLogin, UserUpdate, UserResponse,
-    ConversationCreate, ConversationUpdate, ConversationResponse, UserModel, TaskModel
+    get_async_db_manager, UserRegister, UserLogin, UserUpdate, UserResponse,
+    ConversationCreate, ConversationUpdate, ConversationMessagesAppend, ConversationResponse, ConversationSummary, UserModel, TaskModel,
+    encode_cursor, decode_cursor
 )
 from mgx_backend.auth import (
-    get_password_hash, verify_password, create_access_token,
-    authenticate_user, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+    password_hasher, create_access_token, user_claims, update_user, user_cache,
+    authenticate_user, get_current_user, get_token_user, ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from datetime import timedelta
 
@@ -53,16 +65,30 @@ app.add_middleware(
     max_age=3600,
 )
 
-# WebSocket connections (must stay in memory, cannot be serialized)
-websocket_connections: Dict[str, WebSocket] = {}
-# Message queue for messages sent before WebSocket connection is established (temporary, can stay in memory)
-pending_messages: Dict[str, list] = {}
+# WebSocket subscribers of each task on this node (must stay in memory, cannot be serialized)
+subscribers = SubscriberRegistry()
+# Numbered progress events of each task, replayed to clients that connect late or reconnect
+event_log = EventLog()
+# Progress fields of tasks, written to the database behind the events
+task_state = TaskStateCache()
+# Per-call LLM costs, inserted in batches with their rollups
+cost_ledger = CostLedger()
+# Project paths of completed tasks, for file listing and downloads
+task_locator = TaskLocator()
+# Set in worker processes to hand progress to the API process instead of local WebSockets
+progress_forwarder: Optional[Callable[[str, dict], None]] = None
 
 
 class GenerateRequest(BaseModel):
     idea: str
     investment: float = 5.0
     n_round: int = 5
+    priority: Literal["interactive", "batch"] = "interactive"
+
+
+class AmendRequest(BaseModel):
+    change_request: str
+    investment: float = 2.0
 
 
 class GitHubUploadRequest(BaseModel):
@@ -75,7 +101,7 @@ class GitHubUploadRequest(BaseModel):
 
 class TaskStatus(BaseModel):
     task_id: str
-    status: str  # pending, running, completed, failed
+    status: str  # pending, running, completed, failed, cancelled
     progress: int  # 0-100
     current_stage: str
     cost: float
@@ -85,13 +111,9 @@ class TaskStatus(BaseModel):
     updated_at: str
 
 
-def get_task_dict(task_id: str) -> dict:
-    """Get task as dictionary from database."""
-    db = get_db_manager()
-    task = db.get_task(task_id)
-    if not task:
-        return None
-    return {
+def format_task(task, include_result: bool = True) -> dict:
+    """Task row (or listing projection) as returned by the API, including progress not written yet."""
+    task_dict = {
         "task_id": task.task_id,
         "status": task.status,
         "progress": task.progress,
@@ -100,16 +122,30 @@ def get_task_dict(task_id: str) -> dict:
         "idea": task.idea,
         "investment": task.investment,
         "n_round": task.n_round,
-        "result": task.result,
         "error": task.error,
+        "kind": task.kind or "generate",
+        "parent_task_id": task.parent_task_id,
+        "user_id": task.user_id,
+        "priority_class": task.priority_class or "interactive",
         "created_at": task.created_at.isoformat() if task.created_at else None,
         "updated_at": task.updated_at.isoformat() if task.updated_at else None
     }
+    if include_result:
+        task_dict["result"] = task.result
+    task_dict.update(task_state.pending(task.task_id))
+    return task_dict
+
+async def get_task_dict(task_id: str) -> dict:
+    """Get task as dictionary from database, including progress not written yet."""
+    db = get_async_db_manager()
+    task = await db.get_task(task_id)
+    if not task:
+        return None
+    return format_task(task)
 
 async def send_progress(task_id: str, data: dict):
     """Send progress update via WebSocket and update database."""
-    # Update task in database if status/progress/cost changed
-    db = get_db_manager()
+    # Update task if status/progress/cost changed (progress is written behind, transitions right away)
     update_data = {}
     if "status" in data:
         update_data["status"] = data["status"]
@@ -125,27 +161,137 @@ async def send_progress(task_id: str, data: dict):
         update_data["result"] = data["result"]
     
     if update_data:
-        db.update_task(task_id, **update_data)
+        await task_state.update(task_id, **update_data)
     
-    # Send via WebSocket
-    if task_id in websocket_connections:
-        try:
-            await websocket_connections[task_id].send_json(data)
-        except:
-            pass
+    # Number the event so clients can resume after it
+    event = await event_log.append_async(task_id, data)
+    if progress_forwarder:
+        progress_forwarder(task_id, event)
     else:
-        # WebSocket not yet connected, queue the message
-        if task_id not in pending_messages:
-            pending_messages[task_id] = []
-        pending_messages[task_id].append(data)
-        print(f"📬 [API] WebSocket not connected for {task_id}, queued message. Queue size: {len(pending_messages[task_id])}")
+        await event_bus.publish(task_id, event)
+
+
+async def deliver_progress(task_id: str, data: dict):
+    """Send a progress update to the task's WebSocket subscribers on this node.
+    
+    Clients connecting later get it replayed from the event log.
+    """
+    event_log.record(task_id, data)
+    if subscribers.has_subscribers(task_id):
+        await subscribers.broadcast(task_id, data)
+
+
+# Progress events go through the bus, so a WebSocket on any node receives them (MGX_EVENT_BUS)
+event_bus = create_event_bus(deliver_progress)
+
+
+async def mark_cancelled(task_id: str, cost: float):
+    """Record a cancelled task together with the cost spent before cancellation."""
+    db = get_async_db_manager()
+    await db.update_task(task_id, status="cancelled", current_stage="Cancelled", cost=cost)
+    print(f"🛑 [API] Task {task_id} cancelled, partial cost: ${cost:.4f}")
+    await send_progress(task_id, {
+        "type": "cancelled",
+        "status": "cancelled",
+        "stage": "Cancelled",
+        "cost": cost
+    })
+
+
+async def load_checkpoint(task_id: str):
+    """Load checkpointed team messages for a task.
+    
+    Returns:
+        (history, queue_state, last_record) or None if nothing was checkpointed
+    """
+    db = get_async_db_manager()
+    records = await db.list_task_messages(task_id)
+    if not records:
+        return None
+    history = [
+        Message(
+            content=record.content,
+            role=record.role or "user",
+            cause_by=record.cause_by or "",
+            sent_from=record.sent_from or "",
+            send_to=record.send_to or "",
+            metadata=record.extra_data or {}
+        )
+        for record in records
+    ]
+    return history, records[-1].queue_state or {}, records[-1]
+
+
+async def save_task_project(uow, task_id: str, idea: str, investment: float, user_id: Optional[int], ctx: Context):
+    """Save the project of a completed generation within a unit of work.
+    
+    The project is owned by the user who started the task, else by the user of
+    the conversation that references the task, else by the first user. Its
+    status, path and cost, and the task's cost records, are written with it.
+    
+    Returns:
+        The saved project, or None if there is no user to own it
+    """
+    from mgx_backend.database import ProjectCreate
+    
+    if not user_id:
+        task = await uow.get_task(task_id)
+        user_id = task.user_id if task else None
+    
+    if not user_id:
+        conversation = await uow.get_conversation_by_task_id(task_id)
+        if conversation:
+            user_id = conversation.user_id
+            print(f"📁 [API] Found user_id from conversation: {user_id}")
+    
+    if not user_id:
+        users = await uow.list_users(limit=1)
+        if not users:
+            print(f"⚠️ [API] No users found in database, cannot create project")
+            return None
+        user_id = users[0].id
+        print(f"⚠️ [API] No user_id found, using default user: {user_id}")
+    
+    project_name = f"Project {task_id[:8]}"
+    project_description = idea[:200] if idea else f"Generated project {task_id[:8]}"
+    print(f"💾 [API] Creating project in database: {project_name}, path: {ctx.project_path}, user_id: {user_id}")
+    
+    project = await uow.create_project(
+        ProjectCreate(
+            name=project_name,
+            description=project_description,
+            idea=idea,
+            investment=investment
+        ),
+        user_id=user_id,
+        task_id=task_id
+    )
+    await uow.update_project_status(project.id, "completed", project_path=str(ctx.project_path))
+    await uow.update_project_cost(project.id, ctx.cost_manager.total_cost)
+    await uow.assign_task_costs(task_id, project.id)
+    return project
 
 
-async def run_generation_task(task_id: str, idea: str, investment: float, n_round: int):
-    """Run the generation task in background."""
-    db = get_db_manager()
+async def run_generation_task(
+    task_id: str,
+    idea: str,
+    investment: float,
+    n_round: int,
+    resume: bool = False,
+    priority_class: str = "interactive",
+    user_id: Optional[int] = None
+):
+    """Run the generation task in background.
+    
+    With resume=True the team is restored from the task's checkpointed messages,
+    so stages that already completed are not run (or billed) again. LLM tokens
+    are drawn from the process-wide limiter under the task's priority class, and
+    each call is recorded in the cost ledger under the task and user.
+    """
+    db = get_async_db_manager()
+    ctx = None
     try:
-        db.update_task(task_id, status="running", current_stage="Initializing")
+        await db.update_task(task_id, status="running", current_stage="Initializing")
         
         await send_progress(task_id, {
             "type": "status",
@@ -159,11 +305,43 @@ async def run_generation_task(task_id: str, idea: str, investment: float, n_roun
         config = Config.default()
         config.update_project(project_name=f"project_{task_id}")
         ctx = Context(config=config)
+        ctx.kwargs.set("rate_limiter", llm_rate_limiter)
+        ctx.kwargs.set("priority_class", priority_class)
+        ctx.cost_manager.task_id = task_id
+        ctx.cost_manager.user_id = user_id
+        ctx.cost_manager.ledger = cost_ledger
         
         team = Team(context=ctx)
         team.hire([ProductManager(), Architect(), Engineer()])
         team.invest(investment)
         
+        checkpoint = await load_checkpoint(task_id) if resume else None
+        if checkpoint:
+            history, queue_state, last_record = checkpoint
+            team.resume(history, queue_state)
+            ctx.cost_manager.total_cost = last_record.cost or 0.0
+            ctx.cost_manager.total_prompt_tokens = last_record.prompt_tokens or 0
+            ctx.cost_manager.total_completion_tokens = last_record.completion_tokens or 0
+            print(f"♻️  [API] Resuming task {task_id} from message {last_record.seq} ({last_record.cause_by})")
+            await send_progress(task_id, {
+                "type": "status",
+                "stage": f"Resuming after {last_record.cause_by}",
+                "progress": 20,
+                "cost": ctx.cost_manager.total_cost
+            })
+        
+        async def checkpoint_callback(seq: int, message: Message, queue_state: dict):
+            """Persist each published message so completed stages survive restarts."""
+            await db.save_task_message(
+                task_id,
+                seq,
+                message.model_dump(mode="json"),
+                queue_state,
+                cost=ctx.cost_manager.total_cost,
+                prompt_tokens=ctx.cost_manager.total_prompt_tokens,
+                completion_tokens=ctx.cost_manager.total_completion_tokens
+            )
+        
         await send_progress(task_id, {
             "type": "status",
             "stage": "ProductManager working",
@@ -220,7 +398,7 @@ async def run_generation_task(task_id: str, idea: str, investment: float, n_roun
                 else:
                     progress = 75
             else:
-                task_dict = get_task_dict(task_id)
+                task_dict = await get_task_dict(task_id)
                 progress = task_dict.get("progress", 20) if task_dict else 20
             
             # Progress updated via send_progress
@@ -262,7 +440,12 @@ async def run_generation_task(task_id: str, idea: str, investment: float, n_roun
             "progress": 20,
             "cost": ctx.cost_manager.total_cost
         })
-        history = await team.run(n_round=n_round, idea=idea, progress_callback=progress_callback)
+        history = await team.run(
+            n_round=n_round,
+            idea="" if checkpoint else idea,
+            progress_callback=progress_callback,
+            checkpoint_callback=checkpoint_callback
+        )
         
         # Track final progress through completed messages
         for i, msg in enumerate(history):
@@ -327,7 +510,7 @@ async def run_generation_task(task_id: str, idea: str, investment: float, n_roun
                             content = await repo.srcs.read(filepath)
                             if content:
                                 # Get current task status
-                                task_dict = get_task_dict(task_id)
+                                task_dict = await get_task_dict(task_id)
                                 current_progress = task_dict.get("progress", 90) if task_dict else 90
                                 current_stage = task_dict.get("current_stage", "Saving project files...") if task_dict else "Saving project files..."
                                 
@@ -386,136 +569,147 @@ async def run_generation_task(task_id: str, idea: str, investment: float, n_roun
             "cost": ctx.cost_manager.total_cost,
             "tokens": ctx.cost_manager.total_tokens
         }
-        db.update_task(
-            task_id,
-            status="completed",
-            progress=100,
-            current_stage="Completed",
-            cost=ctx.cost_manager.total_cost,
-            result=result
-        )
+        completion = {
+            "status": "completed",
+            "progress": 100,
+            "current_stage": "Completed",
+            "cost": ctx.cost_manager.total_cost,
+            "result": result
+        }
         
-        # Save project to database for persistence
+        # Complete the task and save its project in one unit of work
+        await cost_ledger.flush()
+        project = None
         try:
-            db = get_db_manager()
-            from mgx_backend.database import ProjectCreate
-            
-            # Get task to find user_id if available
-            task_dict = get_task_dict(task_id)
-            user_id = None
-            
-            # Try to get user_id from task's result or extra_data
-            if task_dict:
-                if task_dict.get("result") and isinstance(task_dict["result"], dict):
-                    user_id = task_dict["result"].get("user_id")
-                # Also check if task has extra_data with user_id
-                if not user_id and task_dict.get("extra_data"):
-                    if isinstance(task_dict["extra_data"], dict):
-                        user_id = task_dict["extra_data"].get("user_id")
-            
-            # If no user_id in task, try to find from conversations that reference this task_id
-            if not user_id:
-                from mgx_backend.database import ConversationHistoryModel, get_db
-                db_session = next(get_db())
-                try:
-                    # Find conversation with this task_id in extra_data
-                    all_conversations = db_session.query(ConversationHistoryModel).all()
-                    for conv in all_conversations:
-                        if conv.extra_data and isinstance(conv.extra_data, dict):
-                            if conv.extra_data.get("task_id") == task_id:
-                                user_id = conv.user_id
-                                print(f"📁 [API] Found user_id from conversation: {user_id}")
-                                break
-                finally:
-                    db_session.close()
-            
-            # If still no user_id, try to find a default user (first user in database)
-            if not user_id:
-                users = db.list_users(limit=1)
-                if users:
-                    user_id = users[0].id
-                    print(f"⚠️ [API] No user_id found, using default user: {user_id}")
-                else:
-                    print(f"⚠️ [API] No users found in database, cannot create project")
-                    user_id = None
-            
-            if user_id:
-                project_name = f"Project {task_id[:8]}"
-                project_description = idea[:200] if idea else f"Generated project {task_id[:8]}"
-                
-                print(f"💾 [API] Creating project in database: {project_name}, path: {ctx.project_path}, user_id: {user_id}")
-                
-                # Create project
-                project = db.create_project(
-                    ProjectCreate(
-                        name=project_name,
-                        description=project_description,
-                        idea=idea,
-                        investment=investment
-                    ),
-                    user_id=user_id
-                )
-                
-                # Update project status and path
-                db.update_project_status(
-                    project.id,
-                    "completed",
-                    project_path=str(ctx.project_path)
-                )
-                
-                # Update project cost
-                db.update_project_cost(
-                    project.id,
-                    ctx.cost_manager.total_cost
-                )
-                
-                # Store project_id and task_id in extra_data for easy lookup
-                from mgx_backend.database import ProjectModel, get_db
-                db_session = next(get_db())
-                try:
-                    db_project = db_session.query(ProjectModel).filter(ProjectModel.id == project.id).first()
-                    if db_project:
-                        extra_data = db_project.extra_data or {}
-                        extra_data["task_id"] = task_id
-                        db_project.extra_data = extra_data
-                        db_session.commit()
-                        print(f"✅ [API] Project saved successfully: project_id={project.id}, task_id={task_id}")
-                finally:
-                    db_session.close()
-                
-                # Upload project files to Supabase Storage if configured
-                try:
-                    supabase_url = os.getenv("SUPABASE_URL")
-                    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
-                    
-                    if supabase_url and supabase_key:
-                        print(f"📤 [API] Uploading project to Supabase Storage: {task_id}")
-                        await upload_project_to_supabase(task_id, ctx.project_path, project.id)
-                    else:
-                        print(f"⚠️ [API] Supabase Storage not configured (SUPABASE_URL or SUPABASE_KEY not set)")
-                except Exception as e:
-                    print(f"⚠️ [API] Failed to upload project to Supabase Storage: {e}")
-                    import traceback
-                    traceback.print_exc()
-            else:
-                print(f"⚠️ [API] Cannot create project: no user_id available")
-            
+            async with db.transaction() as uow:
+                await uow.update_task(task_id, **completion)
+                project = await save_task_project(uow, task_id, idea, investment, user_id, ctx)
+            if project:
+                print(f"✅ [API] Project saved successfully: project_id={project.id}, task_id={task_id}")
         except Exception as e:
             print(f"⚠️ [API] Failed to save project to database: {e}")
             import traceback
             traceback.print_exc()
+            project = None
+            await db.update_task(task_id, **completion)
+        
+        # Upload project files to Supabase Storage if configured
+        if project:
+            try:
+                supabase_url = os.getenv("SUPABASE_URL")
+                supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+                
+                if supabase_url and supabase_key:
+                    print(f"📤 [API] Uploading project to Supabase Storage: {task_id}")
+                    await upload_project_to_supabase(task_id, ctx.project_path, project.id)
+                else:
+                    print(f"⚠️ [API] Supabase Storage not configured (SUPABASE_URL or SUPABASE_KEY not set)")
+            except Exception as e:
+                print(f"⚠️ [API] Failed to upload project to Supabase Storage: {e}")
+                import traceback
+                traceback.print_exc()
+        
+        await send_progress(task_id, {
+            "type": "complete",
+            "status": "completed",
+            "progress": 100,
+            "cost": completion["cost"],
+            "result": result
+        })
+        
+    except asyncio.CancelledError:
+        # Shutdown or a lost lease also cancels the run; the task then stays queued
+        if worker_pool.is_cancel_requested(task_id):
+            await mark_cancelled(task_id, ctx.cost_manager.total_cost if ctx else 0.0)
+        raise
+    except Exception as e:
+        await db.update_task(task_id, status="failed", error=str(e))
+        
+        await send_progress(task_id, {
+            "type": "error",
+            "status": "failed",
+            "error": str(e)
+        })
+
+
+async def run_amend_task(
+    task_id: str,
+    source_task_id: str,
+    change_request: str,
+    investment: float,
+    priority_class: str = "interactive",
+    user_id: Optional[int] = None
+):
+    """Run an amendment of a completed task's project in background."""
+    db = get_async_db_manager()
+    ctx = None
+    try:
+        source = await get_task_dict(source_task_id)
+        if not source or not (source.get("result") or {}).get("project_path"):
+            raise ValueError(f"Project of task {source_task_id} not found")
+        project_path = source["result"]["project_path"]
+        
+        await db.update_task(task_id, status="running", current_stage="Initializing")
+        
+        project = await db.get_project_by_task_id(source_task_id)
         
-        task_dict = get_task_dict(task_id)
+        ctx = Context(config=Config.default())
+        ctx.cost_manager.max_budget = investment
+        ctx.kwargs.set("rate_limiter", llm_rate_limiter)
+        ctx.kwargs.set("priority_class", priority_class)
+        ctx.cost_manager.task_id = task_id
+        ctx.cost_manager.user_id = user_id
+        ctx.cost_manager.project_id = project.id if project else None
+        ctx.cost_manager.ledger = cost_ledger
+        
+        async def progress_callback(update: dict):
+            """Forward amendment progress with the running cost."""
+            await send_progress(task_id, {**update, "cost": ctx.cost_manager.total_cost})
+        
+        amendment = await amend_project(project_path, change_request, ctx.llm(), progress_callback)
+        
+        # Push regenerated files to the frontend like a normal generation does
+        repo = ProjectRepo(project_path)
+        for filepath in amendment["updated_files"]:
+            content = await repo.srcs.read(filepath)
+            await send_progress(task_id, {
+                "type": "file_complete",
+                "filepath": f"src/{filepath}",
+                "content": content,
+                "cost": ctx.cost_manager.total_cost,
+                "message": f"File updated: src/{filepath}"
+            })
+        
+        result = {
+            "project_path": project_path,
+            "amends": source_task_id,
+            **amendment,
+            "cost": ctx.cost_manager.total_cost,
+            "tokens": ctx.cost_manager.total_tokens
+        }
+        await db.update_task(
+            task_id,
+            status="completed",
+            progress=100,
+            current_stage="Completed",
+            cost=ctx.cost_manager.total_cost,
+            result=result
+        )
         await send_progress(task_id, {
             "type": "complete",
             "status": "completed",
             "progress": 100,
-            "cost": task_dict["cost"] if task_dict else ctx.cost_manager.total_cost,
+            "cost": ctx.cost_manager.total_cost,
             "result": result
         })
         
+    except asyncio.CancelledError:
+        # Shutdown or a lost lease also cancels the run; the task then stays queued
+        if worker_pool.is_cancel_requested(task_id):
+            await mark_cancelled(task_id, ctx.cost_manager.total_cost if ctx else 0.0)
+        raise
     except Exception as e:
-        db.update_task(task_id, status="failed", error=str(e))
+        await db.update_task(task_id, status="failed", error=str(e))
         
         await send_progress(task_id, {
             "type": "error",
@@ -524,6 +718,70 @@ async def run_generation_task(task_id: str, idea: str, investment: float, n_roun
         })
 
 
+async def execute_task(task: TaskModel):
+    """Run a task claimed from the queue.
+    
+    Generations always resume from their checkpoint, so a task reclaimed after
+    a crash or a lost lease skips the stages it already completed.
+    """
+    priority_class = task.priority_class or "interactive"
+    if task.kind == "amend":
+        await run_amend_task(
+            task.task_id, task.parent_task_id, task.idea, task.investment,
+            priority_class=priority_class, user_id=task.user_id
+        )
+    else:
+        await run_generation_task(
+            task.task_id, task.idea, task.investment, task.n_round,
+            resume=True, priority_class=priority_class, user_id=task.user_id
+        )
+
+
+# MGX_WORKER_MODE=process runs tasks in worker processes instead of this event loop
+process_executor = ProcessExecutor() if os.getenv("MGX_WORKER_MODE", "async") == "process" else None
+
+
+async def execute_task_in_process(task: TaskModel):
+    """Run a task claimed from the queue in a worker process."""
+    await process_executor.run(task, worker_pool.is_cancel_requested)
+
+
+# Samples event loop lag, reported with the queue stats
+loop_monitor = LoopLagMonitor()
+
+# Bounded pool of workers claiming queued tasks (size from MGX_WORKERS, or one per worker process)
+worker_pool = WorkerPool(
+    execute_task_in_process if process_executor else execute_task,
+    concurrency=process_executor.processes if process_executor else None,
+    saturated_users=saturated_users,
+    scheduler=FairScheduler()
+)
+
+
+@app.on_event("startup")
+async def start_worker_pool():
+    """Start queue workers; tasks left by a previous process are reclaimed once their leases expire."""
+    loop_monitor.start()
+    await event_bus.start()
+    if process_executor:
+        await process_executor.start(event_bus.publish)
+    await worker_pool.start()
+
+
+@app.on_event("shutdown")
+async def stop_worker_pool():
+    """Stop queue workers, putting their running tasks back in the queue."""
+    await worker_pool.stop()
+    if process_executor:
+        await process_executor.stop()
+    await event_bus.stop()
+    await task_state.stop()
+    await cost_ledger.stop()
+    await get_async_db_manager().close()
+    await loop_monitor.stop()
+    password_hasher.shutdown()
+
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -535,76 +793,152 @@ async def root():
 
 
 @app.post("/api/generate")
-async def generate(request: GenerateRequest, background_tasks: BackgroundTasks):
-    """Start a new generation task."""
+async def generate(request: GenerateRequest, current_user: UserModel = Depends(get_current_user)):
+    """Start a new generation task (subject to the user's tier limits)."""
     task_id = str(uuid.uuid4())
     
-    # Create task in database
-    db = get_db_manager()
-    db.create_task(task_id, request.idea, request.investment, request.n_round)
-    
-    # Start background task
-    background_tasks.add_task(
-        run_generation_task,
+    # Create task in database, in the same transaction as the admission check
+    queued = await create_admitted_task(
+        current_user,
         task_id,
         request.idea,
         request.investment,
-        request.n_round
+        n_round=request.n_round,
+        priority_class=request.priority
     )
     
-    return {"task_id": task_id, "status": "pending"}
+    # Queued tasks are picked up by the worker pool
+    worker_pool.notify()
+    
+    return {"task_id": task_id, "status": "pending", "queued": queued}
 
 
 @app.get("/api/status/{task_id}")
 async def get_status(task_id: str):
     """Get task status."""
-    task_dict = get_task_dict(task_id)
+    task_dict = await get_task_dict(task_id)
     if not task_dict:
         raise HTTPException(status_code=404, detail="Task not found")
     
     return task_dict
 
 
+async def subscribe(subscriber: Subscriber, since: int = 0):
+    """Bring a new subscriber up to date and register it for live events.
+    
+    The subscriber gets the task's current status, then the events after
+    `since` from the event log. If too many were missed, it gets a
+    {"type": "snapshot"} marker followed by the compacted events describing
+    the task's current state instead.
+    """
+    task_id = subscriber.task_id
+    subscriber.last_seq = since
+    
+    # Send initial status (format matches frontend expectations)
+    task_dict = await get_task_dict(task_id)
+    if task_dict:
+        await subscriber.send({
+            "type": "status",
+            "status": task_dict.get("status", "pending"),
+            "progress": task_dict.get("progress", 0),
+            "stage": task_dict.get("current_stage", "Queued"),
+            "cost": task_dict.get("cost", 0.0),
+            "result": task_dict.get("result"),
+            "error": task_dict.get("error")
+        })
+    
+    # Replay missed events; events logged meanwhile are picked up by the
+    # next round, until the subscriber is registered for live delivery
+    backlog = await event_log.replay_async(task_id, since)
+    if backlog is None:
+        print(f"📬 [API] Subscriber of {task_id} missed too many events, sending snapshot")
+        backlog = await event_log.snapshot_async(task_id)
+        await subscriber.send({"type": "snapshot", "seq": backlog[-1]["seq"] if backlog else 0})
+    while backlog:
+        print(f"📬 [API] Subscriber connected for {task_id}, replaying {len(backlog)} events")
+        for event in backlog:
+            await subscriber.send(event)
+        backlog = await event_log.replay_async(task_id, subscriber.last_seq) or []
+    subscribers.add(subscriber)
+
+
 @app.websocket("/api/ws/{task_id}")
-async def websocket_endpoint(websocket: WebSocket, task_id: str):
-    """WebSocket endpoint for real-time updates."""
+async def websocket_endpoint(websocket: WebSocket, task_id: str, since: int = 0):
+    """WebSocket endpoint for real-time updates.
+    
+    Events carry a "seq" number; a client reconnecting with ?since=<seq> is
+    sent only the events after it (see subscribe()).
+    """
     await websocket.accept()
-    websocket_connections[task_id] = websocket
+    subscriber = Subscriber(task_id, websocket)
     
     try:
-        # Send initial status (format matches frontend expectations)
-        task_dict = get_task_dict(task_id)
-        if task_dict:
-            await websocket.send_json({
-                "type": "status",
-                "status": task_dict.get("status", "pending"),
-                "progress": task_dict.get("progress", 0),
-                "stage": task_dict.get("current_stage", "Queued"),
-                "cost": task_dict.get("cost", 0.0),
-                "result": task_dict.get("result"),
-                "error": task_dict.get("error")
-            })
-        
-        # Send any pending messages that were queued before connection
-        if task_id in pending_messages:
-            print(f"📬 [API] WebSocket connected for {task_id}, sending {len(pending_messages[task_id])} pending messages")
-            for pending_msg in pending_messages[task_id]:
-                try:
-                    await websocket.send_json(pending_msg)
-                except:
-                    pass
-            # Clear the queue after sending
-            del pending_messages[task_id]
+        await subscribe(subscriber, since)
         
         # Keep connection alive
         while True:
             await websocket.receive_text()
             
     except WebSocketDisconnect:
-        if task_id in websocket_connections:
-            del websocket_connections[task_id]
-        if task_id in pending_messages:
-            del pending_messages[task_id]
+        pass
+    finally:
+        # Only this connection goes away; other viewers of the task keep receiving
+        subscribers.remove(subscriber)
+
+
+# Seconds between SSE heartbeat comments, keeping proxies from closing idle streams
+SSE_HEARTBEAT_SECONDS = float(os.getenv("MGX_SSE_HEARTBEAT_SECONDS", "15"))
+
+
+@app.get("/api/events/{task_id}")
+async def events_stream(task_id: str, request: Request, since: int = 0):
+    """Server-Sent Events stream of a task's progress, for clients that cannot use WebSockets.
+    
+    Carries the same events as /api/ws/{task_id}, with each event's seq as
+    its SSE id. A reconnecting EventSource sends Last-Event-ID and is sent
+    only the events after it; ?since=<seq> does the same for a fresh stream.
+    The stream ends after the task's final event (complete, error or
+    cancelled), or one heartbeat interval after the replay if the task had
+    already finished.
+    """
+    if not await get_task_dict(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    subscriber = SSESubscriber(task_id)
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            await subscribe(subscriber, since)
+            finished = False
+            while True:
+                try:
+                    data = await asyncio.wait_for(subscriber.next_event(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if finished or await request.is_disconnected():
+                        # Finished before the stream connected, its final event already received
+                        return
+                    yield ": heartbeat\n\n"
+                    continue
+                if data is None:
+                    # Closed, e.g. for falling too far behind; the client resumes with Last-Event-ID
+                    return
+                yield format_sse(data)
+                if data.get("type") in TERMINAL_EVENTS:
+                    return
+                if data.get("type") == "status" and data.get("status") in ("completed", "failed", "cancelled"):
+                    finished = True
+        finally:
+            subscribers.remove(subscriber)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # Disable caching and proxy buffering, which would hold events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 async def upload_project_to_supabase(task_id: str, project_path: str, project_id: int):
@@ -668,18 +1002,8 @@ async def upload_project_to_supabase(task_id: str, project_path: str, project_id
         print(f"✅ [Supabase] Project uploaded to Storage: {storage_path}")
         
         # Store storage path in project extra_data
-        from mgx_backend.database import ProjectModel, get_db
-        db_session = next(get_db())
-        try:
-            db_project = db_session.query(ProjectModel).filter(ProjectModel.id == project_id).first()
-            if db_project:
-                extra_data = db_project.extra_data or {}
-                extra_data["storage_path"] = storage_path
-                db_project.extra_data = extra_data
-                db_session.commit()
-                print(f"✅ [Supabase] Storage path saved to project: {storage_path}")
-        finally:
-            db_session.close()
+        await get_async_db_manager().update_project_extra_data(project_id, storage_path=storage_path)
+        print(f"✅ [Supabase] Storage path saved to project: {storage_path}")
             
     except Exception as e:
         print(f"❌ [Supabase] Failed to upload project: {e}")
@@ -691,133 +1015,15 @@ async def upload_project_to_supabase(task_id: str, project_path: str, project_id
 @app.get("/api/files/{task_id}")
 async def get_files(task_id: str):
     """Get list of generated files."""
-    project_path = None
-    
-    # Get task from database
-    task_dict = get_task_dict(task_id)
-    if task_dict:
-        if task_dict["status"] != "completed":
-            raise HTTPException(status_code=400, detail="Task not completed")
-        if task_dict.get("result") and task_dict["result"].get("project_path"):
-            project_path = task_dict["result"]["project_path"]
-    
-    if not project_path:
-        # Try to get from database by project_id (if task_id is numeric)
-        try:
-            project_id = int(task_id)
-            db = get_db_manager()
-            project = db.get_project(project_id)
-            if project and project.project_path:
-                project_path = project.project_path
-                print(f"📁 [API] Found project_path from database by project_id: {project_path}")
-            else:
-                # If project exists but no project_path, return empty files instead of 404
-                if project:
-                    print(f"⚠️ [API] Project {project_id} exists but has no project_path, returning empty files")
-                    return {"files": []}
-                raise HTTPException(status_code=404, detail="Project not found or no project_path")
-        except (ValueError, TypeError):
-            # task_id is not numeric (UUID), try to find project by searching conversations
-            # First try to find conversation with this task_id in extra_data
-            db = get_db_manager()
-            try:
-                # Search all conversations for this task_id in extra_data
-                from mgx_backend.database import ConversationHistoryModel, get_db
-                
-                db_session = next(get_db())
-                try:
-                    # Query all conversations and check extra_data manually (SQLite JSON support is limited)
-                    all_conversations = db_session.query(ConversationHistoryModel).all()
-                    matching_conversation = None
-                    for conv in all_conversations:
-                        if conv.extra_data and isinstance(conv.extra_data, dict):
-                            if conv.extra_data.get("task_id") == task_id:
-                                matching_conversation = conv
-                                break
-                    
-                    if matching_conversation:
-                        # Get project_id from the matching conversation
-                        if matching_conversation.project_id:
-                            project = db.get_project(matching_conversation.project_id)
-                            if project and project.project_path:
-                                project_path = project.project_path
-                                print(f"📁 [API] Found project_path from conversation extra_data: {project_path}")
-                            elif project:
-                                print(f"⚠️ [API] Project {matching_conversation.project_id} exists but has no project_path")
-                        else:
-                            print(f"⚠️ [API] Conversation found but no project_id, task_id: {task_id}")
-                finally:
-                    db_session.close()
-            except Exception as e:
-                print(f"⚠️ [API] Error searching conversations for task_id {task_id}: {e}")
-            
-            # If still not found, try to find project by reconstructing path
-            # Project paths are typically: workspace/project_{task_id} or workspace/project_{project_name}
-            import os
-            from mgx_backend.config import Config
-            
-            # Get workspace from config - resolve to absolute path
-            config = Config.default()
-            workspace_str = config.project.workspace if hasattr(config.project, 'workspace') else "./workspace"
-            
-            # Get the script's directory (where api.py is located)
-            # api.py is in: workspace/mgx_backend/api.py
-            # workspace directory is: workspace/workspace/
-            script_dir = Path(__file__).parent.resolve()  # mgx_backend directory
-            workspace_root = script_dir.parent  # workspace/ directory (where mgx_backend is)
-            
-            # Try multiple path resolutions
-            workspace_candidates = [
-                workspace_root / workspace_str.lstrip("./"),  # workspace/workspace
-                workspace_root / "workspace",  # workspace/workspace (fallback)
-                Path(workspace_str).resolve() if Path(workspace_str).is_absolute() else workspace_root / workspace_str.lstrip("./"),
-                Path(os.getcwd()) / workspace_str.lstrip("./"),
-                Path(os.getcwd()) / "workspace",
-            ]
-            
-            workspace = None
-            for ws_candidate in workspace_candidates:
-                if ws_candidate.exists() and ws_candidate.is_dir():
-                    workspace = ws_candidate.resolve()
-                    break
-            
-            if not workspace:
-                workspace = workspace_root / "workspace"
-                print(f"⚠️ [API] Workspace not found, using default: {workspace}")
-            
-            print(f"📁 [API] Using workspace: {workspace} (exists: {workspace.exists()}, script_dir: {script_dir}, workspace_root: {workspace_root})")
-            
-            # Try standard pattern: workspace/project_{task_id}
-            potential_path = workspace / f"project_{task_id}"
-            if potential_path.exists() and potential_path.is_dir():
-                project_path = str(potential_path.resolve())
-                print(f"📁 [API] Found project_path from filesystem: {project_path}")
-            else:
-                # Try to find in workspace directory by matching task_id in directory name
-                if workspace.exists():
-                    # Look for directories matching the pattern
-                    for project_dir in workspace.iterdir():
-                        if project_dir.is_dir() and task_id in project_dir.name:
-                            project_path = str(project_dir.resolve())
-                            print(f"📁 [API] Found project_path by pattern match: {project_path}")
-                            break
-                
-                if not project_path:
-                    # List available projects for debugging
-                    if workspace.exists():
-                        available_projects = [d.name for d in workspace.iterdir() if d.is_dir() and d.name.startswith("project_")]
-                        print(f"❌ [API] Project not found for task_id: {task_id}")
-                        print(f"   Workspace: {workspace}")
-                        print(f"   Available projects: {available_projects[:5]}")
-                        print(f"   Looking for: project_{task_id}")
-                    # Return empty files instead of 404 for better UX
-                    print(f"⚠️ [API] Returning empty files for task_id: {task_id} (project not found)")
-                    return {"files": []}
+    location = await task_locator.locate(task_id)
+    if location is None and task_id.isdigit():
+        raise HTTPException(status_code=404, detail="Project not found or no project_path")
     
-    if not project_path:
-        # Return empty files instead of 404
+    if not location or not location.project_path:
+        # Return empty files instead of 404 for better UX
         print(f"⚠️ [API] No project_path found for task_id: {task_id}, returning empty files")
         return {"files": []}
+    project_path = location.project_path
     
     # Check if project path exists
     if not Path(project_path).exists():
@@ -880,198 +1086,40 @@ async def get_files(task_id: str):
 @app.get("/api/download/{task_id}")
 async def download_project(task_id: str):
     """Download the generated project as a zip file."""
-    project_path = None
-    
-    # Get task from database
-    task_dict = get_task_dict(task_id)
-    if task_dict:
-        if task_dict["status"] != "completed":
-            raise HTTPException(status_code=400, detail="Task not completed")
-        if task_dict.get("result") and task_dict["result"].get("project_path"):
-            project_path = task_dict["result"]["project_path"]
-    
-    if not project_path:
-        # Try to get from database by project_id (if task_id is numeric)
-        try:
-            project_id = int(task_id)
-            db = get_db_manager()
-            project = db.get_project(project_id)
-            if project and project.project_path:
-                project_path = project.project_path
-                print(f"📁 [API] Found project_path from database by project_id: {project_path}")
-        except (ValueError, TypeError):
-            # task_id is not numeric (UUID), try to find project by searching conversations
-            db = get_db_manager()
-            try:
-                from mgx_backend.database import ConversationHistoryModel, get_db
-                
-                db_session = next(get_db())
-                try:
-                    # Find conversation with this task_id in extra_data
-                    all_conversations = db_session.query(ConversationHistoryModel).all()
-                    matching_conversation = None
-                    for conv in all_conversations:
-                        if conv.extra_data and isinstance(conv.extra_data, dict):
-                            if conv.extra_data.get("task_id") == task_id:
-                                matching_conversation = conv
-                                break
-                    
-                    if matching_conversation and matching_conversation.project_id:
-                        project = db.get_project(matching_conversation.project_id)
-                        if project and project.project_path:
-                            project_path = project.project_path
-                            print(f"📁 [API] Found project_path from conversation: {project_path}")
-                finally:
-                    db_session.close()
-            except Exception as e:
-                print(f"⚠️ [API] Error searching conversations for task_id {task_id}: {e}")
-            
-            # If still not found, try to find project by reconstructing path
-            if not project_path:
-                import os
-                from mgx_backend.config import Config
-                
-                config = Config.default()
-                workspace_str = config.project.workspace if hasattr(config.project, 'workspace') else "./workspace"
-                
-                script_dir = Path(__file__).parent.resolve()
-                workspace_root = script_dir.parent
-                
-                workspace_candidates = [
-                    workspace_root / workspace_str.lstrip("./"),
-                    workspace_root / "workspace",
-                    Path(workspace_str).resolve() if Path(workspace_str).is_absolute() else workspace_root / workspace_str.lstrip("./"),
-                    Path(os.getcwd()) / workspace_str.lstrip("./"),
-                    Path(os.getcwd()) / "workspace",
-                ]
-                
-                workspace = None
-                for ws_candidate in workspace_candidates:
-                    if ws_candidate.exists() and ws_candidate.is_dir():
-                        workspace = ws_candidate.resolve()
-                        break
-                
-                if not workspace:
-                    workspace = workspace_root / "workspace"
-                
-                # Try standard pattern: workspace/project_{task_id}
-                potential_path = workspace / f"project_{task_id}"
-                if potential_path.exists() and potential_path.is_dir():
-                    project_path = str(potential_path.resolve())
-                    print(f"📁 [API] Found project_path from filesystem: {project_path}")
-                else:
-                    # Try to find in workspace directory by matching task_id in directory name
-                    if workspace.exists():
-                        for project_dir in workspace.iterdir():
-                            if project_dir.is_dir() and task_id in project_dir.name:
-                                project_path = str(project_dir.resolve())
-                                print(f"📁 [API] Found project_path by pattern match: {project_path}")
-                                break
-    
-    if not project_path:
+    location = await task_locator.locate(task_id)
+    if not location or not location.project_path:
         raise HTTPException(status_code=404, detail="Project path not found")
     
     # Try to download from Supabase Storage first
-    try:
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
-        
-        if supabase_url and supabase_key:
-            # Get storage path from project extra_data
-            storage_path = None
-            db = get_db_manager()
-            
-            # Try to get from project extra_data
-            try:
-                from mgx_backend.database import ConversationHistoryModel, get_db, ProjectModel
-                db_session = next(get_db())
-                try:
-                    # Find conversation with this task_id
-                    all_conversations = db_session.query(ConversationHistoryModel).all()
-                    matching_conversation = None
-                    for conv in all_conversations:
-                        if conv.extra_data and isinstance(conv.extra_data, dict):
-                            if conv.extra_data.get("task_id") == task_id:
-                                matching_conversation = conv
-                                break
-                    
-                    if matching_conversation and matching_conversation.project_id:
-                        project = db.get_project(matching_conversation.project_id)
-                        if project and project.extra_data and isinstance(project.extra_data, dict):
-                            storage_path = project.extra_data.get("storage_path")
-                    
-                    # Also try direct project lookup if task_id is numeric
-                    if not storage_path:
-                        try:
-                            project_id = int(task_id)
-                            project = db.get_project(project_id)
-                            if project and project.extra_data and isinstance(project.extra_data, dict):
-                                storage_path = project.extra_data.get("storage_path")
-                        except (ValueError, TypeError):
-                            pass
-                finally:
-                    db_session.close()
-            except Exception as e:
-                print(f"⚠️ [API] Error getting storage path: {e}")
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if supabase_url and supabase_key:
+        try:
+            from supabase import create_client, Client
+            supabase: Client = create_client(supabase_url, supabase_key)
             
-            # Try default storage path
-            if not storage_path:
-                storage_path = f"projects/{task_id}.zip"
+            print(f"📥 [API] Attempting to download from Supabase Storage: {location.storage_path}")
+            file_data = supabase.storage.from_("projects").download(location.storage_path)
             
-            # Try to download from Supabase Storage
-            try:
-                from supabase import create_client, Client
-                supabase: Client = create_client(supabase_url, supabase_key)
-                
-                print(f"📥 [API] Attempting to download from Supabase Storage: {storage_path}")
-                file_data = supabase.storage.from_("projects").download(storage_path)
-                
-                if file_data:
-                    print(f"✅ [API] Successfully downloaded from Supabase Storage: {storage_path}")
-                    return StreamingResponse(
-                        io.BytesIO(file_data),
-                        media_type="application/zip",
-                        headers={"Content-Disposition": f'attachment; filename="project_{task_id}.zip"'}
-                    )
-            except Exception as e:
-                print(f"⚠️ [API] Failed to download from Supabase Storage: {e}")
-                # Fall through to try local filesystem
-    except Exception as e:
-        print(f"⚠️ [API] Supabase Storage not available: {e}")
-        # Fall through to try local filesystem
+            if file_data:
+                print(f"✅ [API] Successfully downloaded from Supabase Storage: {location.storage_path}")
+                return StreamingResponse(
+                    io.BytesIO(file_data),
+                    media_type="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="project_{task_id}.zip"'}
+                )
+        except Exception as e:
+            print(f"⚠️ [API] Failed to download from Supabase Storage: {e}")
+            # Fall through to try local filesystem
     
     # Fallback to local filesystem
-    project_path = Path(project_path)
+    project_path = Path(location.project_path)
     if not project_path.exists():
-        # Try to provide more helpful error message
         print(f"❌ [API] Project path does not exist: {project_path}")
-        print(f"   Current working directory: {Path.cwd()}")
-        print(f"   Absolute path: {project_path.resolve() if project_path.is_absolute() else Path.cwd() / project_path}")
-        
-        # Check if it's a relative path issue
-        if not project_path.is_absolute():
-            # Try to resolve relative path
-            resolved_path = Path.cwd() / project_path
-            if resolved_path.exists():
-                project_path = resolved_path
-                print(f"✅ [API] Found project using resolved path: {project_path}")
-            else:
-                # Try from script directory
-                script_dir = Path(__file__).parent.parent
-                resolved_path = script_dir / project_path
-                if resolved_path.exists():
-                    project_path = resolved_path
-                    print(f"✅ [API] Found project using script-relative path: {project_path}")
-                else:
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"Project files not found on disk or Supabase Storage. Path: {project_path}. This may happen if the project was deleted or the server was restarted."
-                    )
-        else:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"Project files not found on disk or Supabase Storage. Path: {project_path}. This may happen if the project was deleted or the server was restarted."
-            )
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Project files not found on disk or Supabase Storage. Path: {project_path}. This may happen if the project was deleted or the server was restarted."
+        )
     
     # Create zip file from local filesystem
     zip_path = f"/tmp/{task_id}.zip"
@@ -1091,18 +1139,83 @@ async def download_project(task_id: str):
     )
 
 
+@app.get("/api/tasks/{task_id}/subscribers")
+async def list_task_subscribers(task_id: str):
+    """List WebSocket subscribers of a task on this node with their delivery counts."""
+    return {"task_id": task_id, "subscribers": [s.stats() for s in subscribers.get(task_id)]}
+
+
+@app.get("/api/queue/stats")
+async def queue_stats():
+    """Get queue depth, wait times, worker usage and event loop lag of this process."""
+    db = get_async_db_manager()
+    return {
+        **await db.get_queue_stats(),
+        "workers": worker_pool.concurrency,
+        "busy_workers": worker_pool.busy,
+        "worker_id": worker_pool.worker_id,
+        "event_loop_lag": loop_monitor.stats(),
+        "progress_writes": task_state.stats(),
+        "cost_ledger": cost_ledger.stats(),
+        "db_pool": db.pool_usage.stats(),
+        "task_locator": task_locator.stats(),
+        "user_cache": user_cache.stats(),
+        "password_hashing": password_hasher.stats()
+    }
+
+
+@app.get("/api/buffers/stats")
+async def buffer_stats():
+    """Get size gauges of this process's buffered progress events."""
+    return event_log.stats()
+
+
+# Largest page of /api/tasks
+MAX_TASK_PAGE_SIZE = int(os.getenv("MGX_MAX_TASK_PAGE_SIZE", "500"))
+
+
 @app.get("/api/tasks")
-async def list_tasks():
-    """List all tasks."""
-    db = get_db_manager()
-    tasks_list = db.list_tasks()
-    return {"tasks": [get_task_dict(task.task_id) for task in tasks_list]}
+async def list_tasks(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    user_id: Optional[int] = None,
+    include_result: bool = False
+):
+    """List tasks newest first.
+    
+    Args:
+        limit: Tasks per page (at most MAX_TASK_PAGE_SIZE)
+        cursor: next_cursor of the previous page
+        status: Only tasks in this status (comma-separated for several)
+        user_id: Only tasks started by this user
+        include_result: Also return each task's result
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    limit = max(1, min(limit, MAX_TASK_PAGE_SIZE))
+    
+    db = get_async_db_manager()
+    rows = await db.list_tasks(
+        limit=limit,
+        after=after,
+        statuses=status.split(",") if status else None,
+        user_id=user_id,
+        include_result=include_result
+    )
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if len(rows) == limit else None
+    return {
+        "tasks": [format_task(row, include_result) for row in rows],
+        "next_cursor": next_cursor
+    }
 
 
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(task_id: str):
     """Delete a task."""
-    task_dict = get_task_dict(task_id)
+    task_dict = await get_task_dict(task_id)
     if not task_dict:
         raise HTTPException(status_code=404, detail="Task not found")
     
@@ -1113,15 +1226,88 @@ async def delete_task(task_id: str):
             shutil.rmtree(project_path)
     
     # Delete from database
-    db = get_db_manager()
-    db.delete_task(task_id)
+    db = get_async_db_manager()
+    await db.delete_task(task_id)
+    event_log.delete(task_id)
+    task_locator.invalidate(task_id)
     return {"message": "Task deleted"}
 
 
+@app.post("/api/tasks/{task_id}/resume")
+async def resume_task(task_id: str):
+    """Resume a failed task from its last completed action."""
+    task_dict = await get_task_dict(task_id)
+    if not task_dict:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task_dict["status"] in ("completed", "running"):
+        raise HTTPException(status_code=400, detail=f"Task is {task_dict['status']}")
+    
+    db = get_async_db_manager()
+    await db.update_task(
+        task_id,
+        status="pending",
+        current_stage="Queued",
+        error=None,
+        queued_at=datetime.utcnow(),
+        attempts=0
+    )
+    worker_pool.notify()
+    return {"task_id": task_id, "status": "pending"}
+
+
+@app.post("/api/tasks/{task_id}/cancel")
+async def cancel_task(task_id: str):
+    """Cancel a pending or running task, aborting its in-flight LLM stream."""
+    task_dict = await get_task_dict(task_id)
+    if not task_dict:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task_dict["status"] in ("completed", "failed", "cancelled"):
+        raise HTTPException(status_code=400, detail=f"Task is already {task_dict['status']}")
+    
+    running = worker_pool.cancel(task_id)
+    if running:
+        # Wait briefly so the response carries the recorded partial cost
+        await asyncio.wait([running], timeout=5)
+    else:
+        # Queued, or running in another process: that worker stops once its lease renewal fails
+        await mark_cancelled(task_id, task_dict.get("cost") or 0.0)
+    
+    return await get_task_dict(task_id)
+
+
+@app.post("/api/tasks/{task_id}/amend")
+async def amend_task(
+    task_id: str,
+    request: AmendRequest,
+    current_user: UserModel = Depends(get_current_user)
+):
+    """Apply a change request to a completed task, regenerating only the affected files."""
+    task_dict = await get_task_dict(task_id)
+    if not task_dict:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task_dict["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Task not completed")
+    if not task_dict.get("result") or not task_dict["result"].get("project_path"):
+        raise HTTPException(status_code=404, detail="Project path not found")
+    
+    amend_task_id = str(uuid.uuid4())
+    queued = await create_admitted_task(
+        current_user,
+        amend_task_id,
+        request.change_request,
+        request.investment,
+        n_round=1,
+        kind="amend",
+        parent_task_id=task_id
+    )
+    worker_pool.notify()
+    return {"task_id": amend_task_id, "amends": task_id, "status": "pending", "queued": queued}
+
+
 @app.post("/api/github/upload")
 async def upload_to_github(request: GitHubUploadRequest):
     """Upload project to GitHub repository."""
-    task_dict = get_task_dict(request.task_id)
+    task_dict = await get_task_dict(request.task_id)
     if not task_dict:
         raise HTTPException(status_code=404, detail="Task not found")
     
@@ -1324,30 +1510,26 @@ class Token(BaseModel):
 @app.post("/api/auth/register", response_model=Token)
 async def register(user_data: UserRegister):
     """Register a new user."""
-    db = get_db_manager()
-    
-    # Check if username already exists
-    if db.get_user_by_username(user_data.username):
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    # Check if email already exists
-    if db.get_user_by_email(user_data.email):
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create user
     from mgx_backend.database import UserCreate
-    password_hash = get_password_hash(user_data.password)
+    password_hash = await password_hasher.hash(user_data.password)
     user_create = UserCreate(
         username=user_data.username,
         email=user_data.email,
         password=user_data.password
     )
-    user = db.create_user(user_create, password_hash)
+    
+    # Check for existing users and create the user in one unit of work
+    async with get_async_db_manager().transaction() as uow:
+        if await uow.get_user_by_username(user_data.username):
+            raise HTTPException(status_code=400, detail="Username already registered")
+        if await uow.get_user_by_email(user_data.email):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        user = await uow.create_user(user_create, password_hash)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": str(user.id)}, expires_delta=access_token_expires
+        data=user_claims(user), expires_delta=access_token_expires
     )
     
     return {
@@ -1370,7 +1552,7 @@ async def login(user_data: UserLogin):
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": str(user.id)}, expires_delta=access_token_expires
+        data=user_claims(user), expires_delta=access_token_expires
     )
     
     return {
@@ -1392,88 +1574,173 @@ async def update_current_user(
     current_user: UserModel = Depends(get_current_user)
 ):
     """Update current user information."""
-    db = get_db_manager()
-    updated_user = db.update_user(current_user.id, user_update)
+    updated_user = await update_user(current_user.id, user_update)
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
     return UserResponse.model_validate(updated_user)
 
 
+@app.get("/api/auth/me/costs")
+async def get_my_costs(days: int = 30, current_user: UserModel = Depends(get_token_user)):
+    """Get the current user's LLM cost totals and daily totals over the last days."""
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    return await get_async_db_manager().get_cost_summary(current_user.id, days=days)
+
+
 # ==================== Conversation History ====================
 
+# Messages returned with a conversation; further pages come from /api/conversations/{id}/messages
+MESSAGE_PAGE_SIZE = int(os.getenv("MGX_MESSAGE_PAGE_SIZE", "200"))
+
+
+def parse_message_cursor(cursor: Optional[str]) -> int:
+    """Position after which the requested page of messages starts."""
+    if cursor is None:
+        return -1
+    try:
+        return int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+
+def conversation_response(conv, messages: list, next_position: Optional[int]) -> ConversationResponse:
+    """Conversation with one page of its messages."""
+    return ConversationResponse(
+        id=conv.id,
+        user_id=conv.user_id,
+        project_id=conv.project_id,
+        title=conv.title,
+        messages=messages,
+        next_messages_cursor=str(next_position) if next_position is not None else None,
+        extra_data=conv.extra_data,
+        created_at=conv.created_at,
+        updated_at=conv.updated_at
+    )
+
+
+async def get_owned_conversation(conversation_id: int, current_user: UserModel, db=None):
+    """Get a conversation of the current user, else raise 404/403.
+    
+    Args:
+        db: Unit of work to read in (defaults to the async database manager)
+    """
+    db = db or get_async_db_manager()
+    conv = await db.get_conversation(conversation_id)
+    if not conv:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if conv.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return conv
+
+
 @app.post("/api/conversations", response_model=ConversationResponse)
 async def create_conversation(
     conversation: ConversationCreate,
-    current_user: UserModel = Depends(get_current_user)
+    current_user: UserModel = Depends(get_token_user)
 ):
     """Create a new conversation."""
     # Ensure user_id matches current user (override any user_id in request)
     conversation.user_id = current_user.id
     
-    db = get_db_manager()
-    db_conv = db.create_conversation(conversation)
-    return ConversationResponse.model_validate(db_conv)
+    async with get_async_db_manager().transaction() as uow:
+        db_conv = await uow.create_conversation(conversation)
+        messages, next_position = await uow.list_conversation_messages(db_conv.id, limit=MESSAGE_PAGE_SIZE)
+    return conversation_response(db_conv, messages, next_position)
 
 
-@app.get("/api/conversations", response_model=list[ConversationResponse])
+@app.get("/api/conversations", response_model=list[ConversationSummary])
 async def list_conversations(
     project_id: Optional[int] = None,
     skip: int = 0,
     limit: int = 100,
-    current_user: UserModel = Depends(get_current_user)
+    current_user: UserModel = Depends(get_token_user)
 ):
-    """List conversations for current user."""
-    db = get_db_manager()
-    conversations = db.list_conversations(
+    """List conversations for current user, without their messages (see the detail endpoint)."""
+    db = get_async_db_manager()
+    conversations = await db.list_conversations(
         user_id=current_user.id,
         project_id=project_id,
         skip=skip,
         limit=limit
     )
-    return [ConversationResponse.model_validate(conv) for conv in conversations]
+    return [ConversationSummary.model_validate(conv) for conv in conversations]
 
 
 @app.get("/api/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: int,
-    current_user: UserModel = Depends(get_current_user)
+    messages_cursor: Optional[str] = None,
+    messages_limit: int = MESSAGE_PAGE_SIZE,
+    current_user: UserModel = Depends(get_token_user)
 ):
-    """Get a conversation by ID."""
-    db = get_db_manager()
-    conv = db.get_conversation(conversation_id)
-    if not conv:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    if conv.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return ConversationResponse.from_orm(conv)
+    """Get a conversation by ID with one page of its messages."""
+    after = parse_message_cursor(messages_cursor)
+    async with get_async_db_manager().transaction(write=False) as uow:
+        conv = await get_owned_conversation(conversation_id, current_user, uow)
+        messages, next_position = await uow.list_conversation_messages(
+            conversation_id, after=after, limit=messages_limit
+        )
+    return conversation_response(conv, messages, next_position)
+
+
+@app.get("/api/conversations/{conversation_id}/messages")
+async def list_conversation_messages(
+    conversation_id: int,
+    cursor: Optional[str] = None,
+    limit: int = MESSAGE_PAGE_SIZE,
+    current_user: UserModel = Depends(get_token_user)
+):
+    """Page through a conversation's messages, oldest first."""
+    after = parse_message_cursor(cursor)
+    async with get_async_db_manager().transaction(write=False) as uow:
+        await get_owned_conversation(conversation_id, current_user, uow)
+        messages, next_position = await uow.list_conversation_messages(conversation_id, after=after, limit=limit)
+    return {
+        "messages": messages,
+        "next_cursor": str(next_position) if next_position is not None else None
+    }
+
+
+@app.post("/api/conversations/{conversation_id}/messages")
+async def append_conversation_messages(
+    conversation_id: int,
+    append: ConversationMessagesAppend,
+    current_user: UserModel = Depends(get_token_user)
+):
+    """Append messages to a conversation without resending the earlier ones."""
+    try:
+        async with get_async_db_manager().transaction() as uow:
+            await get_owned_conversation(conversation_id, current_user, uow)
+            message_count = await uow.append_conversation_messages(conversation_id, append.messages)
+    except IntegrityError:
+        # Another append took the same positions first
+        raise HTTPException(status_code=409, detail="Conversation changed, retry")
+    return {"conversation_id": conversation_id, "message_count": message_count}
 
 
 @app.put("/api/conversations/{conversation_id}", response_model=ConversationResponse)
 async def update_conversation(
     conversation_id: int,
     conversation_update: ConversationUpdate,
-    current_user: UserModel = Depends(get_current_user)
+    current_user: UserModel = Depends(get_token_user)
 ):
-    """Update a conversation."""
-    db = get_db_manager()
-    conv = db.get_conversation(conversation_id)
-    if not conv:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    if conv.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    updated_conv = db.update_conversation(conversation_id, conversation_update)
-    return ConversationResponse.from_orm(updated_conv)
+    """Update a conversation; only messages from the first changed one are rewritten."""
+    async with get_async_db_manager().transaction() as uow:
+        await get_owned_conversation(conversation_id, current_user, uow)
+        updated_conv = await uow.update_conversation(conversation_id, conversation_update)
+        messages, next_position = await uow.list_conversation_messages(conversation_id, limit=MESSAGE_PAGE_SIZE)
+    return conversation_response(updated_conv, messages, next_position)
 
 
 @app.delete("/api/conversations/{conversation_id}")
 async def delete_conversation(
     conversation_id: int,
-    current_user: UserModel = Depends(get_current_user)
+    current_user: UserModel = Depends(get_token_user)
 ):
     """Delete a conversation."""
-    db = get_db_manager()
-    success = db.delete_conversation(conversation_id, current_user.id)
+    db = get_async_db_manager()
+    success = await db.delete_conversation(conversation_id, current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return {"message": "Conversation deleted successfully"}
@@ -1,45 +1,141 @@
 """Authentication utilities for user login and JWT tokens."""
 
+import asyncio
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional, Tuple, TypeVar
 from jose import JWTError, jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from mgx_backend.database import get_db_manager, UserModel
+from mgx_backend.database import get_async_db_manager, UserModel, UserUpdate
 
 # JWT settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# MGX_TOKEN_USER_CLAIMS=1 puts the username and avatar in tokens, so endpoints
+# depending on get_token_user need no user lookup
+TOKEN_USER_CLAIMS = os.getenv("MGX_TOKEN_USER_CLAIMS", "0") == "1"
+
+# bcrypt work factor of new hashes; hashes with another factor are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("MGX_BCRYPT_ROUNDS", "12"))
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+T = TypeVar("T")
+
+
+def _password_bytes(password: str) -> bytes:
+    """Password as bcrypt takes it (bcrypt has a 72 byte limit)."""
+    return password.encode('utf-8')[:72]
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
     try:
-        password_bytes = plain_password.encode('utf-8')
-        if len(password_bytes) > 72:
-            password_bytes = password_bytes[:72]
-        return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode('utf-8'))
     except Exception:
         return False
 
 
 def get_password_hash(password: str) -> str:
-    """Hash a password."""
-    # Bcrypt has a 72 byte limit, truncate if necessary
-    password_bytes = password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
+    """Hash a password with the configured work factor."""
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    hashed = bcrypt.hashpw(_password_bytes(password), salt)
     return hashed.decode('utf-8')
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """Whether a hash was made with another work factor than the configured one."""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS  # $2b$<rounds>$<salt+hash>
+    except (IndexError, ValueError):
+        return False
+
+
+class PasswordHasher:
+    """Run bcrypt in a small thread pool so hashing never blocks the event loop.
+    
+    Each hash takes 100-300 ms of CPU. At most `workers` run at once and
+    `queue_limit` more wait; further requests are rejected with 503 instead
+    of piling up behind a login burst.
+    """
+    
+    def __init__(self, workers: Optional[int] = None, queue_limit: Optional[int] = None):
+        """Initialize hasher.
+        
+        Args:
+            workers: Threads hashing at once (defaults to MGX_PASSWORD_HASH_WORKERS or 2)
+            queue_limit: Requests waiting for a thread (defaults to MGX_PASSWORD_HASH_QUEUE or 32)
+        """
+        self.workers = workers or int(os.getenv("MGX_PASSWORD_HASH_WORKERS", "2"))
+        self.queue_limit = queue_limit if queue_limit is not None else int(os.getenv("MGX_PASSWORD_HASH_QUEUE", "32"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0  # Requests running or queued
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0  # Time spent hashing
+    
+    async def _run(self, function: Callable[..., T], *args) -> T:
+        if self.pending >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login requests, retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        
+        def timed():
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.busy_seconds += time.perf_counter() - started
+        
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+    
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured work factor."""
+        return await self._run(get_password_hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash."""
+        return await self._run(verify_password, plain_password, hashed_password)
+    
+    def shutdown(self):
+        """Stop the hashing threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "rounds": BCRYPT_ROUNDS
+        }
+
+
+# Password hashing of this process
+password_hasher = PasswordHasher()
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -52,12 +148,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def user_claims(user: UserModel) -> dict:
+    """Claims identifying a user in their access token."""
+    claims = {"sub": str(user.id)}
+    if TOKEN_USER_CLAIMS:
+        claims.update(username=user.username, avatar_url=user.avatar_url or "")
+    return claims
+
+
 def verify_token(token: str) -> Optional[dict]:
     """Verify and decode a JWT token."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"✅ [Auth] Token verified successfully, user_id: {payload.get('sub')}")
-        return payload
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError as e:
         print(f"❌ [Auth] JWT Error: {type(e).__name__}: {str(e)}")
         return None
@@ -68,8 +170,71 @@ def verify_token(token: str) -> Optional[dict]:
         return None
 
 
-async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)) -> UserModel:
-    """Get current authenticated user from JWT token."""
+class UserCache:
+    """Short-lived cache of user records by id, so authenticated requests skip the lookup."""
+    
+    def __init__(self, ttl: Optional[float] = None, max_size: Optional[int] = None):
+        """Initialize cache.
+        
+        Args:
+            ttl: Seconds a user record is reused (defaults to MGX_USER_CACHE_TTL_SECONDS or 30)
+            max_size: Users kept (defaults to MGX_USER_CACHE_SIZE or 10000)
+        """
+        self.ttl = ttl if ttl is not None else float(os.getenv("MGX_USER_CACHE_TTL_SECONDS", "30"))
+        self.max_size = max_size or int(os.getenv("MGX_USER_CACHE_SIZE", "10000"))
+        self._users: "OrderedDict[int, Tuple[UserModel, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    async def get(self, user_id: int) -> Optional[UserModel]:
+        """Get a user, from the cache if looked up less than ttl seconds ago."""
+        cached = self._users.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        
+        user = await get_async_db_manager().get_user(user_id)
+        if user is None:
+            self._users.pop(user_id, None)
+        elif self.ttl > 0:
+            self._users[user_id] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(user_id)
+            if len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+        return user
+    
+    def invalidate(self, user_id: int):
+        """Forget a user whose record changed."""
+        self._users.pop(user_id, None)
+    
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl
+        }
+
+
+# Users of authenticated requests in this process (invalidated by update_user)
+user_cache = UserCache()
+
+
+async def update_user(user_id: int, user_update: UserUpdate) -> Optional[UserModel]:
+    """Update a user and drop their cached record."""
+    user = await get_async_db_manager().update_user(user_id, user_update)
+    user_cache.invalidate(user_id)
+    return user
+
+
+def _token_payload(token: Optional[str]) -> Tuple[dict, int]:
+    """Verify a token and get its payload and user id.
+    
+    Raises:
+        HTTPException: 401 if the token is missing or invalid
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -90,33 +255,58 @@ async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)) -> Use
         raise credentials_exception
     
     try:
-        user_id = int(user_id_str)  # Convert string to int
+        return payload, int(user_id_str)  # Convert string to int
     except (ValueError, TypeError):
         print(f"❌ [Auth] Invalid user_id type: {type(user_id_str)}, value: {user_id_str}")
         raise credentials_exception
-    
-    db = get_db_manager()
-    user = db.get_user(user_id)
+
+
+async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)) -> UserModel:
+    """Get current authenticated user from JWT token."""
+    _, user_id = _token_payload(token)
+    user = await user_cache.get(user_id)
     if user is None:
         print(f"❌ [Auth] User not found for ID: {user_id}")
-        raise credentials_exception
-    
-    print(f"✅ [Auth] User authenticated: {user.username} (ID: {user.id})")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 
+async def get_token_user(token: Optional[str] = Depends(oauth2_scheme)) -> UserModel:
+    """Get the current user from the claims of their token, without a lookup if it has them.
+    
+    Only id, username and avatar_url are set on the returned user when it
+    comes from the token, so use this for endpoints that need no more; the
+    claims are as of login. Tokens without user claims fall back to
+    get_current_user.
+    """
+    payload, user_id = _token_payload(token)
+    if "username" not in payload:
+        return await get_current_user(token)
+    return UserModel(id=user_id, username=payload["username"], avatar_url=payload.get("avatar_url", ""))
+
+
 async def authenticate_user(username: str, password: str) -> Optional[UserModel]:
-    """Authenticate a user by username and password."""
-    db = get_db_manager()
-    user = db.get_user_by_username(username)
+    """Authenticate a user by username and password.
+    
+    A password hash made with another work factor than MGX_BCRYPT_ROUNDS is
+    replaced by a new hash of the (now known) password.
+    """
+    db = get_async_db_manager()
+    user = await db.get_user_by_username(username)
     if not user:
         return None
     # Check if user has password_hash (for existing users without password)
     if not hasattr(user, 'password_hash') or not user.password_hash:
         return None
-    # Truncate password if too long (bcrypt limit is 72 bytes)
-    password_to_verify = password[:72] if len(password.encode('utf-8')) > 72 else password
-    if not verify_password(password_to_verify, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         return None
+    if needs_rehash(user.password_hash):
+        user.password_hash = await password_hasher.hash(password)
+        await db.update_password_hash(user.id, user.password_hash)
+        user_cache.invalidate(user.id)
+        print(f"🔐 [Auth] Rehashed password of user {user.id} with {BCRYPT_ROUNDS} rounds")
     return user
-
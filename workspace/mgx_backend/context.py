@@ -52,6 +52,8 @@ class Context(BaseModel):
                 max_tokens=self.config.llm.max_tokens,
             )
             self._llm.cost_manager = self.cost_manager
+            self._llm.rate_limiter = self.kwargs.get("rate_limiter")
+            self._llm.priority_class = self.kwargs.get("priority_class", "interactive")
         return self._llm
     
     @property
@@ -0,0 +1,101 @@
+"""Buffered ledger of LLM call costs.
+
+Every LLM call of a task is recorded with its task, project, user, action,
+model and tokens. Records are buffered in memory and inserted in batches,
+either when a batch fills up or on an interval; the same transaction
+increments the per-project, per-user and per-day rollups, so totals are
+read from one row instead of summing raw records.
+"""
+
+import asyncio
+import os
+from typing import List, Optional
+
+from mgx_backend.database import CostRecordCreate, get_async_db_manager
+
+
+class CostLedger:
+    """Buffer cost records and insert them in batches."""
+    
+    def __init__(self, flush_interval: Optional[float] = None, batch_size: Optional[int] = None):
+        """Initialize ledger.
+        
+        Args:
+            flush_interval: Seconds between flushes of buffered records (defaults to
+                MGX_COST_FLUSH_SECONDS or 2)
+            batch_size: Buffered records that trigger a flush right away (defaults to
+                MGX_COST_BATCH_SIZE or 100)
+        """
+        self.flush_interval = flush_interval or float(os.getenv("MGX_COST_FLUSH_SECONDS", "2"))
+        self.batch_size = batch_size or int(os.getenv("MGX_COST_BATCH_SIZE", "100"))
+        self._buffer: List[CostRecordCreate] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self.recorded = 0  # Records received
+        self.written = 0  # Records inserted
+        self.batches = 0  # Batch inserts made
+    
+    def record(self, **fields):
+        """Buffer the record of one LLM call (fields of CostRecordCreate)."""
+        self.recorded += 1
+        self._buffer.append(CostRecordCreate(**fields))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No event loop (CLI use): the records are written by flush()
+        if len(self._buffer) >= self.batch_size:
+            if self._flushing is None or self._flushing.done():
+                self._flushing = asyncio.create_task(self._flush_logged())
+        else:
+            self._ensure_flusher()
+    
+    async def flush(self):
+        """Insert all buffered records now."""
+        while self._buffer:
+            batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            try:
+                await get_async_db_manager().record_costs(batch)
+            except BaseException:
+                # Keep the records for the next flush (also when cancelled), ahead of newer ones
+                self._buffer = batch + self._buffer
+                raise
+            self.written += len(batch)
+            self.batches += 1
+    
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"⚠️ [CostLedger] Failed to write {len(self._buffer)} cost record(s): {e}")
+    
+    def _ensure_flusher(self):
+        """Start the periodic flush in the running event loop if it is not running."""
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not asyncio.get_running_loop():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+    
+    async def stop(self):
+        """Stop the periodic flush and write everything still buffered."""
+        loop = asyncio.get_running_loop()
+        if self._flusher and not self._flusher.done() and self._flusher.get_loop() is loop:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        if self._flushing and not self._flushing.done() and self._flushing.get_loop() is loop:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        self._flusher = None
+        self._flushing = None
+        await self._flush_logged()
+    
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "batches": self.batches,
+            "buffered": len(self._buffer),
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval
+        }
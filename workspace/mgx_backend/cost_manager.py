@@ -1,9 +1,14 @@
 """Cost management for LLM API calls."""
 
-from typing import ClassVar
+from contextvars import ContextVar
+from typing import Any, ClassVar, Optional
 from pydantic import BaseModel, Field
 
 
+# Action whose LLM calls are being made (set by Role while it runs an action)
+current_action: ContextVar[Optional[str]] = ContextVar("current_action", default=None)
+
+
 class CostManager(BaseModel):
     """Manage and track API call costs."""
     
@@ -12,6 +17,12 @@ class CostManager(BaseModel):
     total_cost: float = 0.0
     max_budget: float = 10.0
     
+    # Attribution of recorded calls, and the CostLedger they are recorded in (none outside tasks)
+    task_id: Optional[str] = None
+    user_id: Optional[int] = None
+    project_id: Optional[int] = None
+    ledger: Optional[Any] = Field(default=None, exclude=True)
+    
     # Pricing per 1K tokens (as of 2024)
     PRICING: ClassVar[dict] = {
         "gpt-4-turbo": {"prompt": 0.01, "completion": 0.03},
@@ -26,8 +37,12 @@ class CostManager(BaseModel):
         prompt_tokens: int,
         completion_tokens: int,
         model: str
-    ):
-        """Update cost based on token usage."""
+    ) -> float:
+        """Update cost based on token usage, recording the call in the ledger if there is one.
+        
+        Returns:
+            Cost of the call
+        """
         self.total_prompt_tokens += prompt_tokens
         self.total_completion_tokens += completion_tokens
         
@@ -37,8 +52,22 @@ class CostManager(BaseModel):
         # Calculate cost (price is per 1K tokens)
         prompt_cost = (prompt_tokens / 1000) * pricing["prompt"]
         completion_cost = (completion_tokens / 1000) * pricing["completion"]
+        cost = prompt_cost + completion_cost
+        
+        self.total_cost += cost
         
-        self.total_cost += prompt_cost + completion_cost
+        if self.ledger is not None:
+            self.ledger.record(
+                task_id=self.task_id,
+                user_id=self.user_id,
+                project_id=self.project_id,
+                action_type=current_action.get(),
+                model=model,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_cost=cost
+            )
+        return cost
     
     def check_budget(self):
         """Check if budget is exceeded."""
@@ -1,11 +1,17 @@
 """Database models and management."""
 
+import asyncio
+import base64
 import os
-from datetime import datetime
-from typing import Optional, List
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON, ForeignKey
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from sqlalchemy import create_engine, event, inspect, text, func, or_, and_, Column, Integer, String, Float, DateTime, Text, JSON, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.orm import sessionmaker, relationship, deferred, undefer, Session
 from sqlalchemy.pool import QueuePool
 from pydantic import BaseModel
 
@@ -23,6 +29,7 @@ class UserModel(Base):
     password_hash = Column(String(255), nullable=True)  # Hashed password (nullable for migration)
     avatar_url = Column(String(500), default="")  # Avatar image URL
     api_key_hash = Column(String(255))  # Hashed API key (optional)
+    tier = Column(String(20), default="free")  # Admission limits tier (see admission.py)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -46,6 +53,7 @@ class ProjectModel(Base):
     investment = Column(Float, default=3.0)
     total_cost = Column(Float, default=0.0)
     extra_data = Column(JSON)  # Changed from 'metadata' to 'extra_data' to avoid SQLAlchemy reserved word
+    task_id = Column(String(36), nullable=True, index=True)  # Task that generated the project
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = Column(DateTime)
@@ -75,11 +83,13 @@ class SessionModel(Base):
 
 
 class CostRecordModel(Base):
-    """Cost tracking table."""
+    """Cost tracking table: one row per LLM call."""
     __tablename__ = "cost_records"
     
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)  # Set once the task's project is saved
+    task_id = Column(String(36), nullable=True, index=True)
+    user_id = Column(Integer, nullable=True)
     model = Column(String(50), nullable=False)
     prompt_tokens = Column(Integer, default=0)
     completion_tokens = Column(Integer, default=0)
@@ -89,6 +99,51 @@ class CostRecordModel(Base):
     
     # Relationships
     project = relationship("ProjectModel", back_populates="costs")
+    
+    __table_args__ = (Index("ix_cost_records_project_id", "project_id"),)
+
+
+class CostTotals:
+    """Columns of a cost rollup, incremented as cost records are inserted."""
+    calls = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_cost = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def totals(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_cost": self.total_cost
+        }
+
+
+class ProjectCostRollupModel(CostTotals, Base):
+    """Running cost totals of a project."""
+    __tablename__ = "project_cost_rollups"
+    
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+
+
+class UserCostRollupModel(CostTotals, Base):
+    """Running cost totals of a user."""
+    __tablename__ = "user_cost_rollups"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+
+
+class DailyCostRollupModel(CostTotals, Base):
+    """Cost totals of a user per UTC day."""
+    __tablename__ = "daily_cost_rollups"
+    
+    day = Column(String(10), primary_key=True)  # YYYY-MM-DD
+    user_id = Column(Integer, primary_key=True, default=0)  # 0 for calls without a user
+
+
+# Characters of the last message kept for conversation lists
+MESSAGE_PREVIEW_LENGTH = 200
 
 
 class ConversationHistoryModel(Base):
@@ -99,14 +154,55 @@ class ConversationHistoryModel(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)  # Optional, can be general chat
     title = Column(String(200), default="New Conversation")  # Conversation title
-    messages = Column(JSON, nullable=False)  # Store messages as JSON array
+    messages = deferred(Column(JSON, nullable=False))  # Legacy JSON array; messages are stored in conversation_messages
     extra_data = Column(JSON, nullable=True)  # Store task_id and other metadata
+    task_id = Column(String(36), nullable=True, index=True)  # Copy of extra_data["task_id"], for lookups
+    message_count = Column(Integer, default=0)  # Rows in conversation_messages
+    last_message_preview = Column(String(MESSAGE_PREVIEW_LENGTH))  # Start of the last message, for the sidebar
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     user = relationship("UserModel", back_populates="conversations")
     project = relationship("ProjectModel")
+    
+    __table_args__ = (Index("ix_conversation_history_user_id_updated_at", "user_id", "updated_at"),)
+    
+    def summarize(self, message_count: int, last_message: Optional[dict]):
+        """Update the denormalized message count and preview after messages changed."""
+        self.message_count = message_count
+        content = (last_message or {}).get("content") or ""
+        self.last_message_preview = content[:MESSAGE_PREVIEW_LENGTH] if last_message else None
+
+
+class ConversationMessageModel(Base):
+    """One message of a conversation; messages are appended, not rewritten."""
+    __tablename__ = "conversation_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversation_history.id"), nullable=False)
+    position = Column(Integer, nullable=False)  # Index of the message in the conversation, from 0
+    role = Column(String(50))
+    content = Column(Text, nullable=False)
+    extra_data = Column(JSON)  # Other fields sent by the frontend (roleName, type, timestamp)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (UniqueConstraint("conversation_id", "position", name="uq_conversation_messages_position"),)
+    
+    def to_dict(self) -> dict:
+        """Message as the frontend sent it."""
+        return {**(self.extra_data or {}), "role": self.role, "content": self.content}
+    
+    @classmethod
+    def from_dict(cls, conversation_id: int, position: int, message: dict) -> "ConversationMessageModel":
+        extra_data = {k: v for k, v in message.items() if k not in ("role", "content")}
+        return cls(
+            conversation_id=conversation_id,
+            position=position,
+            role=message.get("role"),
+            content=message.get("content") or "",
+            extra_data=extra_data or None
+        )
 
 
 class TaskModel(Base):
@@ -115,7 +211,7 @@ class TaskModel(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(String(36), unique=True, index=True, nullable=False)  # UUID string
-    status = Column(String(20), default="pending")  # pending, running, completed, failed
+    status = Column(String(20), default="pending", index=True)  # pending, running, completed, failed, cancelled
     progress = Column(Integer, default=0)  # 0-100
     current_stage = Column(String(200), default="Queued")
     cost = Column(Float, default=0.0)
@@ -124,8 +220,73 @@ class TaskModel(Base):
     n_round = Column(Integer, default=5)
     result = Column(JSON, nullable=True)  # Store result as JSON
     error = Column(Text, nullable=True)
+    kind = Column(String(20), default="generate")  # generate, amend
+    parent_task_id = Column(String(36), nullable=True)  # Task whose project an amend task changes
+    user_id = Column(Integer, nullable=True, index=True)  # User who started the task
+    priority_class = Column(String(20), default="interactive")  # interactive, batch (see scheduler.py)
+    # Queue lease: a worker owns a running task until lease_expires_at, then it can be reclaimed
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True)
+    attempts = Column(Integer, default=0)
+    queued_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)  # Last time a worker claimed the task
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Newest-first task listing, optionally by status or user (see list_tasks)
+    __table_args__ = (
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+        Index("ix_tasks_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_tasks_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+
+# Columns returned when listing tasks; result is large and only loaded on request
+TASK_SUMMARY_COLUMNS = [
+    TaskModel.id, TaskModel.task_id, TaskModel.status, TaskModel.progress, TaskModel.current_stage,
+    TaskModel.cost, TaskModel.idea, TaskModel.investment, TaskModel.n_round, TaskModel.error,
+    TaskModel.kind, TaskModel.parent_task_id, TaskModel.user_id, TaskModel.priority_class,
+    TaskModel.created_at, TaskModel.updated_at
+]
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode the position after a row for keyset pagination."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor made by encode_cursor.
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class TaskMessageModel(Base):
+    """Checkpoint table: every message published during a task's team run."""
+    __tablename__ = "task_messages"
+    __table_args__ = (UniqueConstraint("task_id", "seq", name="uq_task_messages_task_seq"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(String(36), index=True, nullable=False)
+    seq = Column(Integer, nullable=False)  # Position in Environment.history
+    role = Column(String(50))
+    cause_by = Column(String(50))
+    sent_from = Column(String(50))
+    send_to = Column(String(50))
+    content = Column(Text, nullable=False)
+    extra_data = Column(JSON)  # Message.metadata
+    queue_state = Column(JSON)  # {role_name: [history seq, ...]} pending news per role after publish
+    cost = Column(Float, default=0.0)  # Cost manager totals at checkpoint time
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 
 # Pydantic Schemas for API
@@ -157,6 +318,7 @@ class UserResponse(BaseModel):
     username: str
     email: str
     avatar_url: Optional[str]
+    tier: Optional[str] = "free"
     created_at: datetime
     
     class Config:
@@ -176,12 +338,30 @@ class ConversationUpdate(BaseModel):
     messages: Optional[list] = None
 
 
+class ConversationMessagesAppend(BaseModel):
+    messages: list
+
+
+class ConversationSummary(BaseModel):
+    id: int
+    project_id: Optional[int]
+    title: str
+    message_count: int
+    last_message_preview: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
 class ConversationResponse(BaseModel):
     id: int
     user_id: int
     project_id: Optional[int]
     title: str
     messages: list
+    next_messages_cursor: Optional[str] = None  # Set when more messages follow (see /api/conversations/{id}/messages)
     extra_data: Optional[dict] = None
     created_at: datetime
     updated_at: datetime
@@ -215,17 +395,22 @@ class ProjectResponse(BaseModel):
 
 
 class CostRecordCreate(BaseModel):
-    project_id: int
+    project_id: Optional[int] = None
+    task_id: Optional[str] = None
+    user_id: Optional[int] = None
     model: str
     prompt_tokens: int
     completion_tokens: int
     total_cost: float
     action_type: Optional[str] = None
+    created_at: Optional[datetime] = None  # Time of the call (defaults to the insert time)
 
 
 class CostRecordResponse(BaseModel):
     id: int
-    project_id: int
+    project_id: Optional[int]
+    task_id: Optional[str] = None
+    user_id: Optional[int] = None
     model: str
     prompt_tokens: int
     completion_tokens: int
@@ -237,6 +422,79 @@ class CostRecordResponse(BaseModel):
         from_attributes = True
 
 
+# SQLite connection settings
+def sqlite_pragmas() -> Dict[str, str]:
+    """PRAGMAs applied to every SQLite connection, per MGX_SQLITE_PROFILE.
+    
+    "production" (default) uses a write-ahead log so readers never block the
+    writer, syncs to disk at checkpoints instead of every commit, waits for
+    locks instead of failing, and memory-maps and caches more of the file.
+    "legacy" keeps SQLite's own defaults.
+    """
+    if os.getenv("MGX_SQLITE_PROFILE", "production") == "legacy":
+        return {}
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": os.getenv("MGX_SQLITE_BUSY_TIMEOUT_MS", "5000"),
+        "mmap_size": os.getenv("MGX_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+        "cache_size": str(-int(os.getenv("MGX_SQLITE_CACHE_KB", str(64 * 1024)))),  # Negative: KiB, not pages
+        "temp_store": "MEMORY",
+    }
+
+
+def configure_sqlite(engine, pragmas: Dict[str, str]):
+    """Apply PRAGMAs to each new connection of a (sync) engine."""
+    if not pragmas:
+        return
+    
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+class PoolUsage:
+    """Connection checkouts, queries, commits and connections in use of an engine."""
+    
+    def __init__(self, engine):
+        """Count pool and transaction events of a (sync) engine."""
+        self.checkouts = 0  # Connections handed out by the pool
+        self.queries = 0  # Statements executed
+        self.commits = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        event.listen(engine, "checkout", self._checkout)
+        event.listen(engine, "checkin", self._checkin)
+        event.listen(engine, "before_cursor_execute", self._execute)
+        event.listen(engine, "commit", self._commit)
+    
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+    
+    def _checkin(self, dbapi_connection, connection_record):
+        self.in_use = max(0, self.in_use - 1)
+    
+    def _execute(self, connection, cursor, statement, parameters, context, executemany):
+        self.queries += 1
+    
+    def _commit(self, connection):
+        self.commits += 1
+    
+    def stats(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "queries": self.queries,
+            "commits": self.commits,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use
+        }
+
+
 # Database Manager
 class DatabaseManager:
     """Manage database connections and operations."""
@@ -275,16 +533,193 @@ class DatabaseManager:
             poolclass=poolclass,
             **pool_kwargs
         )
+        if database_url.startswith("sqlite"):
+            configure_sqlite(self.engine, sqlite_pragmas())
+        self.pool_usage = PoolUsage(self.engine)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
     
     def create_tables(self):
         """Create all tables."""
+        existing_tables = set(inspect(self.engine).get_table_names())
         Base.metadata.create_all(bind=self.engine)
+        added = self.add_missing_columns()
+        if "conversation_history" in existing_tables and "conversation_messages" not in existing_tables:
+            self.migrate_conversation_messages()
+        if {"projects.task_id", "conversation_history.task_id"} & set(added):
+            self.backfill_task_ids()
+        if "conversation_history.message_count" in added:
+            self.backfill_conversation_summaries()
+        if "cost_records.task_id" in added:
+            self.relax_cost_record_project_id()
+        if "cost_records" in existing_tables and "project_cost_rollups" not in existing_tables:
+            self.backfill_cost_rollups()
+    
+    def add_missing_columns(self) -> List[str]:
+        """Add columns and indexes defined on models but missing from existing tables.
+        
+        create_all() only creates missing tables, so columns added to a model later
+        are added here with ALTER TABLE. Existing rows get NULL for them.
+        
+        Returns:
+            Added columns as "table.column"
+        """
+        added = []
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+                existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    added.append(f"{table.name}.{column.name}")
+                    print(f"✅ [DB] Added column {table.name}.{column.name}")
+                for index in table.indexes:
+                    if index.name not in existing_indexes:
+                        index.create(conn)
+                        print(f"✅ [DB] Added index {index.name}")
+        return added
+    
+    def backfill_task_ids(self):
+        """Copy extra_data["task_id"] of existing projects and conversations to their task_id column."""
+        db = self.get_session()
+        try:
+            for model in (ProjectModel, ConversationHistoryModel):
+                filled = 0
+                rows = db.query(model).filter(model.task_id.is_(None), model.extra_data.isnot(None))
+                for row in rows.yield_per(500):
+                    if isinstance(row.extra_data, dict) and row.extra_data.get("task_id"):
+                        row.task_id = row.extra_data["task_id"]
+                        filled += 1
+                db.commit()
+                print(f"✅ [DB] Backfilled task_id of {filled} rows in {model.__tablename__}")
+        finally:
+            db.close()
+    
+    def migrate_conversation_messages(self):
+        """Move the JSON message arrays of existing conversations into conversation_messages."""
+        db = self.get_session()
+        try:
+            migrated = 0
+            convs = db.query(ConversationHistoryModel).options(undefer(ConversationHistoryModel.messages))
+            for conv in convs.yield_per(100):
+                if not conv.messages:
+                    continue
+                db.add_all(
+                    ConversationMessageModel.from_dict(conv.id, position, message)
+                    for position, message in enumerate(conv.messages)
+                )
+                conv.summarize(len(conv.messages), conv.messages[-1])
+                conv.messages = []
+                migrated += 1
+            db.commit()
+            print(f"✅ [DB] Moved messages of {migrated} conversations to conversation_messages")
+        finally:
+            db.close()
+    
+    def backfill_conversation_summaries(self):
+        """Set message_count and last_message_preview of existing conversations."""
+        db = self.get_session()
+        try:
+            last_positions = db.query(
+                ConversationMessageModel.conversation_id,
+                func.max(ConversationMessageModel.position).label("last_position")
+            ).group_by(ConversationMessageModel.conversation_id).subquery()
+            last_messages = db.query(ConversationMessageModel).join(
+                last_positions,
+                and_(
+                    ConversationMessageModel.conversation_id == last_positions.c.conversation_id,
+                    ConversationMessageModel.position == last_positions.c.last_position
+                )
+            )
+            last_by_conversation = {message.conversation_id: message for message in last_messages}
+            for conv in db.query(ConversationHistoryModel):
+                last = last_by_conversation.get(conv.id)
+                conv.summarize(last.position + 1 if last else 0, last.to_dict() if last else None)
+            db.commit()
+            print(f"✅ [DB] Backfilled message summaries of {len(last_by_conversation)} conversations")
+        finally:
+            db.close()
+    
+    def relax_cost_record_project_id(self):
+        """Allow cost records without a project; calls are recorded before their task's project exists."""
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name != "sqlite":
+                conn.execute(text("ALTER TABLE cost_records ALTER COLUMN project_id DROP NOT NULL"))
+            else:
+                # SQLite cannot alter a column constraint, so the table is rebuilt
+                columns = ", ".join(c.name for c in CostRecordModel.__table__.columns)
+                conn.execute(text("ALTER TABLE cost_records RENAME TO cost_records_old"))
+                for index in inspect(conn).get_indexes("cost_records_old"):
+                    conn.execute(text(f"DROP INDEX {index['name']}"))
+                CostRecordModel.__table__.create(conn)
+                conn.execute(text(f"INSERT INTO cost_records ({columns}) SELECT {columns} FROM cost_records_old"))
+                conn.execute(text("DROP TABLE cost_records_old"))
+        print("✅ [DB] Cost records no longer require a project")
+    
+    def backfill_cost_rollups(self):
+        """Compute the cost rollups of cost records inserted before rollups existed."""
+        db = self.get_session()
+        try:
+            sums = [
+                func.count(CostRecordModel.id),
+                func.sum(CostRecordModel.prompt_tokens),
+                func.sum(CostRecordModel.completion_tokens),
+                func.sum(CostRecordModel.total_cost)
+            ]
+            day = func.substr(func.cast(CostRecordModel.created_at, String), 1, 10)
+            groups = [
+                (ProjectCostRollupModel, ["project_id"], [CostRecordModel.project_id], CostRecordModel.project_id.isnot(None)),
+                (UserCostRollupModel, ["user_id"], [CostRecordModel.user_id], CostRecordModel.user_id.isnot(None)),
+                (DailyCostRollupModel, ["day", "user_id"], [day, func.coalesce(CostRecordModel.user_id, 0)], CostRecordModel.created_at.isnot(None)),
+            ]
+            for model, key_names, key_columns, condition in groups:
+                for row in db.query(*key_columns, *sums).filter(condition).group_by(*key_columns).all():
+                    key, (calls, prompt_tokens, completion_tokens, total_cost) = row[:len(key_names)], row[len(key_names):]
+                    db.add(model(
+                        **dict(zip(key_names, key)),
+                        calls=calls,
+                        prompt_tokens=prompt_tokens or 0,
+                        completion_tokens=completion_tokens or 0,
+                        total_cost=total_cost or 0.0
+                    ))
+            db.commit()
+            print("✅ [DB] Backfilled cost rollups")
+        finally:
+            db.close()
     
     def drop_tables(self):
         """Drop all tables."""
         Base.metadata.drop_all(bind=self.engine)
     
+    @contextmanager
+    def transaction(self) -> Iterator["DatabaseManager"]:
+        """Run several operations as one unit of work.
+        
+        Operations called on the yielded manager share one session and
+        connection and are committed together when the block ends, or rolled
+        back if it raises. Returned objects stay loaded after the commit.
+        
+        Example:
+            with db.transaction() as uow:
+                project = uow.create_project(project_create, user_id)
+                uow.update_project_status(project.id, "completed")
+        """
+        session = self.SessionLocal(expire_on_commit=False)
+        try:
+            yield _UnitOfWorkManager(session)
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
     def get_session(self) -> Session:
         """Get database session."""
         return self.SessionLocal()
@@ -332,8 +767,8 @@ class DatabaseManager:
             db.close()
     
     # Project operations
-    def create_project(self, project: ProjectCreate, user_id: int) -> ProjectModel:
-        """Create a new project."""
+    def create_project(self, project: ProjectCreate, user_id: int, task_id: Optional[str] = None) -> ProjectModel:
+        """Create a new project, optionally linked to the task that generated it."""
         db = self.get_session()
         try:
             db_project = ProjectModel(
@@ -341,7 +776,8 @@ class DatabaseManager:
                 name=project.name,
                 description=project.description,
                 idea=project.idea,
-                investment=project.investment
+                investment=project.investment,
+                task_id=task_id
             )
             db.add(db_project)
             db.commit()
@@ -358,6 +794,32 @@ class DatabaseManager:
         finally:
             db.close()
     
+    def get_project_by_task_id(self, task_id: str) -> Optional[ProjectModel]:
+        """Get the project generated by a task, else the project of a conversation about the task."""
+        db = self.get_session()
+        try:
+            project = db.query(ProjectModel).filter(
+                ProjectModel.task_id == task_id
+            ).order_by(ProjectModel.id.desc()).first()
+            if project:
+                return project
+            return db.query(ProjectModel).join(
+                ConversationHistoryModel, ConversationHistoryModel.project_id == ProjectModel.id
+            ).filter(ConversationHistoryModel.task_id == task_id).first()
+        finally:
+            db.close()
+    
+    def update_project_extra_data(self, project_id: int, **fields):
+        """Merge fields into a project's extra_data."""
+        db = self.get_session()
+        try:
+            project = db.query(ProjectModel).filter(ProjectModel.id == project_id).first()
+            if project:
+                project.extra_data = {**(project.extra_data or {}), **fields}
+                db.commit()
+        finally:
+            db.close()
+    
     def update_project_status(self, project_id: int, status: str, project_path: Optional[str] = None):
         """Update project status."""
         db = self.get_session()
@@ -397,17 +859,114 @@ class DatabaseManager:
     
     # Cost record operations
     def create_cost_record(self, cost: CostRecordCreate) -> CostRecordModel:
-        """Create a cost record."""
+        """Create a cost record and add it to the rollups."""
         db = self.get_session()
         try:
-            db_cost = CostRecordModel(**cost.dict())
+            db_cost = CostRecordModel(**{"created_at": datetime.utcnow(), **cost.dict(exclude_none=True)})
             db.add(db_cost)
+            db.flush()
+            self._add_to_rollups(db, [db_cost])
             db.commit()
             db.refresh(db_cost)
             return db_cost
         finally:
             db.close()
     
+    def record_costs(self, costs: List[CostRecordCreate]) -> int:
+        """Insert a batch of cost records and add them to the rollups in one transaction.
+        
+        Returns:
+            Number of records inserted
+        """
+        if not costs:
+            return 0
+        db = self.get_session()
+        try:
+            now = datetime.utcnow()
+            rows = [{"created_at": now, **cost.dict(exclude_none=True)} for cost in costs]
+            db.execute(CostRecordModel.__table__.insert(), rows)
+            self._add_to_rollups(db, [CostRecordModel(**row) for row in rows])
+            db.commit()
+            return len(rows)
+        finally:
+            db.close()
+    
+    def _add_to_rollups(self, db: Session, records: List[CostRecordModel]):
+        """Increment the project, user and daily rollups by the totals of records."""
+        increments: Dict[Tuple[type, tuple], dict] = {}
+        for record in records:
+            keys = [(DailyCostRollupModel, (("day", record.created_at.strftime("%Y-%m-%d")), ("user_id", record.user_id or 0)))]
+            if record.user_id:
+                keys.append((UserCostRollupModel, (("user_id", record.user_id),)))
+            if record.project_id:
+                keys.append((ProjectCostRollupModel, (("project_id", record.project_id),)))
+            for key in keys:
+                totals = increments.setdefault(key, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_cost": 0.0})
+                totals["calls"] += 1
+                totals["prompt_tokens"] += record.prompt_tokens or 0
+                totals["completion_tokens"] += record.completion_tokens or 0
+                totals["total_cost"] += record.total_cost or 0.0
+        for (model, key), totals in increments.items():
+            self._increment_rollup(db, model, dict(key), totals)
+    
+    def _increment_rollup(self, db: Session, model: type, key: dict, totals: dict):
+        """Add totals to a rollup row, creating it if needed."""
+        now = datetime.utcnow()
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            statement = upsert(model).values(**key, **totals, updated_at=now)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=list(key),
+                set_={
+                    **{name: getattr(model, name) + statement.excluded[name] for name in totals},
+                    "updated_at": now
+                }
+            ))
+            return
+        updated = db.query(model).filter_by(**key).update(
+            {**{name: getattr(model, name) + value for name, value in totals.items()}, "updated_at": now},
+            synchronize_session=False
+        )
+        if not updated:
+            db.add(model(**key, **totals, updated_at=now))
+            db.flush()
+    
+    def assign_task_costs(self, task_id: str, project_id: int) -> int:
+        """Attribute the cost records of a task to the project it produced.
+        
+        Returns:
+            Number of records newly attributed
+        """
+        db = self.get_session()
+        try:
+            unassigned = db.query(CostRecordModel).filter(
+                CostRecordModel.task_id == task_id,
+                CostRecordModel.project_id.is_(None)
+            )
+            calls, prompt_tokens, completion_tokens, total_cost = unassigned.with_entities(
+                func.count(CostRecordModel.id),
+                func.sum(CostRecordModel.prompt_tokens),
+                func.sum(CostRecordModel.completion_tokens),
+                func.sum(CostRecordModel.total_cost)
+            ).one()
+            if not calls:
+                return 0
+            unassigned.update({"project_id": project_id}, synchronize_session=False)
+            self._increment_rollup(db, ProjectCostRollupModel, {"project_id": project_id}, {
+                "calls": calls,
+                "prompt_tokens": prompt_tokens or 0,
+                "completion_tokens": completion_tokens or 0,
+                "total_cost": total_cost or 0.0
+            })
+            db.commit()
+            return calls
+        finally:
+            db.close()
+    
     def get_project_costs(self, project_id: int) -> List[CostRecordModel]:
         """Get all cost records for a project."""
         db = self.get_session()
@@ -417,13 +976,32 @@ class DatabaseManager:
             db.close()
     
     def get_total_cost(self, project_id: int) -> float:
-        """Get total cost for a project."""
+        """Get total cost for a project from its rollup."""
         db = self.get_session()
         try:
-            result = db.query(CostRecordModel).filter(
-                CostRecordModel.project_id == project_id
-            ).with_entities(CostRecordModel.total_cost).all()
-            return sum(r[0] for r in result)
+            total = db.query(ProjectCostRollupModel.total_cost).filter(
+                ProjectCostRollupModel.project_id == project_id
+            ).scalar()
+            return total or 0.0
+        finally:
+            db.close()
+    
+    def get_cost_summary(self, user_id: int, days: int = 30) -> dict:
+        """Get a user's cost totals and their daily totals over the last days, from the rollups."""
+        db = self.get_session()
+        try:
+            rollup = db.get(UserCostRollupModel, user_id)
+            since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+            daily = db.query(DailyCostRollupModel).filter(
+                DailyCostRollupModel.user_id == user_id,
+                DailyCostRollupModel.day >= since
+            ).order_by(DailyCostRollupModel.day).all()
+            empty = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_cost": 0.0}
+            return {
+                "user_id": user_id,
+                "totals": rollup.totals() if rollup else empty,
+                "daily": [{"day": row.day, **row.totals()} for row in daily]
+            }
         finally:
             db.close()
     
@@ -452,6 +1030,18 @@ class DatabaseManager:
         finally:
             db.close()
     
+    def update_password_hash(self, user_id: int, password_hash: str):
+        """Replace a user's password hash."""
+        db = self.get_session()
+        try:
+            db.query(UserModel).filter(UserModel.id == user_id).update(
+                {"password_hash": password_hash, "updated_at": datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+    
     # Conversation history operations
     def create_conversation(self, conversation: ConversationCreate) -> ConversationHistoryModel:
         """Create a new conversation."""
@@ -461,10 +1051,17 @@ class DatabaseManager:
                 user_id=conversation.user_id,
                 project_id=conversation.project_id,
                 title=conversation.title,
-                messages=conversation.messages,
-                extra_data=conversation.extra_data
+                messages=[],
+                extra_data=conversation.extra_data,
+                task_id=(conversation.extra_data or {}).get("task_id")
             )
+            db_conv.summarize(len(conversation.messages), conversation.messages[-1] if conversation.messages else None)
             db.add(db_conv)
+            db.flush()
+            db.add_all(
+                ConversationMessageModel.from_dict(db_conv.id, position, message)
+                for position, message in enumerate(conversation.messages)
+            )
             db.commit()
             db.refresh(db_conv)
             return db_conv
@@ -481,6 +1078,16 @@ class DatabaseManager:
         finally:
             db.close()
     
+    def get_conversation_by_task_id(self, task_id: str) -> Optional[ConversationHistoryModel]:
+        """Get the conversation that started a task."""
+        db = self.get_session()
+        try:
+            return db.query(ConversationHistoryModel).filter(
+                ConversationHistoryModel.task_id == task_id
+            ).first()
+        finally:
+            db.close()
+    
     def update_conversation(self, conversation_id: int, conversation_update: ConversationUpdate) -> Optional[ConversationHistoryModel]:
         """Update conversation."""
         db = self.get_session()
@@ -492,7 +1099,9 @@ class DatabaseManager:
                 if conversation_update.title is not None:
                     conv.title = conversation_update.title
                 if conversation_update.messages is not None:
-                    conv.messages = conversation_update.messages
+                    self._replace_messages(db, conversation_id, conversation_update.messages)
+                    messages = conversation_update.messages
+                    conv.summarize(len(messages), messages[-1] if messages else None)
                 conv.updated_at = datetime.utcnow()
                 db.commit()
                 db.refresh(conv)
@@ -500,8 +1109,77 @@ class DatabaseManager:
         finally:
             db.close()
     
+    def _replace_messages(self, db: Session, conversation_id: int, messages: list):
+        """Make a conversation's messages equal to a full list, rewriting only from the first change."""
+        stored = db.query(ConversationMessageModel).filter(
+            ConversationMessageModel.conversation_id == conversation_id
+        ).order_by(ConversationMessageModel.position).all()
+        unchanged = 0
+        for row, message in zip(stored, messages):
+            if row.to_dict() != message:
+                break
+            unchanged += 1
+        if unchanged < len(stored):
+            db.query(ConversationMessageModel).filter(
+                ConversationMessageModel.conversation_id == conversation_id,
+                ConversationMessageModel.position >= unchanged
+            ).delete()
+            db.flush()
+        db.add_all(
+            ConversationMessageModel.from_dict(conversation_id, position, message)
+            for position, message in enumerate(messages[unchanged:], start=unchanged)
+        )
+    
+    def append_conversation_messages(self, conversation_id: int, messages: list) -> int:
+        """Append messages to a conversation.
+        
+        Returns:
+            Number of messages in the conversation afterwards
+        """
+        db = self.get_session()
+        try:
+            last = db.query(func.max(ConversationMessageModel.position)).filter(
+                ConversationMessageModel.conversation_id == conversation_id
+            ).scalar()
+            count = 0 if last is None else last + 1
+            db.add_all(
+                ConversationMessageModel.from_dict(conversation_id, position, message)
+                for position, message in enumerate(messages, start=count)
+            )
+            conv = db.query(ConversationHistoryModel).filter(ConversationHistoryModel.id == conversation_id).first()
+            if messages:
+                conv.summarize(count + len(messages), messages[-1])
+            conv.updated_at = datetime.utcnow()
+            db.commit()
+            return count + len(messages)
+        finally:
+            db.close()
+    
+    def list_conversation_messages(self, conversation_id: int, after: int = -1, limit: int = 200) -> Tuple[list, Optional[int]]:
+        """Page through a conversation's messages in order.
+        
+        Args:
+            conversation_id: Conversation
+            after: Position of the last message of the previous page
+            limit: Messages per page
+        
+        Returns:
+            (messages, position of the last one if more follow, else None)
+        """
+        db = self.get_session()
+        try:
+            rows = db.query(ConversationMessageModel).filter(
+                ConversationMessageModel.conversation_id == conversation_id,
+                ConversationMessageModel.position > after
+            ).order_by(ConversationMessageModel.position).limit(limit + 1).all()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            return [row.to_dict() for row in rows], (rows[-1].position if more else None)
+        finally:
+            db.close()
+    
     def list_conversations(self, user_id: int, project_id: Optional[int] = None, skip: int = 0, limit: int = 100) -> List[ConversationHistoryModel]:
-        """List conversations for a user."""
+        """List conversations for a user, most recently updated first (messages are not loaded)."""
         db = self.get_session()
         try:
             query = db.query(ConversationHistoryModel).filter(
@@ -522,6 +1200,9 @@ class DatabaseManager:
                 ConversationHistoryModel.user_id == user_id
             ).first()
             if conv:
+                db.query(ConversationMessageModel).filter(
+                    ConversationMessageModel.conversation_id == conversation_id
+                ).delete()
                 db.delete(conv)
                 db.commit()
                 return True
@@ -530,7 +1211,17 @@ class DatabaseManager:
             db.close()
     
     # Task operations
-    def create_task(self, task_id: str, idea: str, investment: float = 5.0, n_round: int = 5) -> TaskModel:
+    def create_task(
+        self,
+        task_id: str,
+        idea: str,
+        investment: float = 5.0,
+        n_round: int = 5,
+        kind: str = "generate",
+        parent_task_id: Optional[str] = None,
+        user_id: Optional[int] = None,
+        priority_class: str = "interactive"
+    ) -> TaskModel:
         """Create a new task."""
         db = self.get_session()
         try:
@@ -544,7 +1235,12 @@ class DatabaseManager:
                 investment=investment,
                 n_round=n_round,
                 result=None,
-                error=None
+                error=None,
+                kind=kind,
+                parent_task_id=parent_task_id,
+                user_id=user_id,
+                priority_class=priority_class,
+                queued_at=datetime.utcnow()
             )
             db.add(task)
             db.commit()
@@ -583,6 +1279,7 @@ class DatabaseManager:
         try:
             task = db.query(TaskModel).filter(TaskModel.task_id == task_id).first()
             if task:
+                db.query(TaskMessageModel).filter(TaskMessageModel.task_id == task_id).delete()
                 db.delete(task)
                 db.commit()
                 return True
@@ -590,17 +1287,559 @@ class DatabaseManager:
         finally:
             db.close()
     
-    def list_tasks(self, skip: int = 0, limit: int = 100) -> List[TaskModel]:
-        """List all tasks."""
+    def list_tasks(
+        self,
+        limit: int = 100,
+        after: Optional[Tuple[datetime, int]] = None,
+        statuses: Optional[List[str]] = None,
+        user_id: Optional[int] = None,
+        include_result: bool = False
+    ) -> list:
+        """List tasks newest first, one page at a time.
+        
+        Pages are keyset-paginated on (created_at, id), so a page costs the same
+        however many older tasks exist.
+        
+        Args:
+            limit: Tasks per page
+            after: (created_at, id) of the last task of the previous page
+            statuses: Only tasks in one of these statuses
+            user_id: Only tasks started by this user
+            include_result: Also load the result JSON
+        
+        Returns:
+            Rows with the TASK_SUMMARY_COLUMNS (and result if requested)
+        """
+        db = self.get_session()
+        try:
+            columns = TASK_SUMMARY_COLUMNS + ([TaskModel.result] if include_result else [])
+            query = db.query(*columns)
+            if statuses:
+                query = query.filter(TaskModel.status.in_(statuses))
+            if user_id is not None:
+                query = query.filter(TaskModel.user_id == user_id)
+            if after is not None:
+                created_at, row_id = after
+                query = query.filter(or_(
+                    TaskModel.created_at < created_at,
+                    and_(TaskModel.created_at == created_at, TaskModel.id < row_id)
+                ))
+            return query.order_by(TaskModel.created_at.desc(), TaskModel.id.desc()).limit(limit).all()
+        finally:
+            db.close()
+    
+    # Task queue operations
+    def _claimable(self, now: datetime, exclude_user_ids: Optional[List[int]] = None):
+        """Filter for tasks a worker may claim: queued, or running with an expired lease.
+        
+        Queued tasks of exclude_user_ids (users at their running limit) wait;
+        expired running tasks are always reclaimable.
+        """
+        pending = TaskModel.status == "pending"
+        if exclude_user_ids:
+            pending = and_(pending, or_(TaskModel.user_id.is_(None), TaskModel.user_id.notin_(exclude_user_ids)))
+        return or_(
+            pending,
+            and_(
+                TaskModel.status == "running",
+                or_(TaskModel.lease_expires_at.is_(None), TaskModel.lease_expires_at < now)
+            )
+        )
+    
+    def claim_task(
+        self,
+        worker_id: str,
+        lease_seconds: int,
+        exclude_user_ids: Optional[List[int]] = None,
+        candidate_ids: Optional[List[int]] = None
+    ) -> Optional[TaskModel]:
+        """Atomically claim a claimable task for a worker.
+        
+        The claim is a conditional UPDATE on the candidate row, so when two
+        workers race for the same task only one UPDATE matches (SQLite and
+        PostgreSQL alike); the loser moves on to the next candidate.
+        
+        Args:
+            candidate_ids: Task row ids to try in this order (as chosen by a
+                scheduler); by default the oldest claimable task is taken
+        """
+        db = self.get_session()
+        try:
+            for candidate in (candidate_ids if candidate_ids is not None else [None] * 5):
+                now = datetime.utcnow()
+                if candidate is None:
+                    candidate = db.query(TaskModel.id).filter(
+                        self._claimable(now, exclude_user_ids)
+                    ).order_by(TaskModel.queued_at.asc(), TaskModel.id.asc()).limit(1).scalar()
+                    if candidate is None:
+                        return None
+                claimed = db.query(TaskModel).filter(
+                    TaskModel.id == candidate,
+                    self._claimable(now, exclude_user_ids)
+                ).update({
+                    TaskModel.status: "running",
+                    TaskModel.lease_owner: worker_id,
+                    TaskModel.lease_expires_at: now + timedelta(seconds=lease_seconds),
+                    TaskModel.attempts: func.coalesce(TaskModel.attempts, 0) + 1,
+                    TaskModel.started_at: now,
+                    TaskModel.updated_at: now
+                }, synchronize_session=False)
+                db.commit()
+                if claimed == 1:
+                    return db.query(TaskModel).filter(TaskModel.id == candidate).first()
+            return None
+        finally:
+            db.close()
+    
+    def renew_lease(self, task_id: str, worker_id: str, lease_seconds: int) -> bool:
+        """Extend a worker's lease; False if the task is no longer running under it."""
+        db = self.get_session()
+        try:
+            renewed = db.query(TaskModel).filter(
+                TaskModel.task_id == task_id,
+                TaskModel.lease_owner == worker_id,
+                TaskModel.status == "running"
+            ).update({
+                TaskModel.lease_expires_at: datetime.utcnow() + timedelta(seconds=lease_seconds)
+            }, synchronize_session=False)
+            db.commit()
+            return renewed == 1
+        finally:
+            db.close()
+    
+    def release_task(self, task_id: str, worker_id: str, requeue: bool = False):
+        """Drop a worker's lease, optionally putting a still-running task back in the queue."""
+        db = self.get_session()
+        try:
+            values = {TaskModel.lease_owner: None, TaskModel.lease_expires_at: None}
+            query = db.query(TaskModel).filter(
+                TaskModel.task_id == task_id,
+                TaskModel.lease_owner == worker_id
+            )
+            if requeue:
+                query = query.filter(TaskModel.status == "running")
+                values[TaskModel.status] = "pending"
+                values[TaskModel.queued_at] = datetime.utcnow()
+            query.update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+    
+    def list_queue_heads(self, exclude_user_ids: Optional[List[int]] = None) -> List[dict]:
+        """Get scheduling candidates: the oldest queued task of each (priority class, user),
+        plus running tasks whose lease expired.
+        
+        Returns:
+            List of dicts with id, user_id, tier, priority_class, queued_at and expired
+        """
+        db = self.get_session()
+        try:
+            now = datetime.utcnow()
+            priority_class = func.coalesce(TaskModel.priority_class, "interactive")
+            rank = func.row_number().over(
+                partition_by=(priority_class, TaskModel.user_id),
+                order_by=(TaskModel.queued_at.asc(), TaskModel.id.asc())
+            ).label("rank")
+            pending = TaskModel.status == "pending"
+            if exclude_user_ids:
+                pending = and_(pending, or_(TaskModel.user_id.is_(None), TaskModel.user_id.notin_(exclude_user_ids)))
+            ranked = db.query(
+                TaskModel.id, TaskModel.user_id, priority_class.label("priority_class"), TaskModel.queued_at, rank
+            ).filter(pending).subquery()
+            heads = db.query(ranked, UserModel.tier).outerjoin(
+                UserModel, UserModel.id == ranked.c.user_id
+            ).filter(ranked.c.rank == 1).all()
+            expired = db.query(
+                TaskModel.id, TaskModel.user_id, priority_class, TaskModel.queued_at
+            ).filter(
+                TaskModel.status == "running",
+                or_(TaskModel.lease_expires_at.is_(None), TaskModel.lease_expires_at < now)
+            ).all()
+            return [
+                {"id": row.id, "user_id": row.user_id, "tier": row.tier, "priority_class": row.priority_class,
+                 "queued_at": row.queued_at, "expired": False}
+                for row in heads
+            ] + [
+                {"id": id, "user_id": user_id, "tier": None, "priority_class": cls,
+                 "queued_at": queued_at, "expired": True}
+                for id, user_id, cls, queued_at in expired
+            ]
+        finally:
+            db.close()
+    
+    def count_running_tasks_by_user(self) -> Dict[int, Tuple[int, Optional[str]]]:
+        """Get {user_id: (running task count, user tier)} for users with running tasks."""
+        db = self.get_session()
+        try:
+            rows = db.query(TaskModel.user_id, UserModel.tier, func.count(TaskModel.id)).join(
+                UserModel, UserModel.id == TaskModel.user_id
+            ).filter(TaskModel.status == "running").group_by(TaskModel.user_id, UserModel.tier).all()
+            return {user_id: (count, tier) for user_id, tier, count in rows}
+        finally:
+            db.close()
+    
+    def get_user_task_usage(self, user_id: int, since: datetime) -> dict:
+        """Get a user's running/queued task counts and spend on tasks created since a time."""
+        db = self.get_session()
+        try:
+            counts = dict(db.query(TaskModel.status, func.count(TaskModel.id)).filter(
+                TaskModel.user_id == user_id,
+                TaskModel.status.in_(["pending", "running"])
+            ).group_by(TaskModel.status).all())
+            spend, oldest = db.query(func.sum(TaskModel.cost), func.min(TaskModel.created_at)).filter(
+                TaskModel.user_id == user_id,
+                TaskModel.created_at >= since,
+                TaskModel.cost > 0
+            ).one()
+            return {
+                "running": counts.get("running", 0),
+                "queued": counts.get("pending", 0),
+                "spend": spend or 0.0,
+                "oldest_spend_at": oldest
+            }
+        finally:
+            db.close()
+    
+    def lock_user(self, user_id: int):
+        """Lock a user's row until the transaction ends, serializing admission of their tasks.
+        
+        Uses SELECT ... FOR UPDATE on PostgreSQL; on SQLite the writing
+        transaction already holds the database's single writer.
+        """
+        db = self.get_session()
+        try:
+            db.query(UserModel.id).filter(UserModel.id == user_id).with_for_update().first()
+        finally:
+            db.close()
+    
+    def _queue_stats(self, db: Session, now: datetime, recent: int, priority_class: Optional[str] = None) -> dict:
+        """Queue depth and wait times, optionally for one priority class."""
+        def scoped(query):
+            if priority_class is None:
+                return query
+            return query.filter(func.coalesce(TaskModel.priority_class, "interactive") == priority_class)
+        
+        counts = dict(scoped(db.query(TaskModel.status, func.count(TaskModel.id)).filter(
+            TaskModel.status.in_(["pending", "running"])
+        )).group_by(TaskModel.status).all())
+        oldest = scoped(db.query(func.min(TaskModel.queued_at)).filter(TaskModel.status == "pending")).scalar()
+        started = scoped(db.query(TaskModel.queued_at, TaskModel.started_at).filter(
+            TaskModel.started_at.isnot(None),
+            TaskModel.queued_at.isnot(None)
+        )).order_by(TaskModel.started_at.desc()).limit(recent).all()
+        waits = sorted(max(0.0, (s - q).total_seconds()) for q, s in started)
+        return {
+            "depth": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "oldest_wait_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+            "avg_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait_seconds": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        }
+    
+    def get_queue_stats(self, recent: int = 100) -> dict:
+        """Get queue depth and wait times (seconds between queued_at and claim), overall and per priority class."""
+        db = self.get_session()
+        try:
+            now = datetime.utcnow()
+            classes = [c for (c,) in db.query(
+                func.coalesce(TaskModel.priority_class, "interactive")
+            ).distinct().all()]
+            return {
+                **self._queue_stats(db, now, recent),
+                "classes": {c: self._queue_stats(db, now, recent, c) for c in sorted(classes)}
+            }
+        finally:
+            db.close()
+    
+    # Task checkpoint operations
+    def save_task_message(
+        self,
+        task_id: str,
+        seq: int,
+        message: dict,
+        queue_state: dict,
+        cost: float = 0.0,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0
+    ) -> TaskMessageModel:
+        """Persist a published team message together with role queue state."""
+        db = self.get_session()
+        try:
+            record = TaskMessageModel(
+                task_id=task_id,
+                seq=seq,
+                role=message.get("role"),
+                cause_by=message.get("cause_by"),
+                sent_from=message.get("sent_from"),
+                send_to=message.get("send_to"),
+                content=message.get("content", ""),
+                extra_data=message.get("metadata") or {},
+                queue_state=queue_state,
+                cost=cost,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens
+            )
+            db.add(record)
+            db.commit()
+            db.refresh(record)
+            return record
+        finally:
+            db.close()
+    
+    def list_task_messages(self, task_id: str) -> List[TaskMessageModel]:
+        """Get all checkpointed messages for a task in publish order."""
         db = self.get_session()
         try:
-            return db.query(TaskModel).order_by(TaskModel.created_at.desc()).offset(skip).limit(limit).all()
+            return db.query(TaskMessageModel).filter(
+                TaskMessageModel.task_id == task_id
+            ).order_by(TaskMessageModel.seq.asc()).all()
         finally:
             db.close()
 
 
-# Global database instance
+T = TypeVar("T")
+
+# Async drivers used for each database dialect
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def to_async_url(database_url: str) -> str:
+    """Switch a database URL to the async driver of its dialect (e.g. sqlite:// -> sqlite+aiosqlite://)."""
+    scheme, rest = database_url.split("://", 1)
+    dialect = scheme.split("+")[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}://{rest}"
+
+
+def async_engine_args(database_url: str) -> Tuple[URL, dict]:
+    """Async URL and connect_args for a database URL written for the sync (psycopg2) driver.
+    
+    asyncpg rejects libpq query parameters, so on PostgreSQL `sslmode` becomes
+    asyncpg's `ssl` argument, and `pgbouncer` is dropped in favour of turning
+    off prepared statement caches, which PgBouncer's pooling does not support.
+    """
+    url = make_url(to_async_url(database_url))
+    connect_args = {}
+    if url.drivername == "postgresql+asyncpg":
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        if sslmode:
+            connect_args["ssl"] = sslmode  # asyncpg takes libpq's mode names
+        if str(query.pop("pgbouncer", "")).lower() == "true":
+            connect_args["statement_cache_size"] = 0
+            query["prepared_statement_cache_size"] = "0"
+        url = url.set(query=query)
+    return url, connect_args
+
+
+class _SessionBoundManager(DatabaseManager):
+    """DatabaseManager running its operations on a given session instead of opening its own."""
+    
+    def __init__(self, session: Session):
+        self._session = session
+    
+    def get_session(self) -> Session:
+        return self._session
+
+
+class _UnitOfWorkSession:
+    """Session of a unit of work, as seen by DatabaseManager operations.
+    
+    Operations commit and close their session when they finish; within a unit
+    of work a commit only flushes and close does nothing, so the work is
+    committed once, by the transaction.
+    """
+    
+    def __init__(self, session: Session):
+        self._session = session
+    
+    def commit(self):
+        self._session.flush()
+    
+    def close(self):
+        pass
+    
+    def __getattr__(self, name: str):
+        return getattr(self._session, name)
+
+
+class _UnitOfWorkManager(_SessionBoundManager):
+    """DatabaseManager running its operations in a unit of work."""
+    
+    def __init__(self, session: Session):
+        super().__init__(_UnitOfWorkSession(session))
+
+
+class AsyncUnitOfWork:
+    """Operations of an AsyncDatabaseManager.transaction(), as coroutines on its session."""
+    
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.operations = 0
+    
+    def __getattr__(self, name: str):
+        operation = getattr(DatabaseManager, name, None)
+        if name.startswith("_") or name in AsyncDatabaseManager._SYNC_ONLY or not callable(operation):
+            raise AttributeError(f"{type(self).__name__} has no operation {name!r}")
+        
+        async def call(*args, **kwargs):
+            self.operations += 1
+            return await self.session.run_sync(
+                lambda sync_session: operation(_UnitOfWorkManager(sync_session), *args, **kwargs)
+            )
+        
+        call.__name__ = name
+        call.__doc__ = operation.__doc__
+        setattr(self, name, call)
+        return call
+
+
+class AsyncDatabaseManager:
+    """Async counterpart of DatabaseManager for code running on the event loop.
+    
+    Every DatabaseManager operation is available as a coroutine with the same
+    arguments, e.g. `await adb.get_task(task_id)`. Each call runs in its own
+    session on an AsyncEngine (aiosqlite for SQLite, asyncpg for PostgreSQL),
+    so queries and commits do not block the event loop; returned objects are
+    detached, as with DatabaseManager. The CLI, scripts and worker threads
+    keep using the synchronous DatabaseManager on the same database.
+    
+    On SQLite, which allows one writer at a time, operations that write are
+    serialized through a single writer so concurrent tasks queue here instead
+    of contending for the database lock; reads run concurrently. The writer
+    is per event loop: worker processes (MGX_WORKER_MODE=process), other
+    nodes and synchronous DatabaseManager writes still contend for the lock,
+    and only busy_timeout (MGX_SQLITE_BUSY_TIMEOUT_MS) makes them wait for
+    each other instead of failing with "database is locked".
+    """
+    
+    # Schema management stays with the synchronous manager
+    _SYNC_ONLY = {
+        "create_tables", "add_missing_columns", "migrate_conversation_messages", "backfill_task_ids",
+        "backfill_conversation_summaries", "relax_cost_record_project_id",
+        "backfill_cost_rollups", "drop_tables", "get_session", "transaction"
+    }
+    # Operations that only read, and need not wait for the writer
+    _READ_PREFIXES = ("get_", "list_", "count_")
+    
+    def __init__(self, database_url: Optional[str] = None):
+        """Initialize async database manager.
+        
+        Args:
+            database_url: Database connection URL in its synchronous form (defaults to
+                DATABASE_URL env var or SQLite); the async driver is picked automatically
+        """
+        if database_url is None:
+            database_url = os.getenv("DATABASE_URL", "sqlite:///./mgx_backend.db")
+        
+        pool_kwargs = {}
+        if not database_url.startswith("sqlite"):
+            pool_kwargs = {
+                "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+                "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+                "pool_pre_ping": True,
+                "pool_recycle": 3600,
+            }
+        async_url, connect_args = async_engine_args(database_url)
+        self.engine = create_async_engine(async_url, connect_args=connect_args, **pool_kwargs)
+        self.SessionLocal = async_sessionmaker(self.engine, autoflush=False)
+        pragmas = sqlite_pragmas() if database_url.startswith("sqlite") else {}
+        configure_sqlite(self.engine.sync_engine, pragmas)
+        self.pool_usage = PoolUsage(self.engine.sync_engine)
+        self.serialize_writes = bool(pragmas)
+        self._writer_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+        self.writes = 0  # Operations run by the serialized writer
+        self.writer_wait_seconds = 0.0  # Time spent queued for the writer
+    
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        """Scope an AsyncSession to a block; uncommitted work is rolled back when it ends."""
+        async with self.SessionLocal() as session:
+            yield session
+    
+    def _writer_lock(self) -> asyncio.Lock:
+        """Lock of the single writer in the running event loop (worker processes run one loop per task)."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._writer_locks:
+            self._writer_locks = {l: lock for l, lock in self._writer_locks.items() if not l.is_closed()}
+            self._writer_locks[loop] = asyncio.Lock()
+        return self._writer_locks[loop]
+    
+    @asynccontextmanager
+    async def _writer(self, write: bool) -> AsyncIterator[None]:
+        """Hold the single writer for a block if it may write on SQLite."""
+        if not (write and self.serialize_writes):
+            yield
+            return
+        queued_at = time.perf_counter()
+        async with self._writer_lock():
+            self.writer_wait_seconds += time.perf_counter() - queued_at
+            self.writes += 1
+            yield
+    
+    async def run(self, operation: Callable[[DatabaseManager], T], write: bool = True) -> T:
+        """Run synchronous DatabaseManager code on a single async session.
+        
+        Args:
+            operation: Callable receiving a DatabaseManager bound to the session
+            write: Whether the operation may write (serialized on SQLite)
+        """
+        async with self._writer(write):
+            return await self._run(operation)
+    
+    @asynccontextmanager
+    async def transaction(self, write: bool = True) -> AsyncIterator[AsyncUnitOfWork]:
+        """Run several operations as one unit of work.
+        
+        Operations awaited on the yielded unit of work share one session and
+        connection and are committed together when the block ends, or rolled
+        back if it raises. On SQLite a writing unit of work holds the single
+        writer for the whole block, so call operations on the unit of work,
+        not on this manager, inside it.
+        
+        Args:
+            write: Whether the work may write; read-only work skips the writer
+        
+        Example:
+            async with adb.transaction() as uow:
+                project = await uow.create_project(project_create, user_id)
+                await uow.update_project_status(project.id, "completed")
+        """
+        async with self._writer(write):
+            async with self.SessionLocal(expire_on_commit=False) as session:
+                yield AsyncUnitOfWork(session)
+                await session.commit()
+    
+    async def _run(self, operation: Callable[[DatabaseManager], T]) -> T:
+        async with self.session() as session:
+            return await session.run_sync(lambda sync_session: operation(_SessionBoundManager(sync_session)))
+    
+    def __getattr__(self, name: str):
+        operation = getattr(DatabaseManager, name, None)
+        if name.startswith("_") or name in self._SYNC_ONLY or not callable(operation):
+            raise AttributeError(f"{type(self).__name__} has no operation {name!r}")
+        
+        write = not name.startswith(self._READ_PREFIXES)
+        
+        async def call(*args, **kwargs):
+            return await self.run(lambda db: operation(db, *args, **kwargs), write=write)
+        
+        call.__name__ = name
+        call.__doc__ = operation.__doc__
+        setattr(self, name, call)
+        return call
+    
+    async def close(self):
+        """Close all pooled connections."""
+        await self.engine.dispose()
+
+
+# Global database instances
 db_manager: Optional[DatabaseManager] = None
+async_db_manager: Optional[AsyncDatabaseManager] = None
 
 
 def get_db_manager(database_url: Optional[str] = None) -> DatabaseManager:
@@ -626,4 +1865,24 @@ def get_db_manager(database_url: Optional[str] = None) -> DatabaseManager:
         db_manager = DatabaseManager(database_url)
         db_manager.create_tables()
     
-    return db_manager
\ No newline at end of file
+    return db_manager
+
+def get_async_db_manager(database_url: Optional[str] = None) -> AsyncDatabaseManager:
+    """Get or create the async database manager instance.
+    
+    The schema is created and migrated by the synchronous manager first.
+    
+    Args:
+        database_url: Optional database URL. If not provided, uses DATABASE_URL
+                     environment variable or defaults to SQLite.
+    
+    Returns:
+        AsyncDatabaseManager instance
+    """
+    global async_db_manager
+    
+    if async_db_manager is None:
+        get_db_manager(database_url)
+        async_db_manager = AsyncDatabaseManager(database_url)
+    
+    return async_db_manager
@@ -29,6 +29,27 @@ class Environment(BaseModel):
         # Notify all roles about the new message
         for role in self.roles.values():
             await role.observe(message)
+        
+        # Checkpoint the message once every role has observed it, so the
+        # persisted queue state reflects exactly what is left to do
+        callback = self.context.kwargs.get("checkpoint_callback")
+        if callback:
+            await callback(len(self.history) - 1, message, self.queue_state())
+    
+    def queue_state(self) -> Dict[str, List[int]]:
+        """Get pending news of every role as indexes into history."""
+        positions = {id(msg): i for i, msg in enumerate(self.history)}
+        return {
+            name: [positions[id(msg)] for msg in role._news if id(msg) in positions]
+            for name, role in self.roles.items()
+        }
+    
+    def restore(self, history: List[Message], queue_state: Dict[str, List[int]]):
+        """Restore history and role queues from a checkpoint."""
+        self.history = list(history)
+        for name, role in self.roles.items():
+            role._news = [self.history[i] for i in queue_state.get(name, []) if i < len(self.history)]
+            role._todo = None
     
     def get_roles(self) -> List[Any]:
         """Get all roles."""
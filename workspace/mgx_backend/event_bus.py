@@ -0,0 +1,145 @@
+"""Progress event bus delivering task updates to WebSocket subscribers on any node."""
+
+import abc
+import asyncio
+import json
+import os
+import uuid
+from typing import Awaitable, Callable, Optional
+
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+
+
+class EventBus(abc.ABC):
+    """Publish task progress events and deliver them to this node's subscribers.
+    
+    `deliver(task_id, data)` hands an event to local WebSocket connections; a
+    node calls it for every event published on the bus, whichever node
+    published it.
+    """
+    
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+    
+    async def start(self):
+        """Connect to the bus."""
+    
+    async def stop(self):
+        """Disconnect from the bus."""
+    
+    @abc.abstractmethod
+    async def publish(self, task_id: str, data: dict):
+        """Publish a progress event of a task."""
+
+
+class LocalEventBus(EventBus):
+    """In-process bus: events are delivered directly (single node)."""
+    
+    async def publish(self, task_id: str, data: dict):
+        await self.deliver(task_id, data)
+
+
+class RedisEventBus(EventBus):
+    """Bus over Redis pub/sub (or any server speaking the Redis protocol).
+    
+    Every node subscribes to one channel and delivers the events for which it
+    holds subscribers. If the server is unreachable, events are still
+    delivered locally and the subscription is retried in the background.
+    """
+    
+    def __init__(
+        self,
+        deliver: Deliver,
+        url: Optional[str] = None,
+        channel: Optional[str] = None,
+        client=None
+    ):
+        """Initialize Redis event bus.
+        
+        Args:
+            deliver: Async callback(task_id, data) delivering events to local subscribers
+            url: Server URL (defaults to REDIS_URL env var or redis://localhost:6379/0)
+            channel: Pub/sub channel (defaults to MGX_EVENT_CHANNEL env var or mgx:progress)
+            client: Existing redis.asyncio-compatible client, e.g. a local stand-in in tests
+        """
+        super().__init__(deliver)
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.channel = channel or os.getenv("MGX_EVENT_CHANNEL", "mgx:progress")
+        self.node_id = uuid.uuid4().hex[:8]
+        self._client = client
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+    
+    async def start(self):
+        """Connect and start listening for events."""
+        if self._client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("MGX_EVENT_BUS=redis requires the 'redis' package (pip install redis)")
+            self._client = redis.from_url(self.url)
+        self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            print(f"⚠️ [EventBus] Not subscribed to {self.channel} yet, retrying in background")
+    
+    async def stop(self):
+        """Stop listening and close the connection."""
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._client is not None:
+            await self._client.aclose()
+    
+    async def publish(self, task_id: str, data: dict):
+        """Publish an event to all nodes; delivered locally if the server is unreachable."""
+        payload = json.dumps({"task_id": task_id, "data": data}, default=str)
+        try:
+            await self._client.publish(self.channel, payload)
+        except Exception as e:
+            print(f"⚠️ [EventBus] Publish failed, delivering locally only: {e}")
+            await self.deliver(task_id, data)
+    
+    async def _listen(self):
+        """Deliver events from the channel, resubscribing after connection errors."""
+        delay = 0.5
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self._subscribed.set()
+                print(f"📡 [EventBus] Subscribed to {self.channel} (node {self.node_id})")
+                delay = 0.5
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    event = json.loads(message["data"])
+                    try:
+                        await self.deliver(event["task_id"], event["data"])
+                    except Exception as e:
+                        print(f"⚠️ [EventBus] Failed to deliver event for {event['task_id']}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                print(f"⚠️ [EventBus] Subscription lost ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def create_event_bus(deliver: Deliver) -> EventBus:
+    """Create the event bus selected by MGX_EVENT_BUS ("local" or "redis")."""
+    backend = os.getenv("MGX_EVENT_BUS", "local")
+    if backend == "redis":
+        return RedisEventBus(deliver)
+    if backend != "local":
+        raise ValueError(f"Unknown MGX_EVENT_BUS backend: {backend}")
+    return LocalEventBus(deliver)
@@ -0,0 +1,438 @@
+"""Replayable log of task progress events.
+
+Every progress event gets a per-task sequence number and is appended to a
+JSON-lines file, so a client that reconnects can ask for the events after
+the last one it saw. Recent events are also kept in an in-memory buffer
+on each node to serve replays without reading the file. Once a task
+finishes its file is compacted to the events still needed to rebuild the
+final state (chat messages, the last content of each file, the outcome).
+
+Transient events (stream chunks, thinking indicators) are numbered but
+only kept in the in-memory buffers, not written to the file: a stream
+chunk carries all text streamed so far, so logging every chunk would grow
+the file quadratically. A batch ending with transient events writes a
+small seq mark instead, so the file's last line always holds the task's
+latest number and another process (a resumed run, a cancellation on
+another node) continues after it. From the event loop, appends are written in
+batches by a thread and replays read the file in a thread (append_async(),
+replay_async(), snapshot_async()).
+
+The in-memory buffers are bounded: superseded events are coalesced (only
+the latest content of each file is kept), each task and all tasks together
+have a byte budget, and buffers of tasks without events for a while are
+dropped. Replays a buffer cannot serve are read from the file.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+# Events describing the task's outcome; the log is compacted after them
+TERMINAL_EVENTS = {"complete", "error", "cancelled"}
+
+# Events only meaningful while they are live, kept in memory but not in the log file
+TRANSIENT_EVENTS = {"stream_chunk", "thinking", "saving", "action_start", "action_executing"}
+
+# Type of the log lines recording the latest seq after transient events; never replayed
+SEQ_MARK = "seq_mark"
+
+
+def _supersede_key(event: dict) -> Optional[tuple]:
+    """Key of the state an event replaces; later events with the same key supersede it."""
+    event_type = event.get("type", "status")
+    if event_type in ("file_update", "file_content", "file_complete"):
+        return ("file", event.get("filepath"))
+    if event_type == "status":
+        return ("status",)
+    return None
+
+
+def _coalesce_key(event: dict) -> Hashable:
+    """Key under which an event is buffered; a newer event with the same key replaces it."""
+    if event.get("type") == "stream_chunk":
+        # Chunks carry the accumulated text, so the latest one per action is enough
+        return ("stream", event.get("role"), event.get("action"))
+    return _supersede_key(event) or ("seq", event["seq"])
+
+
+def coalesce_events(events: List[dict]) -> List[dict]:
+    """Keep only the latest of the events sharing a coalescing key, in order."""
+    latest = {_coalesce_key(event): i for i, event in enumerate(events)}
+    return [event for i, event in enumerate(events) if latest[_coalesce_key(event)] == i]
+
+
+def _event_size(event: dict) -> int:
+    """Approximate memory held by an event, in bytes of its JSON form."""
+    return len(json.dumps(event, default=str))
+
+
+class EventBuffer:
+    """Recent events of one task, coalesced by the state they update.
+    
+    The buffer holds the latest event of every key among the events since
+    `start_seq`, so it can serve any replay from `start_seq - 1` on.
+    """
+    
+    def __init__(self, start_seq: int):
+        self.start_seq = start_seq
+        self.last_seq = start_seq - 1
+        self.size = 0
+        self.touched = time.monotonic()
+        self._events: "OrderedDict[Hashable, Tuple[dict, int]]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._events)
+    
+    def add(self, event: dict) -> int:
+        """Add an event after the buffered ones.
+        
+        Returns:
+            Number of buffered events it superseded (0 or 1)
+        """
+        key = _coalesce_key(event)
+        superseded = self._events.pop(key, None)
+        if superseded:
+            self.size -= superseded[1]
+        size = _event_size(event)
+        self._events[key] = (event, size)
+        self.size += size
+        self.last_seq = event["seq"]
+        self.touched = time.monotonic()
+        return 1 if superseded else 0
+    
+    def evict_oldest(self):
+        """Drop the oldest event; the buffer then starts after it."""
+        _, (event, size) = self._events.popitem(last=False)
+        self.size -= size
+        self.start_seq = event["seq"] + 1
+    
+    def events_since(self, since: int) -> List[dict]:
+        return [event for event, _ in self._events.values() if event["seq"] > since]
+
+
+def compact_events(events: List[dict]) -> List[dict]:
+    """Reduce events to those needed to rebuild the current state, in order.
+    
+    Transient events are dropped, and of the events updating one file (or the
+    task status) only the latest is kept.
+    """
+    latest: Dict[tuple, int] = {}
+    for i, event in enumerate(events):
+        key = _supersede_key(event)
+        if key is not None:
+            latest[key] = i
+    return [
+        event for i, event in enumerate(events)
+        if event.get("type") not in TRANSIENT_EVENTS
+        and latest.get(_supersede_key(event), i) == i
+    ]
+
+
+def _read_last_line(path: Path) -> Optional[str]:
+    """Read the last line of a file without reading all of it."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        data = b""
+        position = end
+        while position > 0:
+            step = min(64 * 1024, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+            lines = data.rstrip(b"\n").split(b"\n")
+            if len(lines) > 1 or position == 0:
+                last = lines[-1].strip()
+                return last.decode("utf-8") if last else None
+    return None
+
+
+class EventLog:
+    """Per-task event log with sequence numbers and replay."""
+    
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        ring_size: Optional[int] = None,
+        max_replay: Optional[int] = None,
+        task_budget: Optional[int] = None,
+        total_budget: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        """Initialize event log.
+        
+        Args:
+            directory: Where task logs are written (defaults to MGX_EVENT_LOG_DIR or
+                workspace/.events); must be shared by nodes and worker processes
+            ring_size: Recent events kept in memory per task (defaults to MGX_EVENT_RING_SIZE or 1000)
+            max_replay: Largest gap replayed event by event; larger gaps get a
+                compacted snapshot instead (defaults to MGX_EVENT_MAX_REPLAY or 500)
+            task_budget: Bytes of events buffered per task (defaults to MGX_EVENT_BUFFER_TASK_BYTES or 8 MB)
+            total_budget: Bytes of events buffered for all tasks (defaults to MGX_EVENT_BUFFER_TOTAL_BYTES or 128 MB)
+            ttl: Seconds without events after which a task's buffer is dropped
+                (defaults to MGX_EVENT_BUFFER_TTL or 600)
+        """
+        default_directory = Path(__file__).parent.parent / "workspace" / ".events"
+        self.directory = Path(directory or os.getenv("MGX_EVENT_LOG_DIR", str(default_directory)))
+        self.ring_size = ring_size or int(os.getenv("MGX_EVENT_RING_SIZE", "1000"))
+        self.max_replay = max_replay or int(os.getenv("MGX_EVENT_MAX_REPLAY", "500"))
+        self.task_budget = task_budget or int(os.getenv("MGX_EVENT_BUFFER_TASK_BYTES", str(8 * 1024 * 1024)))
+        self.total_budget = total_budget or int(os.getenv("MGX_EVENT_BUFFER_TOTAL_BYTES", str(128 * 1024 * 1024)))
+        self.ttl = ttl or float(os.getenv("MGX_EVENT_BUFFER_TTL", "600"))
+        # Latest seq of each task and the log size it was read at
+        self._last_seq: Dict[str, Tuple[int, int]] = {}
+        # Buffers of tasks, least recently active first
+        self._buffers: "OrderedDict[str, EventBuffer]" = OrderedDict()
+        self._buffered_bytes = 0
+        self.counters = {"coalesced": 0, "evicted_task_budget": 0, "evicted_total_budget": 0, "expired": 0}
+        # Appends come from the event loop and from writer threads
+        self._lock = threading.Lock()
+        # Events waiting for the writer, with the futures of their senders
+        self._pending: List[Tuple[str, dict, asyncio.Future]] = []
+        self._writer: Optional[asyncio.Task] = None
+    
+    def _path(self, task_id: str) -> Path:
+        return self.directory / f"{task_id}.jsonl"
+    
+    def _read(self, task_id: str) -> List[dict]:
+        path = self._path(task_id)
+        if not path.exists():
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        return [event for event in events if event.get("type") != SEQ_MARK]
+    
+    def last_seq(self, task_id: str) -> int:
+        """Sequence number of the task's latest event (0 if none).
+        
+        Callers hold the lock. Another process continues from the last line of
+        the file, an event or the seq mark written after transient events.
+        """
+        path = self._path(task_id)
+        size = path.stat().st_size if path.exists() else 0
+        cached = self._last_seq.get(task_id)
+        if cached and cached[1] == size:
+            return cached[0]
+        # Not seen yet, or written by another process since (e.g. a resumed run)
+        last = _read_last_line(path) if size else None
+        seq = json.loads(last)["seq"] if last else 0
+        self._last_seq[task_id] = (seq, size)
+        return seq
+    
+    def append(self, task_id: str, data: dict) -> dict:
+        """Number an event and write it to the task's log.
+        
+        Called by the process running the task, which is the only writer of
+        its log while it holds the task's lease; numbering continues from the
+        log file when another process wrote to it before.
+        
+        Returns:
+            The event with its "seq" field set
+        """
+        return self._append_batch([(task_id, data)])[0]
+    
+    async def append_async(self, task_id: str, data: dict) -> dict:
+        """Number an event and write it to the task's log without blocking the event loop.
+        
+        Events sent while a write is in progress are written together by the
+        next one, in the order they were sent.
+        
+        Returns:
+            The event with its "seq" field set
+        """
+        loop = asyncio.get_running_loop()
+        if self._writer is None or self._writer.done() or self._writer.get_loop() is not loop:
+            self._pending = []
+            self._writer = None
+        future = loop.create_future()
+        self._pending.append((task_id, data, future))
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_pending())
+        return await future
+    
+    async def _write_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                events = await asyncio.to_thread(self._append_batch, [(task_id, data) for task_id, data, _ in batch])
+            except asyncio.CancelledError:
+                for _, _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                print(f"⚠️ [EventLog] Failed to write {len(batch)} event(s): {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), event in zip(batch, events):
+                if not future.done():
+                    future.set_result(event)
+    
+    def _append_batch(self, items: List[Tuple[str, dict]]) -> List[dict]:
+        """Number events and write the non-transient ones, one write per task.
+        
+        A task whose latest event in the batch is transient gets a seq mark
+        line, so its file keeps the highest number handed out.
+        """
+        events = []
+        lines: Dict[str, List[str]] = {}
+        marks: Dict[str, int] = {}
+        with self._lock:
+            for task_id, data in items:
+                seq = self.last_seq(task_id) + 1
+                event = {**data, "seq": seq}
+                events.append(event)
+                # The cached size is unchanged until the lines are written
+                self._last_seq[task_id] = (seq, self._last_seq[task_id][1])
+                if event.get("type") in TRANSIENT_EVENTS:
+                    marks[task_id] = seq
+                    continue
+                marks.pop(task_id, None)
+                lines.setdefault(task_id, []).append(json.dumps(event, default=str) + "\n")
+                if event.get("type") in TERMINAL_EVENTS:
+                    self._write_lines(task_id, lines.pop(task_id))
+                    self._compact(task_id)
+            for task_id, seq in marks.items():
+                lines.setdefault(task_id, []).append(json.dumps({"type": SEQ_MARK, "seq": seq}) + "\n")
+            for task_id, task_lines in lines.items():
+                self._write_lines(task_id, task_lines)
+        return events
+    
+    def _write_lines(self, task_id: str, lines: List[str]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._path(task_id), "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+            size = f.tell()
+        self._last_seq[task_id] = (self._last_seq[task_id][0], size)
+    
+    def record(self, task_id: str, event: dict):
+        """Keep a delivered event in this node's buffer of the task."""
+        seq = event.get("seq")
+        if seq is None:
+            return
+        self._expire()
+        if event.get("type") in TERMINAL_EVENTS:
+            # Finished tasks are replayed from their compacted log
+            self._drop(task_id)
+            return
+        buffer = self._buffers.get(task_id)
+        if buffer is None:
+            buffer = self._buffers[task_id] = EventBuffer(seq)
+        elif seq <= buffer.last_seq:
+            return
+        self._buffers.move_to_end(task_id)
+        
+        size = buffer.size
+        self.counters["coalesced"] += buffer.add(event)
+        while len(buffer) > 1 and (len(buffer) > self.ring_size or buffer.size > self.task_budget):
+            buffer.evict_oldest()
+            self.counters["evicted_task_budget"] += 1
+        self._buffered_bytes += buffer.size - size
+        
+        # Over the global budget, drop whole buffers of the least recently active tasks
+        while self._buffered_bytes > self.total_budget and len(self._buffers) > 1:
+            idle_task_id = next(iter(self._buffers))
+            self._drop(idle_task_id)
+            self.counters["evicted_total_budget"] += 1
+            print(f"🧹 [EventLog] Buffer budget exceeded, dropped buffer of {idle_task_id}")
+    
+    def _drop(self, task_id: str):
+        buffer = self._buffers.pop(task_id, None)
+        if buffer:
+            self._buffered_bytes -= buffer.size
+    
+    def _expire(self):
+        """Drop buffers of tasks without events for longer than the TTL (e.g. abandoned or crashed)."""
+        deadline = time.monotonic() - self.ttl
+        while self._buffers:
+            task_id, buffer = next(iter(self._buffers.items()))
+            if buffer.touched > deadline:
+                return
+            self._drop(task_id)
+            self.counters["expired"] += 1
+    
+    def stats(self) -> dict:
+        """Gauges of this node's event buffers."""
+        self._expire()
+        largest = sorted(self._buffers.items(), key=lambda item: item[1].size, reverse=True)[:5]
+        return {
+            "tasks": len(self._buffers),
+            "bytes": self._buffered_bytes,
+            "events": sum(len(buffer) for buffer in self._buffers.values()),
+            "task_budget": self.task_budget,
+            "total_budget": self.total_budget,
+            "ttl_seconds": self.ttl,
+            "largest": [{"task_id": task_id, "bytes": buffer.size, "events": len(buffer)} for task_id, buffer in largest],
+            **self.counters
+        }
+    
+    def replay(self, task_id: str, since: int = 0) -> Optional[List[dict]]:
+        """Get the events after `since`, in order.
+        
+        Events are coalesced, so a superseded event may be left out in favor
+        of the later one replacing it.
+        
+        Returns:
+            The missing events, or None if there are more than max_replay of
+            them and the client should rebuild its state from snapshot()
+        """
+        return self._replay(task_id, since, *self._buffered(task_id, since))
+    
+    async def replay_async(self, task_id: str, since: int = 0) -> Optional[List[dict]]:
+        """Like replay(), reading the log file in a thread."""
+        return await asyncio.to_thread(self._replay, task_id, since, *self._buffered(task_id, since))
+    
+    def _buffered(self, task_id: str, since: int) -> Tuple[Optional[List[dict]], int]:
+        """Buffered events after `since` (None if the buffer does not reach back to it) and the buffer's last seq."""
+        buffer = self._buffers.get(task_id)
+        if buffer and buffer.start_seq <= since + 1:
+            return buffer.events_since(since), buffer.last_seq
+        return None, 0
+    
+    def _replay(self, task_id: str, since: int, buffered: Optional[List[dict]], buffered_seq: int) -> Optional[List[dict]]:
+        with self._lock:
+            # The buffer serves the replay if it has every logged event
+            # (it lags the file while events are still on their way to this node)
+            if buffered is not None and buffered_seq >= self.last_seq(task_id):
+                events = buffered
+            else:
+                events = coalesce_events([event for event in self._read(task_id) if event["seq"] > since])
+        if len(events) > self.max_replay:
+            return None
+        return events
+    
+    def snapshot(self, task_id: str) -> List[dict]:
+        """Get the compacted events describing the task's current state."""
+        with self._lock:
+            return compact_events(self._read(task_id))
+    
+    async def snapshot_async(self, task_id: str) -> List[dict]:
+        """Like snapshot(), reading the log file in a thread."""
+        return await asyncio.to_thread(self.snapshot, task_id)
+    
+    def _compact(self, task_id: str):
+        """Rewrite a finished task's log keeping only non-superseded events."""
+        path = self._path(task_id)
+        events = self._read(task_id)
+        compacted = compact_events(events)
+        tmp_path = path.with_suffix(".jsonl.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for event in compacted:
+                f.write(json.dumps(event, default=str) + "\n")
+        os.replace(tmp_path, path)
+        self._last_seq[task_id] = (events[-1]["seq"] if events else 0, path.stat().st_size)
+        print(f"🗜️  [EventLog] Compacted log of {task_id}: {len(events)} -> {len(compacted)} events")
+    
+    def delete(self, task_id: str):
+        """Delete a task's log."""
+        with self._lock:
+            self._last_seq.pop(task_id, None)
+            self._drop(task_id)
+            self._path(task_id).unlink(missing_ok=True)
@@ -1,7 +1,7 @@
 """LLM wrapper for OpenAI API."""
 
 import asyncio
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
 from pydantic import BaseModel, ConfigDict
 from openai import AsyncOpenAI
 
@@ -14,6 +14,9 @@ class BaseLLM(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     
     cost_manager: Optional[CostManager] = None
+    # Optional token limiter (scheduler.WeightedRateLimiter) and the class charged for calls
+    rate_limiter: Optional[Any] = None
+    priority_class: str = "interactive"
     
     async def ask(self, prompt: str, system_prompt: Optional[str] = None) -> str:
         """Ask LLM a question."""
@@ -64,6 +67,11 @@ class OpenAILLM(BaseLLM):
             "content": prompt
         })
         
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(
+                self.priority_class, int(sum(len(msg["content"].split()) * 1.3 for msg in messages))
+            )
+        
         try:
             # Use streaming if callback is provided
             if stream_callback:
@@ -85,33 +93,48 @@ class OpenAILLM(BaseLLM):
                 chunk_count = 0
                 finish_reason = None
                 
-                async for chunk in stream:
-                    chunk_count += 1
-                    
-                    # Check for content in chunk
-                    if chunk.choices and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        if delta and delta.content:
-                            content = delta.content
-                            full_content += content
-                            completion_tokens += len(content.split())  # Rough token estimate
-                            if stream_callback:
-                                try:
-                                    await stream_callback(content)
-                                except Exception as e:
-                                    print(f"⚠️  [LLM] stream_callback error: {e}")
-                                    import traceback
-                                    traceback.print_exc()
-                                    # Continue streaming even if callback fails
+                try:
+                    async for chunk in stream:
+                        chunk_count += 1
+                        
+                        # Check for content in chunk
+                        if chunk.choices and len(chunk.choices) > 0:
+                            delta = chunk.choices[0].delta
+                            if delta and delta.content:
+                                content = delta.content
+                                full_content += content
+                                completion_tokens += len(content.split())  # Rough token estimate
+                                if stream_callback:
+                                    try:
+                                        await stream_callback(content)
+                                    except Exception as e:
+                                        print(f"⚠️  [LLM] stream_callback error: {e}")
+                                        import traceback
+                                        traceback.print_exc()
+                                        # Continue streaming even if callback fails
+                            
+                            # Check finish_reason in final chunk
+                            if chunk.choices[0].finish_reason:
+                                finish_reason = chunk.choices[0].finish_reason
                         
-                        # Check finish_reason in final chunk
-                        if chunk.choices[0].finish_reason:
-                            finish_reason = chunk.choices[0].finish_reason
-                    
-                    # Get usage from final chunk if available
-                    if chunk.usage:
-                        prompt_tokens_estimate = chunk.usage.prompt_tokens
-                        completion_tokens = chunk.usage.completion_tokens
+                        # Get usage from final chunk if available
+                        if chunk.usage:
+                            prompt_tokens_estimate = chunk.usage.prompt_tokens
+                            completion_tokens = chunk.usage.completion_tokens
+                except asyncio.CancelledError:
+                    # Task was cancelled: close the provider stream right away so it
+                    # stops generating, and still bill and rate-limit the tokens received so far
+                    await stream.close()
+                    if self.rate_limiter:
+                        self.rate_limiter.consume(self.priority_class, int(completion_tokens))
+                    if self.cost_manager:
+                        self.cost_manager.update_cost(
+                            prompt_tokens=int(prompt_tokens_estimate),
+                            completion_tokens=int(completion_tokens),
+                            model=self.model
+                        )
+                    print(f"🛑 [LLM] Stream cancelled after {chunk_count} chunks, content length: {len(full_content)}")
+                    raise
                 
                 # Log finish reason for debugging
                 if finish_reason:
@@ -126,6 +149,8 @@ class OpenAILLM(BaseLLM):
                     print(f"📊 [LLM] Stream completed. Received {chunk_count} chunks, total content length: {len(full_content)}")
                 
                 # Update cost with estimated tokens
+                if self.rate_limiter:
+                    self.rate_limiter.consume(self.priority_class, int(completion_tokens))
                 if self.cost_manager:
                     self.cost_manager.update_cost(
                         prompt_tokens=int(prompt_tokens_estimate),
@@ -144,6 +169,8 @@ class OpenAILLM(BaseLLM):
                 )
                 
                 # Update cost
+                if self.rate_limiter:
+                    self.rate_limiter.consume(self.priority_class, response.usage.completion_tokens)
                 if self.cost_manager:
                     usage = response.usage
                     self.cost_manager.update_cost(
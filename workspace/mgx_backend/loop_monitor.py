@@ -0,0 +1,54 @@
+"""Event loop lag monitoring."""
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop runs a callback scheduled at a fixed interval.
+    
+    Lag is time the loop spent on blocking work (synchronous I/O, CPU-bound
+    code) while other coroutines waited, so it bounds how long any request
+    or WebSocket message could be held up.
+    """
+    
+    def __init__(self, interval: float = 0.1, window: int = 600):
+        """Initialize monitor.
+        
+        Args:
+            interval: Seconds between samples
+            window: Number of recent samples kept for statistics
+        """
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _sample(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+    
+    def stats(self) -> dict:
+        """Lag percentiles over the recent window, in milliseconds."""
+        if not self.samples:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self.samples)
+        return {
+            "samples": len(ordered),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2)
+        }
@@ -127,18 +127,7 @@ class ProjectRepo(BaseModel):
         
         for filepath, content in files.items():
             try:
-                # Normalize file path: remove leading slashes and convert absolute paths to relative
-                filepath = filepath.lstrip('/')
-                
-                # Remove project name from path if it appears at the start
-                # e.g., "/2048-game/index.html" -> "index.html" or "2048-game/index.html" -> "index.html"
-                project_name = self.workdir.name
-                if filepath.startswith(f"{project_name}/"):
-                    filepath = filepath[len(project_name) + 1:]
-                
-                # Remove src/ prefix if it exists
-                if filepath.startswith("src/"):
-                    filepath = filepath[4:]
+                filepath = self.normalize_code_path(filepath)
                 
                 # All code files are saved to src/ directory
                 await self.srcs.save(filepath, content)
@@ -147,6 +136,23 @@ class ProjectRepo(BaseModel):
                 print(f"   ❌ Error saving {filepath}: {e}")
                 raise
     
+    def normalize_code_path(self, filepath: str) -> str:
+        """Normalize a code file path from LLM output to a path relative to src/."""
+        # Normalize file path: remove leading slashes and convert absolute paths to relative
+        filepath = filepath.lstrip('/')
+        
+        # Remove project name from path if it appears at the start
+        # e.g., "/2048-game/index.html" -> "index.html" or "2048-game/index.html" -> "index.html"
+        project_name = self.workdir.name
+        if filepath.startswith(f"{project_name}/"):
+            filepath = filepath[len(project_name) + 1:]
+        
+        # Remove src/ prefix if it exists
+        if filepath.startswith("src/"):
+            filepath = filepath[4:]
+        
+        return filepath
+    
     def _parse_code_files(self, content: str) -> dict:
         """Parse code files from LLM output."""
         files = {}
@@ -4,6 +4,7 @@ from typing import List, Set, Optional, Any
 from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 
 from mgx_backend.action import Action
+from mgx_backend.cost_manager import current_action
 from mgx_backend.message import Message
 from mgx_backend.llm import BaseLLM
 
@@ -486,6 +487,8 @@ class Role(BaseModel):
         print(f"   progress_callback available: {self._env.context.kwargs.get('progress_callback') is not None if self._env and self._env.context else False}")
         print(f"   accumulated_content length before: {len(accumulated_content)}")
         
+        # LLM calls made by the action are recorded under its name
+        action_token = current_action.set(self._todo.name)
         try:
             result = await self._todo.run(context, stream_callback=stream_callback)
             print(f"✅ [Role] {self._todo.name} completed, result length: {len(result) if result else 0}")
@@ -511,6 +514,8 @@ class Role(BaseModel):
                         "error": str(e),
                         "message": f"{self.name} encountered an error during {self._todo.name.lower()}"
                     })
+        finally:
+            current_action.reset(action_token)
         
         # Send final file contents for all actions
         if current_content:
@@ -0,0 +1,193 @@
+"""Fair-share scheduling of queued tasks and LLM tokens across users and priority classes."""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from mgx_backend.admission import get_tier_limits
+
+
+def load_class_weights() -> Dict[str, float]:
+    """Load priority class weights (MGX_CLASS_WEIGHTS JSON, default interactive 4 : batch 1)."""
+    weights = {"interactive": 4.0, "batch": 1.0}
+    overrides = os.getenv("MGX_CLASS_WEIGHTS")
+    if overrides:
+        weights.update({k: float(v) for k, v in json.loads(overrides).items()})
+    return weights
+
+
+class FairScheduler:
+    """Weighted fair queuing across priority classes, and across users within a class.
+    
+    Every class and every (class, user) flow has a virtual time that grows by
+    1/weight per dispatched task; the backlogged flow with the smallest
+    virtual finish time goes next. A flow that was idle restarts at the
+    current virtual time instead of cashing in credit from its idle period.
+    
+    Interactive latency is bounded by two extra rules: batch tasks never
+    occupy the last `reserved_interactive` workers, and an interactive task
+    waiting longer than `interactive_max_wait` seconds jumps the queue.
+    The state is per process, so with several API processes fairness holds
+    per process.
+    """
+    
+    def __init__(
+        self,
+        class_weights: Optional[Dict[str, float]] = None,
+        reserved_interactive: Optional[int] = None,
+        interactive_max_wait: Optional[float] = None
+    ):
+        """Initialize scheduler.
+        
+        Args:
+            class_weights: Weight of each priority class (defaults to MGX_CLASS_WEIGHTS)
+            reserved_interactive: Workers kept free of batch tasks (defaults to MGX_INTERACTIVE_RESERVED_WORKERS or 1)
+            interactive_max_wait: Seconds after which interactive tasks go first (defaults to MGX_INTERACTIVE_MAX_WAIT or 30)
+        """
+        self.class_weights = class_weights or load_class_weights()
+        self.reserved_interactive = (
+            reserved_interactive if reserved_interactive is not None
+            else int(os.getenv("MGX_INTERACTIVE_RESERVED_WORKERS", "1"))
+        )
+        self.interactive_max_wait = interactive_max_wait or float(os.getenv("MGX_INTERACTIVE_MAX_WAIT", "30"))
+        # Virtual start times of classes and of (class, user) flows
+        self._class_vtime: Dict[str, float] = {}
+        self._user_vtime: Dict[Tuple[str, Optional[int]], float] = {}
+    
+    def class_weight(self, priority_class: str) -> float:
+        """Weight of a priority class (unknown classes weigh like batch)."""
+        return self.class_weights.get(priority_class, self.class_weights.get("batch", 1.0))
+    
+    @staticmethod
+    def _activate(vtimes: dict, active: list):
+        """Start newly backlogged flows at the current virtual time."""
+        known = [vtimes[key] for key in active if key in vtimes]
+        now = min(known) if known else 0.0
+        for key in active:
+            if key not in vtimes:
+                vtimes[key] = now
+    
+    @staticmethod
+    def _deactivate(vtimes: dict, active: list):
+        """Forget idle flows so they restart at the current virtual time."""
+        for key in list(vtimes):
+            if key not in active:
+                del vtimes[key]
+    
+    def order(self, heads: List[dict], running_by_class: Dict[str, int], concurrency: int) -> List[int]:
+        """Order scheduling candidates (see DatabaseManager.list_queue_heads) for claiming.
+        
+        Returns:
+            Task row ids, most deserving first
+        """
+        now = datetime.utcnow()
+        expired = [h for h in heads if h["expired"]]
+        queued = [h for h in heads if not h["expired"]]
+        
+        classes = sorted({h["priority_class"] for h in queued})
+        self._deactivate(self._class_vtime, classes)
+        self._activate(self._class_vtime, classes)
+        flows = sorted({(h["priority_class"], h["user_id"]) for h in queued}, key=str)
+        self._deactivate(self._user_vtime, flows)
+        for cls in classes:
+            self._activate(self._user_vtime, [f for f in flows if f[0] == cls])
+        
+        # Keep the last workers free for interactive tasks
+        batch_limit = max(1, concurrency - self.reserved_interactive)
+        if sum(n for c, n in running_by_class.items() if c != "interactive") >= batch_limit:
+            queued = [h for h in queued if h["priority_class"] == "interactive"]
+        
+        def rank(head: dict):
+            cls, user = head["priority_class"], head["user_id"]
+            overdue = cls == "interactive" and (now - head["queued_at"]).total_seconds() > self.interactive_max_wait
+            class_finish = self._class_vtime[cls] + 1 / self.class_weight(cls)
+            user_finish = self._user_vtime[(cls, user)] + 1 / get_tier_limits(head["tier"]).weight
+            return (not overdue, class_finish, cls, user_finish, head["queued_at"])
+        
+        # Orphaned running tasks are resumed before anything new starts
+        return [h["id"] for h in expired] + [h["id"] for h in sorted(queued, key=rank)]
+    
+    def charge(self, priority_class: Optional[str], user_id: Optional[int], tier: Optional[str]):
+        """Advance virtual times after a task of a flow was dispatched."""
+        cls = priority_class or "interactive"
+        self._class_vtime[cls] = self._class_vtime.get(cls, 0.0) + 1 / self.class_weight(cls)
+        flow = (cls, user_id)
+        self._user_vtime[flow] = self._user_vtime.get(flow, 0.0) + 1 / get_tier_limits(tier).weight
+
+
+class WeightedRateLimiter:
+    """Token bucket for LLM tokens shared by priority classes in proportion to their weights.
+    
+    Each class refills at its share of `tokens_per_minute`; refill a class
+    cannot hold (its bucket is full) spills into a shared bucket any class
+    may draw from, so idle classes do not waste capacity. Limits apply per
+    process.
+    """
+    
+    def __init__(self, tokens_per_minute: int, class_weights: Optional[Dict[str, float]] = None):
+        """Initialize rate limiter.
+        
+        Args:
+            tokens_per_minute: Total LLM tokens per minute (0 disables limiting)
+            class_weights: Weight of each priority class (defaults to MGX_CLASS_WEIGHTS)
+        """
+        self.tokens_per_minute = tokens_per_minute
+        weights = class_weights or load_class_weights()
+        total = sum(weights.values())
+        self.rates = {cls: tokens_per_minute * w / total / 60 for cls, w in weights.items()}
+        self.capacity = {cls: rate * 60 for cls, rate in self.rates.items()}
+        self.tokens = dict(self.capacity)
+        self.shared = 0.0
+        self._updated = time.monotonic()
+        # One waiter queue per class, so a throttled class does not hold up the others
+        self._locks = {cls: asyncio.Lock() for cls in self.rates}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.tokens_per_minute > 0
+    
+    def _refill(self):
+        """Add tokens for the time elapsed since the last refill."""
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        for cls, rate in self.rates.items():
+            level = self.tokens[cls] + rate * elapsed
+            if level > self.capacity[cls]:
+                self.shared = min(self.tokens_per_minute, self.shared + level - self.capacity[cls])
+                level = self.capacity[cls]
+            self.tokens[cls] = level
+    
+    def _class(self, priority_class: Optional[str]) -> str:
+        return priority_class if priority_class in self.rates else "batch"
+    
+    async def acquire(self, priority_class: Optional[str], tokens: int):
+        """Wait until `tokens` may be spent by a class."""
+        if not self.enabled:
+            return
+        cls = self._class(priority_class)
+        # Requests larger than a bucket would never fit: cap them at the class capacity
+        tokens = min(tokens, self.capacity[cls])
+        async with self._locks[cls]:
+            while True:
+                self._refill()
+                available = self.tokens[cls] + self.shared
+                if available >= tokens:
+                    own = min(self.tokens[cls], tokens)
+                    self.tokens[cls] -= own
+                    self.shared -= tokens - own
+                    return
+                await asyncio.sleep((tokens - available) / self.rates[cls])
+    
+    def consume(self, priority_class: Optional[str], tokens: int):
+        """Charge tokens used beyond what was acquired (the bucket may go negative)."""
+        if not self.enabled:
+            return
+        self._refill()
+        self.tokens[self._class(priority_class)] -= tokens
+
+
+# Shared by all LLM calls of this process (MGX_LLM_TOKENS_PER_MINUTE, 0 = unlimited)
+llm_rate_limiter = WeightedRateLimiter(int(os.getenv("MGX_LLM_TOKENS_PER_MINUTE", "0")))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Benchmark concurrent task progress writes on SQLite.
+
+Several processes (like the API and its worker processes) each run a number
+of tasks that update their task row as fast as they can, the way progress
+events did before they were written behind. Reports write throughput,
+latency and "database is locked" failures for each SQLite profile.
+
+Usage:
+    python -m mgx_backend.sqlite_benchmark [--processes 2] [--tasks 8] [--updates 200]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def run_writer(database_url: str, profile: str, process_index: int, tasks: int, updates: int, results):
+    """Update `tasks` task rows `updates` times each from one process."""
+    os.environ["MGX_SQLITE_PROFILE"] = profile
+    from mgx_backend.database import AsyncDatabaseManager
+    
+    async def update_task(db, task_id: str, latencies: list, errors: list):
+        for progress in range(updates):
+            started = time.perf_counter()
+            try:
+                await db.update_task(task_id, progress=progress % 100, current_stage=f"stage {progress}")
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(str(e))
+    
+    async def main():
+        db = AsyncDatabaseManager(database_url)
+        latencies, errors = [], []
+        try:
+            await asyncio.gather(*(
+                update_task(db, f"p{process_index}-t{i}", latencies, errors) for i in range(tasks)
+            ))
+        finally:
+            await db.close()
+        results.put((latencies, errors))
+    
+    asyncio.run(main())
+
+
+def benchmark(profile: str, processes: int, tasks: int, updates: int) -> dict:
+    """Run the writers of all processes against a fresh database."""
+    os.environ["MGX_SQLITE_PROFILE"] = profile
+    from mgx_backend.database import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = f"sqlite:///{tmpdir}/benchmark.db"
+        db = DatabaseManager(database_url)
+        db.create_tables()
+        for p in range(processes):
+            for i in range(tasks):
+                db.create_task(f"p{p}-t{i}", "benchmark", 1.0, 1)
+        db.engine.dispose()
+        
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=run_writer, args=(database_url, profile, p, tasks, updates, results))
+            for p in range(processes)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+    
+    latencies = sorted(latency for lat, _ in collected for latency in lat)
+    errors = [error for _, errs in collected for error in errs]
+    return {
+        "profile": profile,
+        "writes": len(latencies),
+        "failed": len(errors),
+        "writes_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+        "first_error": errors[0] if errors else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--tasks", type=int, default=8, help="Concurrent tasks per process")
+    parser.add_argument("--updates", type=int, default=200, help="Updates per task")
+    parser.add_argument("--profiles", default="legacy,production")
+    args = parser.parse_args()
+    
+    print(f"📊 SQLite write benchmark: {args.processes} processes x {args.tasks} tasks x {args.updates} updates")
+    for profile in args.profiles.split(","):
+        result = benchmark(profile, args.processes, args.tasks, args.updates)
+        print(f"  {result}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
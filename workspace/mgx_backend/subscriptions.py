@@ -0,0 +1,272 @@
+"""WebSocket and Server-Sent Events subscribers of task progress events.
+
+Live events are queued per connection and written by the connection's own
+writer, so a slow client never holds up the task producing the events.
+When a connection's queue is full the slow-consumer policy applies:
+
+- "coalesce": merge superseded events (latest content per file, latest
+  stream chunk per action, latest status)
+- "drop": drop transient events such as stream chunks
+- "disconnect": close the connection
+
+If the queue is still full after coalescing or dropping, the connection is
+closed too; the client can reconnect with ?since=<seq> and resume from the
+event log.
+"""
+
+import asyncio
+import json
+import os
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+from mgx_backend.event_log import TRANSIENT_EVENTS, coalesce_events
+
+
+SLOW_CONSUMER_POLICIES = ("coalesce", "drop", "disconnect")
+
+# WebSocket close code telling the client to reconnect later
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class Subscriber:
+    """One WebSocket connection watching a task, with its own delivery state."""
+    
+    def __init__(
+        self,
+        task_id: str,
+        websocket: Optional[WebSocket] = None,
+        queue_size: Optional[int] = None,
+        policy: Optional[str] = None
+    ):
+        """Initialize subscriber.
+        
+        Args:
+            task_id: Task watched
+            websocket: Connection events are written to
+            queue_size: Live events queued before the policy applies (defaults to MGX_SEND_QUEUE_SIZE or 256)
+            policy: Slow-consumer policy (defaults to MGX_SLOW_CONSUMER_POLICY or "coalesce")
+        """
+        self.task_id = task_id
+        self.websocket = websocket
+        self.queue_size = queue_size or int(os.getenv("MGX_SEND_QUEUE_SIZE", "256"))
+        self.policy = policy or os.getenv("MGX_SLOW_CONSUMER_POLICY", "coalesce")
+        if self.policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {self.policy}")
+        self.connected_at = datetime.utcnow()
+        self.delivered = 0  # Events sent to this connection
+        self.failed = 0  # Events that could not be sent
+        self.dropped = 0  # Events coalesced or dropped because the client was too slow
+        self.last_error: Optional[str] = None
+        self.last_seq = 0  # Latest numbered event sent, so replayed events are not sent twice
+        self.closed = False
+        self._queue: Deque[dict] = deque()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._closer: Optional[asyncio.Task] = None
+    
+    def _is_new(self, data: dict) -> bool:
+        """Check an event was not sent before, and mark it as sent."""
+        seq = data.get("seq")
+        if seq is not None and data.get("type") != "snapshot":
+            if seq <= self.last_seq:
+                return False
+            self.last_seq = seq
+        return True
+    
+    async def send(self, data: dict) -> bool:
+        """Send an event right away (replay while connecting); returns False if the connection is gone."""
+        if self.closed:
+            return False
+        if not self._is_new(data):
+            return True
+        try:
+            await self._write(data)
+            self.delivered += 1
+            return True
+        except Exception as e:
+            self.failed += 1
+            self.last_error = str(e)
+            self.closed = True
+            return False
+    
+    def offer(self, data: dict) -> bool:
+        """Queue a live event without waiting for the client.
+        
+        Returns:
+            False if the connection is gone or was closed for being too slow
+        """
+        if self.closed:
+            return False
+        if not self._is_new(data):
+            return True
+        if len(self._queue) >= self.queue_size:
+            self._relieve()
+            if len(self._queue) >= self.queue_size:
+                self._overflow()
+                return False
+        self._queue.append(data)
+        self._ready.set()
+        return True
+    
+    def _relieve(self):
+        """Shrink a full queue according to the slow-consumer policy."""
+        before = len(self._queue)
+        if self.policy == "coalesce":
+            events = coalesce_events(list(self._queue))
+        elif self.policy == "drop":
+            events = [event for event in self._queue if event.get("type") not in TRANSIENT_EVENTS]
+        else:
+            return
+        self._queue = deque(events)
+        self.dropped += before - len(events)
+    
+    def _overflow(self):
+        """Give up on a client that cannot keep up; it may resume from the event log."""
+        self.closed = True
+        self.last_error = f"Send queue full ({self.queue_size} events, policy {self.policy})"
+        self._ready.set()
+        if self.websocket is not None:
+            self._closer = asyncio.create_task(self._close_slow())
+    
+    async def _close_slow(self):
+        print(f"🐢 [API] Closing slow subscriber of {self.task_id}: {self.last_error}")
+        try:
+            await self.websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        except Exception as e:
+            print(f"⚠️ [API] Failed to close slow subscriber of {self.task_id}: {e}")
+    
+    async def next_event(self) -> Optional[dict]:
+        """Wait for the next queued event; None once the subscriber is closed."""
+        while not self._queue:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        if self.closed:
+            return None
+        return self._queue.popleft()
+    
+    def start(self):
+        """Start the writer sending queued events to the connection."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+    
+    def stop(self):
+        """Stop delivering events."""
+        self.closed = True
+        self._ready.set()
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+    
+    async def _drain(self):
+        """Write queued events to the connection, at whatever pace the client reads."""
+        while True:
+            data = await self.next_event()
+            if data is None:
+                break
+            try:
+                await self._write(data)
+                self.delivered += 1
+            except Exception as e:
+                self.failed += 1
+                self.last_error = str(e)
+                self.closed = True
+                return
+    
+    async def _write(self, data: dict):
+        await self.websocket.send_json(data)
+    
+    def stats(self) -> dict:
+        return {
+            "connected_at": self.connected_at.isoformat(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "queued": len(self._queue),
+            "policy": self.policy,
+            "last_seq": self.last_seq,
+            "last_error": self.last_error
+        }
+
+
+class SSESubscriber(Subscriber):
+    """A Server-Sent Events stream watching a task.
+    
+    The streaming response reads events with next_event(), formats them with
+    format_sse() and sends heartbeats while none arrive.
+    """
+    
+    def __init__(self, task_id: str, queue_size: Optional[int] = None, policy: Optional[str] = None):
+        super().__init__(task_id, queue_size=queue_size, policy=policy)
+        # Events replayed while connecting, streamed before the live ones
+        self.backlog: List[dict] = []
+    
+    async def _write(self, data: dict):
+        self.backlog.append(data)
+        self._ready.set()
+    
+    async def next_event(self) -> Optional[dict]:
+        if self.backlog:
+            return self.backlog.pop(0)
+        return await super().next_event()
+    
+    def start(self):
+        """Events are pulled by the streaming response; no writer needed."""
+
+
+def format_sse(data: dict) -> str:
+    """Format an event as an SSE message; numbered events get their seq as event id."""
+    lines = []
+    if data.get("seq") is not None and data.get("type") != "snapshot":
+        lines.append(f"id: {data['seq']}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class SubscriberRegistry:
+    """Set of subscribers per task, with non-blocking fan-out."""
+    
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+    
+    def add(self, subscriber: Subscriber):
+        """Register a subscriber of its task and start delivering live events to it."""
+        self._subscribers.setdefault(subscriber.task_id, set()).add(subscriber)
+        subscriber.start()
+    
+    def remove(self, subscriber: Subscriber):
+        """Unregister one connection, leaving the task's other subscribers in place."""
+        subscriber.stop()
+        subscribers = self._subscribers.get(subscriber.task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[subscriber.task_id]
+    
+    def has_subscribers(self, task_id: str) -> bool:
+        return bool(self._subscribers.get(task_id))
+    
+    def get(self, task_id: str) -> Set[Subscriber]:
+        return set(self._subscribers.get(task_id, ()))
+    
+    async def broadcast(self, task_id: str, data: dict) -> int:
+        """Queue an event for all subscribers of a task without waiting for any client.
+        
+        Subscribers whose connection failed or fell too far behind are removed.
+        
+        Returns:
+            Number of subscribers the event was queued for
+        """
+        delivered = 0
+        for subscriber in self.get(task_id):
+            if subscriber.offer(data):
+                delivered += 1
+            else:
+                print(f"🔌 [API] Dropping subscriber of {task_id}: {subscriber.last_error}")
+                self.remove(subscriber)
+        return delivered
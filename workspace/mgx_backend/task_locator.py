@@ -0,0 +1,144 @@
+"""Resolve a task or project id to the project's files.
+
+Project paths are looked up in this order: the task's result, the project
+row (by numeric project id or by indexed task_id), and finally the
+conventional workspace/project_{task_id} directory. Resolved locations of
+completed tasks do not change, so they are kept in an LRU cache until the
+task is deleted.
+"""
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from mgx_backend.config import Config
+from mgx_backend.database import get_async_db_manager
+
+
+class ProjectLocation(BaseModel):
+    """Where a project's files are kept."""
+    project_path: Optional[str] = None  # Local directory, None if the project has none
+    storage_path: str  # Object path of the zipped project in Supabase Storage
+    project_id: Optional[int] = None
+
+
+class TaskLocator:
+    """Cached resolution of task and project ids to project locations."""
+    
+    def __init__(self, cache_size: Optional[int] = None, workspace: Optional[Path] = None):
+        """Initialize locator.
+        
+        Args:
+            cache_size: Locations kept (defaults to MGX_TASK_LOCATOR_CACHE_SIZE or 1024)
+            workspace: Directory of generated projects (defaults to the configured workspace)
+        """
+        self.cache_size = cache_size or int(os.getenv("MGX_TASK_LOCATOR_CACHE_SIZE", "1024"))
+        self._workspace = workspace
+        self._cache: "OrderedDict[str, ProjectLocation]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def workspace(self) -> Path:
+        """Directory generated projects are written to, resolved once."""
+        if self._workspace is None:
+            workspace_str = Config.default().project.workspace
+            package_root = Path(__file__).parent.parent.resolve()
+            candidates = [
+                Path(workspace_str) if Path(workspace_str).is_absolute() else package_root / workspace_str,
+                package_root / "workspace",
+                Path.cwd() / workspace_str,
+                Path.cwd() / "workspace",
+            ]
+            self._workspace = next((c.resolve() for c in candidates if c.is_dir()), package_root / "workspace")
+            print(f"📁 [Locator] Using workspace: {self._workspace}")
+        return self._workspace
+    
+    async def locate(self, task_id: str) -> Optional[ProjectLocation]:
+        """Find the project of a task, or of a project when given a numeric project id.
+        
+        Args:
+            task_id: Task UUID or project id
+        
+        Returns:
+            Location of the project, or None if no project is known
+        
+        Raises:
+            HTTPException: 400 if the task exists but has not completed
+        """
+        location = self._cache.get(task_id)
+        if location is not None:
+            self._cache.move_to_end(task_id)
+            self.hits += 1
+            return location
+        self.misses += 1
+        
+        location = await self._resolve(task_id)
+        if location is not None and location.project_path:
+            self._cache[task_id] = location
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return location
+    
+    async def _resolve(self, task_id: str) -> Optional[ProjectLocation]:
+        db = get_async_db_manager()
+        project_path = None
+        
+        task = await db.get_task(task_id)
+        if task:
+            if task.status != "completed":
+                raise HTTPException(status_code=400, detail="Task not completed")
+            project_path = (task.result or {}).get("project_path")
+        
+        if task_id.isdigit():
+            project = await db.get_project(int(task_id))
+        else:
+            project = await db.get_project_by_task_id(task_id)
+        
+        extra_data = project.extra_data if project and isinstance(project.extra_data, dict) else {}
+        project_path = project_path or (project.project_path if project else None)
+        
+        if not project_path and not task_id.isdigit():
+            # Projects are written to workspace/project_{task_id}; never scan the whole workspace
+            candidate = self.workspace / f"project_{task_id}"
+            if candidate.is_dir():
+                project_path = str(candidate)
+        
+        if not project_path and not project:
+            return None
+        
+        return ProjectLocation(
+            project_path=self._absolute(project_path) if project_path else None,
+            storage_path=extra_data.get("storage_path") or f"projects/{task_id}.zip",
+            project_id=project.id if project else None
+        )
+    
+    def _absolute(self, project_path: str) -> str:
+        """Resolve a relative project path against the working or package directory."""
+        path = Path(project_path)
+        if path.is_absolute():
+            return str(path)
+        for base in (Path.cwd(), Path(__file__).parent.parent):
+            if (base / path).exists():
+                return str((base / path).resolve())
+        return str(path)
+    
+    def invalidate(self, task_id: str):
+        """Forget the location of a deleted task, including other ids cached for its project."""
+        location = self._cache.pop(task_id, None)
+        if location is None:
+            return
+        for key in [k for k, v in self._cache.items() if v.project_path == location.project_path]:
+            del self._cache[key]
+    
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,201 @@
+"""Durable task queue with a bounded pool of async workers."""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from mgx_backend.database import get_async_db_manager, TaskModel
+from mgx_backend.scheduler import FairScheduler
+
+
+class WorkerPool:
+    """Run queued tasks from the tasks table with a fixed number of async workers.
+    
+    Tasks are claimed with a lease (visibility timeout) that is renewed while
+    they run. If a process dies, its leases expire and another worker reclaims
+    the tasks, which then resume from their checkpoints.
+    """
+    
+    def __init__(
+        self,
+        runner: Callable[[TaskModel], Awaitable[None]],
+        concurrency: Optional[int] = None,
+        lease_seconds: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        saturated_users: Optional[Callable[[], Awaitable[List[int]]]] = None,
+        scheduler: Optional[FairScheduler] = None
+    ):
+        """Initialize worker pool.
+        
+        Args:
+            runner: Coroutine function executing one claimed task
+            concurrency: Number of workers (defaults to MGX_WORKERS env var or 4)
+            lease_seconds: Lease length (defaults to MGX_LEASE_SECONDS env var or 60)
+            poll_interval: Seconds between polls when idle (defaults to MGX_QUEUE_POLL_SECONDS or 2)
+            max_attempts: Claims before a task is failed (defaults to MGX_MAX_ATTEMPTS or 3)
+            saturated_users: Optional async callable returning ids of users at their running
+                limit; their queued tasks are skipped until a slot frees up
+            scheduler: Optional fair-share scheduler choosing which queued task
+                runs next (FIFO by default)
+        """
+        self.runner = runner
+        self.saturated_users = saturated_users
+        self.scheduler = scheduler
+        self.concurrency = concurrency or int(os.getenv("MGX_WORKERS", "4"))
+        self.lease_seconds = lease_seconds or int(os.getenv("MGX_LEASE_SECONDS", "60"))
+        self.poll_interval = poll_interval or float(os.getenv("MGX_QUEUE_POLL_SECONDS", "2"))
+        self.max_attempts = max_attempts or int(os.getenv("MGX_MAX_ATTEMPTS", "3"))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        
+        # asyncio tasks of claimed tasks running in this process
+        self.running: Dict[str, asyncio.Task] = {}
+        self.running_classes: Dict[str, str] = {}
+        self.cancel_requested: Set[str] = set()
+        self._workers: list = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+    
+    async def start(self):
+        """Start the workers."""
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        print(f"👷 [Queue] Started {self.concurrency} workers ({self.worker_id})")
+    
+    async def stop(self):
+        """Stop the workers and put their running tasks back in the queue."""
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        for task in list(self.running.values()):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self.running.values(), return_exceptions=True)
+        self._workers = []
+        print(f"👷 [Queue] Stopped workers ({self.worker_id})")
+    
+    def notify(self):
+        """Wake idle workers after a task was enqueued."""
+        if self._wakeup:
+            self._wakeup.set()
+    
+    def cancel(self, task_id: str) -> Optional[asyncio.Task]:
+        """Cancel a task running in this process; returns its asyncio task if found."""
+        task = self.running.get(task_id)
+        if task:
+            self.cancel_requested.add(task_id)
+            task.cancel()
+        return task
+    
+    def is_cancel_requested(self, task_id: str) -> bool:
+        """Whether cancellation of a task was requested (rather than a shutdown or lost lease)."""
+        return task_id in self.cancel_requested
+    
+    @property
+    def busy(self) -> int:
+        """Number of workers currently running a task."""
+        return len(self.running)
+    
+    async def _worker(self):
+        """Claim and run tasks until stopped."""
+        db = get_async_db_manager()
+        while not self._stopping:
+            try:
+                task = await self._claim(db)
+            except Exception as e:
+                print(f"❌ [Queue] Failed to claim task: {e}")
+                task = None
+            
+            if task is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            try:
+                if task.attempts and task.attempts > self.max_attempts:
+                    print(f"❌ [Queue] Task {task.task_id} failed after {task.attempts - 1} attempts")
+                    await db.update_task(task.task_id, status="failed", error=f"Gave up after {task.attempts - 1} attempts")
+                    await db.release_task(task.task_id, self.worker_id)
+                    continue
+                
+                await self._run(db, task)
+            except Exception as e:
+                # Keep the worker alive; the task's lease expires and it is reclaimed
+                print(f"❌ [Queue] Failed to handle task {task.task_id}: {e}")
+    
+    async def _claim(self, db) -> Optional[TaskModel]:
+        """Claim the next task, in the scheduler's order if there is one."""
+        exclude = await self.saturated_users() if self.saturated_users else None
+        if not self.scheduler:
+            return await db.claim_task(self.worker_id, self.lease_seconds, exclude_user_ids=exclude)
+        
+        heads = await db.list_queue_heads(exclude)
+        if not heads:
+            return None
+        running_by_class: Dict[str, int] = {}
+        for priority_class in self.running_classes.values():
+            running_by_class[priority_class] = running_by_class.get(priority_class, 0) + 1
+        order = self.scheduler.order(heads, running_by_class, self.concurrency)
+        task = await db.claim_task(self.worker_id, self.lease_seconds, candidate_ids=order)
+        head = next((h for h in heads if task and h["id"] == task.id), None)
+        if head and not head["expired"]:
+            self.scheduler.charge(head["priority_class"], head["user_id"], head["tier"])
+        return task
+    
+    async def _run(self, db, task: TaskModel):
+        """Run one claimed task, renewing its lease until it finishes."""
+        task_id = task.task_id
+        print(f"👷 [Queue] Running task {task_id} (attempt {task.attempts})")
+        run = asyncio.create_task(self.runner(task))
+        self.running[task_id] = run
+        self.running_classes[task_id] = task.priority_class or "interactive"
+        requeue = False
+        renewed_at = time.monotonic()
+        try:
+            while not run.done():
+                await asyncio.wait([run], timeout=self.lease_seconds / 3)
+                if run.done():
+                    break
+                try:
+                    renewed = await db.renew_lease(task_id, self.worker_id, self.lease_seconds)
+                except Exception as e:
+                    print(f"⚠️ [Queue] Failed to renew lease on task {task_id}: {e}")
+                    if time.monotonic() - renewed_at < self.lease_seconds:
+                        continue  # Retried at the next renewal while the lease still holds
+                    renewed = False
+                if renewed:
+                    renewed_at = time.monotonic()
+                    continue
+                # Lease lost: cancelled through another process, reclaimed after expiry,
+                # or expired while it could not be renewed
+                try:
+                    current = await db.get_task(task_id)
+                    if current and current.status == "cancelled":
+                        self.cancel_requested.add(task_id)
+                except Exception as e:
+                    print(f"⚠️ [Queue] Failed to read task {task_id}: {e}")
+                print(f"⚠️ [Queue] Lost lease on task {task_id}, stopping it")
+                run.cancel()
+                await asyncio.wait([run])
+        except asyncio.CancelledError:
+            # Pool is stopping: let the task unwind and hand it back to the queue
+            run.cancel()
+            await asyncio.wait([run])
+            requeue = True
+            raise
+        finally:
+            self.running.pop(task_id, None)
+            self.running_classes.pop(task_id, None)
+            self.cancel_requested.discard(task_id)
+            try:
+                await db.release_task(task_id, self.worker_id, requeue=requeue)
+            except Exception as e:
+                print(f"⚠️ [Queue] Failed to release task {task_id}, its lease expires instead: {e}")
+        if not run.cancelled() and run.exception():
+            print(f"❌ [Queue] Task {task_id} crashed: {run.exception()}")
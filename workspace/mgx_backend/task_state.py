@@ -0,0 +1,95 @@
+"""Write-behind cache of task progress fields.
+
+Progress events update a task's stage, progress and cost many times per
+second while it streams. Instead of committing each one, updates are merged
+per task and flushed on an interval; state transitions (a new status, a
+result or an error) are written through immediately. Reads of a task in
+this process see its unflushed fields (see TaskStateCache.pending).
+"""
+
+import asyncio
+import os
+from typing import Dict, Optional
+
+from mgx_backend.database import get_async_db_manager
+
+
+# Fields whose change is written through immediately
+WRITE_THROUGH_FIELDS = {"status", "result", "error"}
+
+
+class TaskStateCache:
+    """Coalesce task field updates and write them behind."""
+    
+    def __init__(self, flush_interval: Optional[float] = None):
+        """Initialize cache.
+        
+        Args:
+            flush_interval: Seconds between flushes of dirty tasks (defaults to
+                MGX_PROGRESS_FLUSH_SECONDS or 1)
+        """
+        self.flush_interval = flush_interval or float(os.getenv("MGX_PROGRESS_FLUSH_SECONDS", "1"))
+        self._dirty: Dict[str, dict] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.updates = 0  # Updates received
+        self.writes = 0  # Database writes made
+    
+    async def update(self, task_id: str, **fields):
+        """Record new values of task fields."""
+        self.updates += 1
+        self._dirty.setdefault(task_id, {}).update(fields)
+        if WRITE_THROUGH_FIELDS & fields.keys():
+            await self.flush(task_id)
+        else:
+            self._ensure_flusher()
+    
+    def pending(self, task_id: str) -> dict:
+        """Fields of a task not written to the database yet."""
+        return dict(self._dirty.get(task_id, {}))
+    
+    async def flush(self, task_id: str):
+        """Write a task's dirty fields now."""
+        fields = self._dirty.pop(task_id, None)
+        if not fields:
+            return
+        try:
+            await get_async_db_manager().update_task(task_id, **fields)
+            self.writes += 1
+        except Exception:
+            # Keep the values for the next flush, unless newer ones arrived meanwhile
+            self._dirty[task_id] = {**fields, **self._dirty.get(task_id, {})}
+            raise
+    
+    async def flush_all(self):
+        """Write the dirty fields of all tasks."""
+        for task_id in list(self._dirty):
+            try:
+                await self.flush(task_id)
+            except Exception as e:
+                print(f"⚠️ [TaskState] Failed to flush task {task_id}: {e}")
+    
+    def _ensure_flusher(self):
+        """Start the periodic flush in the running event loop if it is not running."""
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not asyncio.get_running_loop():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()
+    
+    async def stop(self):
+        """Stop the periodic flush and write everything still dirty."""
+        if self._flusher and not self._flusher.done():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        await self.flush_all()
+    
+    def stats(self) -> dict:
+        return {
+            "updates": self.updates,
+            "writes": self.writes,
+            "dirty_tasks": len(self._dirty),
+            "flush_interval_seconds": self.flush_interval
+        }
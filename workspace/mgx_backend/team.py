@@ -7,7 +7,7 @@ from pydantic import BaseModel, ConfigDict, Field
 from mgx_backend.context import Context
 from mgx_backend.environment import Environment
 from mgx_backend.role import Role
-from mgx_backend.message import UserRequirement
+from mgx_backend.message import Message, UserRequirement
 from mgx_backend.cost_manager import NoMoneyException
 
 
@@ -55,14 +55,33 @@ class Team(BaseModel):
         import asyncio
         asyncio.create_task(self.env.publish_message(message))
     
-    async def run(self, n_round: int = 5, idea: str = "", progress_callback=None):
+    def resume(self, history: List[Message], queue_state: dict):
+        """Resume from checkpointed messages instead of publishing a new idea.
+        
+        Args:
+            history: Previously published messages in order
+            queue_state: Pending news per role as indexes into history
+        """
+        self.env.restore(history, queue_state)
+        for message in history:
+            if message.cause_by == "UserRequirement":
+                self.idea = message.content
+                break
+        print(f"♻️  Resumed from checkpoint: {len(history)} messages")
+    
+    async def run(self, n_round: int = 5, idea: str = "", progress_callback=None, checkpoint_callback=None):
         """Run the team for n rounds.
         
         Args:
             n_round: Number of rounds to run
             idea: Project idea
             progress_callback: Callback function(task_id, update_dict) for progress updates
+            checkpoint_callback: Callback function(seq, message, queue_state) called after each publish
         """
+        # Register before publishing the idea so the requirement is checkpointed too
+        if checkpoint_callback:
+            self.env.context.kwargs.set("checkpoint_callback", checkpoint_callback)
+        
         if idea:
             self.idea = idea
             message = UserRequirement(content=idea)
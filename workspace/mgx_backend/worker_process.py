@@ -0,0 +1,156 @@
+"""Run queued tasks in separate worker processes.
+
+The API process keeps claiming tasks and holding their leases (see
+task_queue.WorkerPool) but hands each one to a process pool, so LLM
+streaming, parsing and file writing do not block the event loop serving
+HTTP and WebSockets. Progress events come back over a multiprocessing
+queue and are fanned out to WebSocket clients by the API process.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+from mgx_backend.database import get_async_db_manager, TaskModel
+
+
+# Set in each worker process by _init_worker
+_progress_queue = None
+_cancel_flags = None
+
+# How often a worker process checks whether its task should stop
+CANCEL_POLL_SECONDS = 0.5
+
+
+def _init_worker(progress_queue, cancel_flags):
+    """Initialize a worker process with the IPC channels of the API process."""
+    global _progress_queue, _cancel_flags
+    _progress_queue = progress_queue
+    _cancel_flags = cancel_flags
+    
+    from mgx_backend import api
+    # Progress is persisted here and delivered to WebSockets by the API process
+    api.progress_forwarder = lambda task_id, data: _progress_queue.put((task_id, data))
+
+
+def _warm_up():
+    """No-op run once per process at startup so imports do not delay the first task."""
+
+
+def _run_task(task_id: str):
+    """Entry point of a worker process for one task."""
+    asyncio.run(_run_task_async(task_id))
+
+
+async def _run_task_async(task_id: str):
+    """Run a task and stop it when the API process raises its cancel flag."""
+    from mgx_backend import api
+    
+    task = await get_async_db_manager().get_task(task_id)
+    if not task:
+        await get_async_db_manager().close()
+        return
+    run = asyncio.create_task(api.execute_task(task))
+    while not run.done():
+        await asyncio.wait([run], timeout=CANCEL_POLL_SECONDS)
+        flag = await asyncio.to_thread(_cancel_flags.get, task_id)
+        if flag and not run.done():
+            if flag == "cancel":
+                # Lets the runner record the cancellation; "stop" leaves the task queued
+                api.worker_pool.cancel_requested.add(task_id)
+            run.cancel()
+            await asyncio.wait([run])
+    api.worker_pool.cancel_requested.discard(task_id)
+    await api.task_state.stop()
+    await api.cost_ledger.stop()
+    # Pooled connections belong to this task's event loop
+    await get_async_db_manager().close()
+    if not run.cancelled() and run.exception():
+        raise run.exception()
+
+
+class ProcessExecutor:
+    """Execute claimed tasks in a pool of worker processes."""
+    
+    def __init__(self, processes: Optional[int] = None):
+        """Initialize process executor.
+        
+        Args:
+            processes: Number of worker processes (defaults to MGX_WORKER_PROCESSES env var or CPU count)
+        """
+        self.processes = processes or int(os.getenv("MGX_WORKER_PROCESSES", str(os.cpu_count() or 1)))
+        self._mp = multiprocessing.get_context("spawn")
+        self._manager = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+        self._cancel_flags = None
+        self._pump: Optional[asyncio.Task] = None
+    
+    async def start(self, deliver: Callable[[str, dict], Awaitable[None]]):
+        """Start worker processes and the progress pump.
+        
+        Args:
+            deliver: Async callback(task_id, data) delivering progress to clients
+        """
+        self._manager = self._mp.Manager()
+        self._progress_queue = self._manager.Queue()
+        self._cancel_flags = self._manager.dict()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=self._mp,
+            initializer=_init_worker,
+            initargs=(self._progress_queue, self._cancel_flags)
+        )
+        await asyncio.gather(*[
+            asyncio.wrap_future(self._executor.submit(_warm_up)) for _ in range(self.processes)
+        ])
+        self._pump = asyncio.create_task(self._pump_progress(deliver))
+        print(f"⚙️  [Workers] Started pool of {self.processes} worker processes")
+    
+    async def stop(self):
+        """Stop worker processes and the progress pump."""
+        if self._executor:
+            await asyncio.to_thread(self._executor.shutdown, wait=True)
+            self._executor = None
+        if self._pump:
+            self._progress_queue.put(None)
+            await self._pump
+            self._pump = None
+        if self._manager:
+            self._manager.shutdown()
+            self._manager = None
+        print("⚙️  [Workers] Stopped worker processes")
+    
+    async def _pump_progress(self, deliver: Callable[[str, dict], Awaitable[None]]):
+        """Deliver progress events sent by worker processes until stopped."""
+        while True:
+            item = await asyncio.to_thread(self._progress_queue.get)
+            if item is None:
+                return
+            task_id, data = item
+            try:
+                await deliver(task_id, data)
+            except Exception as e:
+                print(f"⚠️ [Workers] Failed to deliver progress for {task_id}: {e}")
+    
+    async def run(self, task: TaskModel, cancel_requested: Callable[[str], bool]):
+        """Run a claimed task in a worker process until it finishes.
+        
+        Cancelling this coroutine raises the task's cancel flag: "cancel" when
+        cancel_requested(task_id) says a user cancelled it, otherwise "stop"
+        (shutdown or lost lease) so the task stays queued.
+        """
+        task_id = task.task_id
+        self._cancel_flags.pop(task_id, None)
+        future = asyncio.wrap_future(self._executor.submit(_run_task, task_id))
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self._cancel_flags[task_id] = "cancel" if cancel_requested(task_id) else "stop"
+            # Wait for the worker process to unwind and record the outcome
+            await asyncio.wait([future])
+            raise
+        finally:
+            self._cancel_flags.pop(task_id, None)
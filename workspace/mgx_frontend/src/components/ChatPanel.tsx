@@ -28,6 +28,7 @@ export function ChatPanel() {
   const lastMessageCountRef = useRef(0)
   const [savingHistory, setSavingHistory] = useState(false)
   const [currentConversationId, setCurrentConversationId] = useState<number | null>(null)
+  const savedMessagesRef = useRef<string[]>([]) // Messages as last saved, to append only new ones
   
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
@@ -358,6 +359,29 @@ export function ChatPanel() {
         })),
         extra_data: currentTask?.task_id ? { task_id: currentTask.task_id } : null
       }
+      const serialized = conversationData.messages.map(msg => JSON.stringify(msg))
+      const saved = savedMessagesRef.current
+      const onlyAppended = saved.length <= serialized.length && saved.every((msg, idx) => msg === serialized[idx])
+      
+      if (isUpdate && currentConversationId && onlyAppended) {
+        if (serialized.length > saved.length) {
+          // Append only the new messages instead of rewriting the whole conversation
+          const response = await fetch(`${API_URL}/api/conversations/${currentConversationId}/messages`, {
+            method: 'POST',
+            headers: {
+              'Content-Type': 'application/json',
+              'Authorization': `Bearer ${token}`
+            },
+            body: JSON.stringify({ messages: conversationData.messages.slice(saved.length) })
+          })
+          if (!response.ok) {
+            throw new Error(`Failed to append messages: ${response.status} ${await response.text()}`)
+          }
+          savedMessagesRef.current = serialized
+          console.log('✅ Conversation history saved (appended', serialized.length - saved.length, 'messages)')
+        }
+        return
+      }
       
       console.log('💾 [Save] Sending request...', {
         url: isUpdate && currentConversationId 
@@ -412,6 +436,7 @@ export function ChatPanel() {
         setCurrentConversationId(data.id)
         console.log('💾 [Save] Set conversation ID:', data.id)
       }
+      savedMessagesRef.current = serialized
       
       console.log('✅ Conversation history saved', isUpdate ? '(updated)' : '(created)')
     } catch (error) {
@@ -454,6 +479,7 @@ export function ChatPanel() {
   useEffect(() => {
     if (currentTask?.status === 'pending' && currentTask?.current_stage === 'Initializing') {
       setCurrentConversationId(null)
+      savedMessagesRef.current = []
     }
   }, [currentTask?.status, currentTask?.current_stage])
   
@@ -477,6 +503,13 @@ export function ChatPanel() {
     
     setMessages(loadedMessages)
     setCurrentConversationId(conversationId)
+    savedMessagesRef.current = loadedMessages.map(msg => JSON.stringify({
+      role: msg.role,
+      roleName: msg.roleName,
+      content: msg.content,
+      type: msg.type,
+      timestamp: msg.timestamp.toISOString()
+    }))
     setIdea(conversationTitle)
     
     // Load project files - try task_id from extra_data first, then project_id
@@ -504,6 +537,7 @@ export function ChatPanel() {
     // Clear all chat state
     setMessages([])
     setCurrentConversationId(null)
+    savedMessagesRef.current = []
     setIdea('')
     setShowScrollToBottom(false)
     lastMessageCountRef.current = 0
@@ -521,6 +555,7 @@ export function ChatPanel() {
     // Clear messages and conversation ID when starting a new generation
     setMessages([])
     setCurrentConversationId(null)
+    savedMessagesRef.current = []
     await startGeneration(idea, investment)
   }
 
@@ -17,6 +17,17 @@ interface Conversation {
     type?: string
     timestamp: string
   }>
+  next_messages_cursor?: string | null
+  created_at: string
+  updated_at: string
+}
+
+interface ConversationSummary {
+  id: number
+  project_id: number | null
+  title: string
+  message_count: number
+  last_message_preview: string | null
   created_at: string
   updated_at: string
 }
@@ -27,7 +38,7 @@ interface ConversationHistoryProps {
 
 export function ConversationHistory({ onClose }: ConversationHistoryProps) {
   const { user, token } = useAuth()
-  const [conversations, setConversations] = useState<Conversation[]>([])
+  const [conversations, setConversations] = useState<ConversationSummary[]>([])
   const [loading, setLoading] = useState(true)
   const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null)
   const [deleting, setDeleting] = useState<number | null>(null)
@@ -105,6 +116,45 @@ export function ConversationHistory({ onClose }: ConversationHistoryProps) {
     }
   }
 
+  // Conversations come with their first page of messages; fetch the rest before loading one
+  const loadAllMessages = async (conversation: Conversation) => {
+    const messages = [...conversation.messages]
+    let cursor = conversation.next_messages_cursor
+    while (cursor && token) {
+      const response = await fetch(
+        `${API_URL}/api/conversations/${conversation.id}/messages?cursor=${encodeURIComponent(cursor)}`,
+        { headers: { 'Authorization': `Bearer ${token}` } }
+      )
+      if (!response.ok) {
+        throw new Error(`Failed to load messages: ${response.status}`)
+      }
+      const page = await response.json()
+      messages.push(...page.messages)
+      cursor = page.next_cursor
+    }
+    return messages
+  }
+
+  // The list only has summaries; load the whole conversation when one is selected
+  const selectConversation = async (id: number) => {
+    if (!token) return
+    
+    try {
+      const response = await fetch(`${API_URL}/api/conversations/${id}`, {
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      })
+      if (!response.ok) {
+        throw new Error(`Failed to load conversation: ${response.status}`)
+      }
+      const conversation: Conversation = await response.json()
+      setSelectedConversation({ ...conversation, messages: await loadAllMessages(conversation), next_messages_cursor: null })
+    } catch (error) {
+      console.error('Failed to load conversation:', error)
+    }
+  }
+
   const deleteConversation = async (id: number) => {
     if (!token) return
     
@@ -184,7 +234,7 @@ export function ConversationHistory({ onClose }: ConversationHistoryProps) {
                   {conversations.map((conv) => (
                     <div
                       key={conv.id}
-                      onClick={() => setSelectedConversation(conv)}
+                      onClick={() => selectConversation(conv.id)}
                       className={`p-3 rounded-lg cursor-pointer transition-all ${
                         selectedConversation?.id === conv.id
                           ? 'bg-pink-100 dark:bg-pink-900 border-2 border-pink-400 dark:border-pink-600'
@@ -200,8 +250,13 @@ export function ConversationHistory({ onClose }: ConversationHistoryProps) {
                             <Calendar className="w-3 h-3" />
                             <span>{formatDate(conv.updated_at)}</span>
                           </div>
+                          {conv.last_message_preview && (
+                            <p className="text-xs text-pink-700 dark:text-pink-300 mt-1 truncate">
+                              {conv.last_message_preview}
+                            </p>
+                          )}
                           <p className="text-xs text-pink-500 dark:text-pink-500 mt-1">
-                            {conv.messages.length} message{conv.messages.length !== 1 ? 's' : ''}
+                            {conv.message_count} message{conv.message_count !== 1 ? 's' : ''}
                           </p>
                         </div>
                         <button
@@ -22,6 +22,7 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
   const [files, setFiles] = useState<FileItem[]>([])
   const [isGenerating, setIsGenerating] = useState(false)
   const [ws, setWs] = useState<WebSocket | null>(null)
+  const [eventSource, setEventSource] = useState<EventSource | null>(null)
   const [streamingFiles, setStreamingFiles] = useState<Map<string, string>>(new Map())
   const [chatMessages, setChatMessages] = useState<Array<{id: string, role: string, content: string, timestamp: Date}>>([])
 
@@ -29,13 +30,21 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
     setIsGenerating(true)
     
     try {
+      const token = localStorage.getItem('auth_token')
       const response = await fetch(`${API_URL}/api/generate`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
         body: JSON.stringify({ idea, investment, n_round: 5 }),
       })
       
       const data = await response.json()
+      if (!response.ok) {
+        // e.g. 429 when the user's generation quota is used up (Retry-After header says when to retry)
+        throw new Error(data.detail || `Failed to start generation (${response.status})`)
+      }
       const taskId = data.task_id
       
       // Clear previous task data when starting new generation
@@ -63,14 +72,25 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
       const wsUrl = `${wsProtocol}//${wsHost}/api/ws/${taskId}`
       const websocket = new WebSocket(wsUrl)
       
+      let websocketOpened = false
+      let source: EventSource | null = null
       websocket.onopen = () => {
+        websocketOpened = true
         console.log('WebSocket connected:', taskId)
       }
       
-      websocket.onmessage = (event) => {
+      const handleMessage = (event: MessageEvent) => {
         try {
         const update: ProgressUpdate = JSON.parse(event.data)
         
+        // Missed too many events: a compacted replay of the task's state follows, so rebuild from it
+        if (update.type === 'snapshot') {
+          setChatMessages([])
+          setStreamingFiles(new Map())
+          setFiles([])
+          return
+        }
+        
         // Debug: Log chat_message type updates
         if (update.type === 'chat_message') {
           console.log('💬 [Frontend] chat_message received:', {
@@ -215,12 +235,17 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
             })
           }
         
+        if (update.type === 'complete' || update.type === 'error' || update.type === 'cancelled') {
+          // The task is over; stop the SSE fallback from reconnecting
+          source?.close()
+        }
+        
         if (update.type === 'complete') {
           setIsGenerating(false)
             setStreamingFiles(new Map()) // Clear all streaming files when task completes
             // DON'T clear chatMessages here - keep them so users can see the conversation history
           fetchFiles()
-        } else if (update.type === 'error') {
+        } else if (update.type === 'error' || update.type === 'cancelled') {
           setIsGenerating(false)
             setStreamingFiles(new Map())
             // DON'T clear chatMessages on error - keep them for debugging/context
@@ -229,9 +254,18 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
           console.error('Failed to parse WebSocket message:', error)
         }
       }
+      websocket.onmessage = handleMessage
       
       websocket.onerror = (error) => {
         console.error('WebSocket error:', error)
+        if (!websocketOpened) {
+          // WebSockets blocked (e.g. by a proxy): receive the same events over Server-Sent Events
+          console.log('Falling back to Server-Sent Events:', taskId)
+          source = new EventSource(`${API_URL}/api/events/${taskId}`)
+          source.onmessage = handleMessage
+          setEventSource(source)
+          return
+        }
         setIsGenerating(false)
       }
       
@@ -321,8 +355,12 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
       ws.close()
       setWs(null)
     }
+    if (eventSource) {
+      eventSource.close()
+      setEventSource(null)
+    }
     console.log('🧹 [Task] Cleared all files and task state')
-  }, [ws])
+  }, [ws, eventSource])
 
   useEffect(() => {
     return () => {
@@ -332,6 +370,14 @@ export function TaskProvider({ children }: { children: React.ReactNode }) {
     }
   }, [ws])
 
+  useEffect(() => {
+    return () => {
+      if (eventSource) {
+        eventSource.close()
+      }
+    }
+  }, [eventSource])
+
   return (
     <TaskContext.Provider
       value={{
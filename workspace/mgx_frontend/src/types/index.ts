@@ -31,7 +31,7 @@ export interface FileItem {
 }
 
 export interface ProgressUpdate {
-  type: 'status' | 'progress' | 'complete' | 'error' | 'thinking' | 'action_start' | 'action_executing' | 'action_complete' | 'saving' | 'stream_chunk' | 'file_update' | 'file_content' | 'file_complete' | 'chat_message'
+  type: 'status' | 'progress' | 'complete' | 'error' | 'thinking' | 'action_start' | 'action_executing' | 'action_complete' | 'saving' | 'stream_chunk' | 'file_update' | 'file_content' | 'file_complete' | 'chat_message' | 'cancelled' | 'snapshot'
   status?: 'pending' | 'running' | 'completed' | 'failed' | string
   stage?: string
   progress?: number
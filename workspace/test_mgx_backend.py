@@ -6,6 +6,7 @@ This script verifies all components work correctly.
 import os
 import sys
 import asyncio
+from contextlib import contextmanager
 from pathlib import Path
 
 # Add mgx_backend to path
@@ -26,6 +27,69 @@ from mgx_backend.project_repo import ProjectRepo
 from mgx_backend.software_company import generate_repo
 
 
+def run_async(coro):
+    """Run a coroutine to completion from sync tests, inside or outside an event loop."""
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+class FakeLLMStream:
+    """Provider stream sending a few chunks, then hanging until the request is cancelled."""
+    
+    def __init__(self):
+        import threading
+        self.started = threading.Event()  # Set once the chunks were sent (waitable from any thread)
+        self.closed = False
+    
+    async def __aiter__(self):
+        from types import SimpleNamespace
+        for word in ("partial ", "product ", "requirements "):
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=word), finish_reason=None)],
+                usage=None
+            )
+        self.started.set()
+        await asyncio.Event().wait()
+    
+    async def close(self):
+        self.closed = True
+
+
+class FakeOpenAIClient:
+    """Stand-in for AsyncOpenAI whose completions are FakeLLMStreams."""
+    
+    streams = []
+    
+    def __init__(self, **kwargs):
+        from types import SimpleNamespace
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    async def create(self, **kwargs):
+        stream = FakeLLMStream()
+        FakeOpenAIClient.streams.append(stream)
+        return stream
+
+
+@contextmanager
+def fake_generation(tmpdir: str):
+    """Run generations against FakeOpenAIClient, writing events and projects under tmpdir."""
+    from mgx_backend import api, llm as llm_module
+    saved = llm_module.AsyncOpenAI, api.event_log.directory, os.environ.get("MGX_WORKSPACE")
+    FakeOpenAIClient.streams = []
+    llm_module.AsyncOpenAI = FakeOpenAIClient
+    api.event_log.directory = Path(tmpdir) / "events"
+    os.environ["MGX_WORKSPACE"] = tmpdir
+    try:
+        yield FakeOpenAIClient.streams
+    finally:
+        llm_module.AsyncOpenAI, api.event_log.directory, workspace = saved
+        if workspace is None:
+            os.environ.pop("MGX_WORKSPACE", None)
+        else:
+            os.environ["MGX_WORKSPACE"] = workspace
+
+
 def test_imports():
     """Test 1: Verify all imports work."""
     print("✅ Test 1: All imports successful")
@@ -242,6 +306,1316 @@ async def test_full_workflow():
         return False
 
 
+def test_checkpoint_resume():
+    """Test 12: Verify environment checkpoint and restore."""
+    print("\n🧪 Test 12: Checkpoint & Resume")
+    
+    config = Config.default()
+    config.llm.api_key = config.llm.api_key or "test-key"
+    
+    checkpoints = []
+    
+    async def checkpoint_callback(seq, message, queue_state):
+        checkpoints.append((seq, message, queue_state))
+    
+    ctx = Context(config=config)
+    ctx.kwargs.set("checkpoint_callback", checkpoint_callback)
+    env = Environment(context=ctx)
+    env.add_roles([ProductManager(), Architect(), Engineer()])
+    run_async(env.publish_message(UserRequirement(content="Create a game")))
+    
+    assert len(checkpoints) == 1
+    seq, message, queue_state = checkpoints[0]
+    assert seq == 0
+    assert queue_state["Alice"] == [0]
+    assert queue_state["Bob"] == [] and queue_state["Charlie"] == []
+    print("  ✅ Message checkpointed with queue state")
+    
+    # Restore into a fresh team, as after a process restart
+    team = Team(context=Context(config=config))
+    team.hire([ProductManager(), Architect(), Engineer()])
+    team.resume([message], queue_state)
+    assert team.idea == "Create a game"
+    assert not team.env.roles["Alice"].is_idle
+    assert team.env.roles["Bob"].is_idle
+    print("  ✅ Team resumed from checkpoint")
+    
+    return True
+
+
+def test_amend_mapping():
+    """Test 13: Verify design diffing and mapping to affected files."""
+    print("\n🧪 Test 13: Amend Mapping")
+    
+    from mgx_backend.amend import split_sections, diff_sections, map_sections_to_files
+    
+    old = "# Design\n## Scoring\nOne point per pellet.\n## Rendering\nDraw the maze in render.js\n"
+    new = "# Design\n## Scoring\nTen points per pellet, see addPoints.\n## Rendering\nDraw the maze in render.js\n"
+    changed = diff_sections(split_sections(old), split_sections(new))
+    assert list(changed) == ["Design / Scoring"]
+    print("  ✅ Only the changed section detected")
+    
+    files = {
+        "score.js": "function addPoints(n) { score += n }",
+        "render.js": "function drawMaze() {}",
+    }
+    assert map_sections_to_files(changed, files) == ["score.js"]
+    print("  ✅ Changed section mapped to affected file")
+    
+    return True
+
+
+def test_task_queue_claim():
+    """Test 14: Verify atomic task claims and lease handling."""
+    print("\n🧪 Test 14: Task Queue Claims")
+    
+    import tempfile
+    from datetime import datetime, timedelta
+    from mgx_backend.database import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseManager(f"sqlite:///{tmpdir}/queue.db")
+        db.create_tables()
+        db.create_task("t1", "first", 5.0, 5)
+        db.create_task("t2", "second", 5.0, 5)
+        
+        first = db.claim_task("worker-a", lease_seconds=60)
+        second = db.claim_task("worker-b", lease_seconds=60)
+        assert first.task_id == "t1" and second.task_id == "t2"
+        assert db.claim_task("worker-c", lease_seconds=60) is None
+        print("  ✅ Each task claimed by exactly one worker")
+        
+        assert db.renew_lease("t1", "worker-a", 60)
+        assert not db.renew_lease("t1", "worker-b", 60)
+        db.update_task("t2", lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+        reclaimed = db.claim_task("worker-c", lease_seconds=60)
+        assert reclaimed.task_id == "t2" and reclaimed.attempts == 2
+        print("  ✅ Expired lease reclaimed by another worker")
+        
+        db.release_task("t1", "worker-a", requeue=True)
+        assert db.get_task("t1").status == "pending"
+        assert db.get_queue_stats()["depth"] == 1
+        print("  ✅ Released task requeued")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_admission_control():
+    """Test 15: Verify per-user admission limits."""
+    print("\n🧪 Test 15: Admission Control")
+    
+    import tempfile
+    from fastapi import HTTPException
+    from mgx_backend import admission, database
+    from datetime import datetime
+    from mgx_backend.admission import admit, create_admitted_task, saturated_users
+    
+    previous = database.db_manager, database.async_db_manager
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database.db_manager = db = database.DatabaseManager(f"sqlite:///{tmpdir}/admission.db")
+        database.async_db_manager = database.AsyncDatabaseManager(f"sqlite:///{tmpdir}/admission.db")
+        db.create_tables()
+        try:
+            user = db.create_user(database.UserCreate(username="alice", email="alice@example.com", password="secret"), password_hash="")
+            assert run_async(admit(user)) is False
+            db.create_task("t1", "first", 5.0, 5, user_id=user.id)
+            db.claim_task("worker", lease_seconds=60)
+            assert run_async(saturated_users()) == [user.id]
+            print("  ✅ User at running limit is saturated")
+            
+            for i in range(2):
+                assert run_async(admit(user)) is True
+                db.create_task(f"q{i}", "queued", 5.0, 5, user_id=user.id)
+            assert db.claim_task("worker", lease_seconds=60, exclude_user_ids=run_async(saturated_users())) is None
+            print("  ✅ Further tasks queued, not claimed")
+            
+            try:
+                run_async(admit(user))
+                assert False, "queue limit not enforced"
+            except HTTPException as e:
+                assert e.status_code == 429 and "Retry-After" in e.headers
+            print("  ✅ Over-limit request rejected with Retry-After")
+            
+            # A tier without spend allowance rejects users who never spent anything
+            admission.tier_limits["trial"] = admission.TierLimits(max_spend=0.0)
+            trial = db.create_user(database.UserCreate(username="trial", email="trial@example.com", password="secret"), password_hash="")
+            trial.tier = "trial"
+            try:
+                run_async(admit(trial))
+                assert False, "spend limit not enforced"
+            except HTTPException as e:
+                assert e.status_code == 429 and e.headers["Retry-After"] == str(24 * 3600)
+            print("  ✅ Zero spend limit rejected with a full-window Retry-After")
+            
+            # A burst of requests cannot all pass the check before their tasks exist
+            burst = db.create_user(database.UserCreate(username="burst", email="burst@example.com", password="secret"), password_hash="")
+            
+            async def admit_burst(n):
+                return await asyncio.gather(
+                    *(create_admitted_task(burst, f"b{i}", "burst", 5.0) for i in range(n)),
+                    return_exceptions=True
+                )
+            
+            results = run_async(admit_burst(6))
+            assert [r for r in results if not isinstance(r, Exception)] == [False, True, True]
+            assert all(isinstance(r, HTTPException) and r.status_code == 429 for r in results if isinstance(r, Exception))
+            assert run_async(database.async_db_manager.get_user_task_usage(burst.id, since=datetime.utcnow()))["queued"] == 3
+            print("  ✅ 6 concurrent requests against a limit of 3 tasks admit exactly 3")
+        finally:
+            run_async(database.async_db_manager.close())
+            admission.tier_limits.pop("trial", None)
+            database.db_manager, database.async_db_manager = previous
+            db.engine.dispose()
+    
+    return True
+
+
+def test_fair_scheduler():
+    """Test 16: Verify weighted fair ordering across users and priority classes."""
+    print("\n🧪 Test 16: Fair Scheduler")
+    
+    from datetime import datetime, timedelta
+    from mgx_backend.scheduler import FairScheduler, WeightedRateLimiter
+    
+    scheduler = FairScheduler(class_weights={"interactive": 4.0, "batch": 1.0}, reserved_interactive=1)
+    start = datetime.utcnow()
+    queue = {
+        ("batch", 1): [start + timedelta(seconds=i) for i in range(5)],
+        ("batch", 2): [start + timedelta(seconds=10 + i) for i in range(2)],
+        ("interactive", 3): [start + timedelta(seconds=20)],
+    }
+    dispatched = []
+    while any(queue.values()):
+        heads = [
+            {"id": len(dispatched) * 10 + n, "user_id": user, "tier": "free", "priority_class": cls,
+             "queued_at": times[0], "expired": False}
+            for n, ((cls, user), times) in enumerate(queue.items()) if times
+        ]
+        first = next(h for h in heads if h["id"] == scheduler.order(heads, {}, concurrency=4)[0])
+        scheduler.charge(first["priority_class"], first["user_id"], first["tier"])
+        queue[(first["priority_class"], first["user_id"])].pop(0)
+        dispatched.append(first["user_id"])
+    
+    assert dispatched[0] == 3
+    assert dispatched[1:5] == [1, 2, 1, 2]
+    print("  ✅ Interactive first, batch users alternate")
+    
+    busy = [{"id": 1, "user_id": 1, "tier": "free", "priority_class": "batch", "queued_at": start, "expired": False}]
+    assert scheduler.order(busy, {"batch": 3}, concurrency=4) == []
+    print("  ✅ Reserved worker kept free for interactive tasks")
+    
+    limiter = WeightedRateLimiter(600, class_weights={"interactive": 4.0, "batch": 1.0})
+    assert limiter.capacity == {"interactive": 480.0, "batch": 120.0}
+    print("  ✅ LLM tokens split by class weight")
+    
+    return True
+
+
+def test_event_bus():
+    """Test 17: Verify progress events reach subscribers on other nodes."""
+    print("\n🧪 Test 17: Event Bus")
+    
+    from mgx_backend.event_bus import EventBus
+    
+    class SilentBus(EventBus):
+        """A bus that forgot to implement publish()."""
+    
+    try:
+        SilentBus(None)
+        assert False, "bus without publish() created"
+    except TypeError:
+        print("  ✅ Bus without publish() rejected when created")
+    
+    try:
+        import fakeredis
+    except ImportError:
+        print("  ⚠️  Skipped (fakeredis not installed)")
+        return True
+    from mgx_backend.event_bus import LocalEventBus, RedisEventBus
+    
+    async def scenario():
+        received = {"a": [], "b": []}
+        
+        def collector(node):
+            async def deliver(task_id, data):
+                received[node].append((task_id, data))
+            return deliver
+        
+        local = LocalEventBus(collector("a"))
+        await local.publish("t0", {"type": "status"})
+        assert received["a"] == [("t0", {"type": "status"})]
+        received["a"].clear()
+        
+        # Two nodes sharing one Redis-protocol server (in-memory stand-in)
+        server = fakeredis.FakeServer()
+        node_a = RedisEventBus(collector("a"), client=fakeredis.aioredis.FakeRedis(server=server))
+        node_b = RedisEventBus(collector("b"), client=fakeredis.aioredis.FakeRedis(server=server))
+        await node_a.start()
+        await node_b.start()
+        await node_a.publish("t1", {"type": "file_complete", "filepath": "src/main.py"})
+        for _ in range(50):
+            if received["b"]:
+                break
+            await asyncio.sleep(0.02)
+        await node_a.stop()
+        await node_b.stop()
+        return received
+    
+    received = run_async(scenario())
+    assert received["b"] == [("t1", {"type": "file_complete", "filepath": "src/main.py"})]
+    assert received["a"] == received["b"]
+    print("  ✅ Event published on one node delivered on every node")
+    
+    return True
+
+
+def test_multiple_subscribers():
+    """Test 18: Verify concurrent fan-out to several subscribers of a task."""
+    print("\n🧪 Test 18: Multiple Subscribers")
+    
+    import time
+    from mgx_backend.subscriptions import Subscriber, SubscriberRegistry
+    
+    class FakeWebSocket:
+        def __init__(self, delay=0.0, broken=False):
+            self.delay, self.broken, self.sent = delay, broken, []
+        
+        async def send_json(self, data):
+            await asyncio.sleep(self.delay)
+            if self.broken:
+                raise RuntimeError("connection closed")
+            self.sent.append(data)
+    
+    async def fan_out():
+        registry = SubscriberRegistry()
+        slow_a, slow_b, broken = FakeWebSocket(0.2), FakeWebSocket(0.2), FakeWebSocket(broken=True)
+        for websocket in (slow_a, slow_b, broken):
+            registry.add(Subscriber("t1", websocket))
+        
+        started = time.perf_counter()
+        queued = await registry.broadcast("t1", {"type": "status"})
+        assert queued == 3 and time.perf_counter() - started < 0.05, "broadcast waited for clients"
+        await asyncio.sleep(0.3)
+        assert slow_a.sent == slow_b.sent == [{"type": "status"}], "sends were not concurrent"
+        print("  ✅ Event sent to all subscribers concurrently")
+        
+        assert await registry.broadcast("t1", {"type": "status"}) == 2
+        assert len(registry.get("t1")) == 2
+        registry.remove(next(s for s in registry.get("t1") if s.websocket is slow_a))
+        assert [s.websocket for s in registry.get("t1")] == [slow_b]
+        registry.remove(next(iter(registry.get("t1"))))
+    
+    run_async(fan_out())
+    print("  ✅ Failed and disconnected subscribers removed individually")
+    
+    return True
+
+
+def test_event_log_replay():
+    """Test 19: Verify event numbering, resume from a sequence number and compaction."""
+    print("\n🧪 Test 19: Event Log Replay")
+    
+    import json
+    import tempfile
+    from mgx_backend.event_log import EventLog
+    
+    directory = tempfile.mkdtemp()
+    log = EventLog(directory=directory, max_replay=5)
+    for i in range(3):
+        log.record("t1", log.append("t1", {"type": "stream_chunk", "chunk": str(i)}))
+    log.record("t1", log.append("t1", {"type": "chat_message", "message": "hi"}))
+    assert [e["seq"] for e in log.replay("t1", 2)] == [3, 4]
+    # Another process (e.g. a resumed run) continues numbering from the file
+    assert EventLog(directory=directory).append("t1", {"type": "status"})["seq"] == 5
+    assert [e["seq"] for e in log.replay("t1", 3)] == [4, 5]  # Not yet delivered to this node's ring buffer
+    print("  ✅ Events numbered per task and replayed from a sequence number")
+    
+    for i in range(6):
+        log.append("t1", {"type": "file_content", "filepath": f"{i}.py", "content": "x"})
+    log.append("t1", {"type": "stream_chunk", "chunk": "3"})
+    assert log.replay("t1", 0) is None
+    snapshot = log.snapshot("t1")
+    assert [e["type"] for e in snapshot] == ["chat_message", "status"] + ["file_content"] * 6
+    print("  ✅ Large gaps answered with a compacted snapshot")
+    
+    log.append("t1", {"type": "complete", "status": "completed"})
+    assert [e["seq"] for e in log.snapshot("t1")] == [4, 5, 6, 7, 8, 9, 10, 11, 13]
+    print("  ✅ Log compacted once the task finished")
+    
+    async def send_events():
+        sent = [log.append_async("t2", {"type": "stream_chunk", "accumulated": "y" * i}) for i in range(50)]
+        sent.append(log.append_async("t2", {"type": "chat_message", "message": "done"}))
+        return await asyncio.gather(*sent)
+    
+    events = run_async(send_events())
+    assert [e["seq"] for e in events] == list(range(1, 52))
+    with open(os.path.join(directory, "t2.jsonl")) as f:
+        assert [json.loads(line)["seq"] for line in f] == [51]  # The transient events are not logged
+    print("  ✅ Transient events kept out of the log file, appends written off the event loop")
+    
+    # Another process numbering the task (e.g. cancelling it on another node) continues after transient events
+    worker = EventLog(directory=directory)
+    worker.append("t3", {"type": "progress", "progress": 10})
+    for i in range(3):
+        worker.append("t3", {"type": "stream_chunk", "accumulated": "z" * i})
+    assert EventLog(directory=directory).append("t3", {"type": "cancelled", "status": "cancelled"})["seq"] == 5
+    assert [e["type"] for e in log.replay("t3", 0)] == ["progress", "cancelled"]
+    print("  ✅ Numbering continues across processes after transient events")
+    
+    return True
+
+
+def test_event_buffer_budgets():
+    """Test 20: Verify coalescing, byte budgets and TTL eviction of buffered events."""
+    print("\n🧪 Test 20: Event Buffer Budgets")
+    
+    import tempfile
+    import time
+    from mgx_backend.event_log import EventLog
+    
+    log = EventLog(directory=tempfile.mkdtemp(), task_budget=2000, total_budget=3000, ttl=0.2)
+    for i in range(20):
+        log.record("t1", log.append("t1", {"type": "file_content", "filepath": "a.py", "content": "x" * 50 * i}))
+    assert [e["content"] for e in log.replay("t1", 0)] == ["x" * 950]
+    assert log.stats()["coalesced"] == 19
+    print("  ✅ Only the latest content of a file is buffered")
+    
+    for i in range(5):
+        log.record("t1", log.append("t1", {"type": "chat_message", "message": "y" * 500}))
+    stats = log.stats()
+    assert stats["largest"][0]["bytes"] <= 2000 and stats["evicted_task_budget"] > 0
+    assert len(log.replay("t1", 0)) == 6  # Evicted events are read back from the log file
+    for i in range(3):
+        log.record("t2", log.append("t2", {"type": "chat_message", "message": "z" * 500}))
+    assert log.stats()["bytes"] <= 3000
+    assert log.stats()["evicted_total_budget"] == 1
+    print("  ✅ Per-task and global byte budgets enforced")
+    
+    time.sleep(0.3)
+    stats = log.stats()
+    assert stats["tasks"] == 0 and stats["bytes"] == 0 and stats["expired"] == 1
+    print("  ✅ Buffers of idle tasks expire")
+    
+    return True
+
+
+def test_sse_subscriber():
+    """Test 21: Verify SSE formatting and queuing of events for an SSE stream."""
+    print("\n🧪 Test 21: SSE Subscriber")
+    
+    from mgx_backend.subscriptions import SSESubscriber, format_sse
+    
+    assert format_sse({"type": "chat_message", "seq": 7}) == 'id: 7\ndata: {"type": "chat_message", "seq": 7}\n\n'
+    assert format_sse({"type": "snapshot", "seq": 9}).startswith("data: ")
+    print("  ✅ Numbered events carry their seq as SSE id")
+    
+    async def deliver():
+        subscriber = SSESubscriber("t1")
+        subscriber.last_seq = 1
+        for seq in (1, 2, 2, 3):
+            await subscriber.send({"type": "status", "seq": seq})
+        return [event["seq"] for event in subscriber.backlog]
+    
+    assert run_async(deliver()) == [2, 3]
+    print("  ✅ Events after Last-Event-ID queued once each")
+    
+    return True
+
+
+def test_slow_consumer_backpressure():
+    """Test 22: Verify slow WebSocket clients get bounded queues and the slow-consumer policies."""
+    print("\n🧪 Test 22: Slow Consumer Backpressure")
+    
+    from mgx_backend.subscriptions import Subscriber, CLOSE_TRY_AGAIN_LATER
+    
+    class StalledWebSocket:
+        def __init__(self):
+            self.close_code = None
+        
+        async def send_json(self, data):
+            await asyncio.sleep(3600)
+        
+        async def close(self, code=1000):
+            self.close_code = code
+    
+    def events():
+        for seq in range(1, 101):
+            if seq % 2:
+                yield {"type": "stream_chunk", "role": "Engineer", "action": "WriteCode", "seq": seq}
+            else:
+                yield {"type": "file_content", "filepath": f"{seq % 4}.py", "content": "x" * seq, "seq": seq}
+    
+    async def produce(policy):
+        websocket = StalledWebSocket()
+        subscriber = Subscriber("t1", websocket, queue_size=10, policy=policy)
+        subscriber.start()
+        accepted = [subscriber.offer(event) for event in events()]
+        await asyncio.sleep(0.01)
+        subscriber.stop()
+        return subscriber, accepted, websocket
+    
+    subscriber, accepted, _ = run_async(produce("coalesce"))
+    assert all(accepted) and subscriber.stats()["queued"] <= 10 and subscriber.dropped > 0
+    print("  ✅ Coalesce policy keeps the latest chunk and file contents within the queue bound")
+    
+    subscriber, accepted, websocket = run_async(produce("drop"))
+    assert not all(accepted) and subscriber.dropped > 0 and websocket.close_code == CLOSE_TRY_AGAIN_LATER
+    print("  ✅ Drop policy drops stream chunks, then disconnects when file events keep coming")
+    
+    subscriber, accepted, websocket = run_async(produce("disconnect"))
+    assert accepted.count(True) == 10 and websocket.close_code == CLOSE_TRY_AGAIN_LATER
+    print("  ✅ Disconnect policy closes the connection so the client resumes from the event log")
+    
+    return True
+
+
+def test_async_database_manager():
+    """Test 23: Verify the async database manager mirrors DatabaseManager without blocking the loop."""
+    print("\n🧪 Test 23: Async Database Manager")
+    
+    import tempfile
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, async_engine_args, to_async_url
+    from mgx_backend.loop_monitor import LoopLagMonitor
+    
+    assert to_async_url("sqlite:///./mgx.db") == "sqlite+aiosqlite:///./mgx.db"
+    assert to_async_url("postgresql://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+    
+    # libpq parameters documented for PostgreSQL URLs must not reach asyncpg.connect()
+    url, connect_args = async_engine_args("postgresql://u:p@h:5432/db?sslmode=require")
+    connect_kwargs = url.get_dialect()().create_connect_args(url)[1]
+    assert connect_args == {"ssl": "require"} and "sslmode" not in connect_kwargs
+    url, connect_args = async_engine_args("postgresql://u:p@h:6543/postgres?pgbouncer=true")
+    connect_kwargs = url.get_dialect()().create_connect_args(url)[1]
+    assert connect_args == {"statement_cache_size": 0} and "pgbouncer" not in connect_kwargs
+    print("  ✅ sslmode and pgbouncer URLs are translated for asyncpg")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/async.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        
+        async def exercise():
+            adb = AsyncDatabaseManager(url)
+            monitor = LoopLagMonitor(interval=0.01)
+            monitor.start()
+            try:
+                await adb.create_task("t1", "idea", 1.0, 2)
+                for progress in range(50):
+                    await adb.update_task("t1", progress=progress)
+                task = await adb.get_task("t1")
+                claimed = await adb.claim_task("worker", lease_seconds=60)
+                return task, claimed, monitor.stats()
+            finally:
+                await monitor.stop()
+                await adb.close()
+        
+        task, claimed, lag = run_async(exercise())
+        assert task.progress == 49 and claimed.task_id == "t1"
+        assert db.get_task("t1").status == "running"
+        print(f"  ✅ Same operations awaitable, visible to the sync manager (loop lag p99 {lag['p99_ms']}ms)")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_task_state_cache():
+    """Test 24: Verify progress updates are coalesced and transitions written through."""
+    print("\n🧪 Test 24: Task State Write-Behind")
+    
+    import tempfile
+    from mgx_backend import database
+    from mgx_backend.task_state import TaskStateCache
+    
+    previous = database.db_manager, database.async_db_manager
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/task_state.db"
+        database.db_manager = database.DatabaseManager(url)
+        database.db_manager.create_tables()
+        database.db_manager.create_task("t1", "idea", 1.0, 2)
+        
+        async def exercise():
+            database.async_db_manager = database.AsyncDatabaseManager(url)
+            cache = TaskStateCache(flush_interval=60)
+            try:
+                await cache.update("t1", status="running")
+                for progress in range(100):
+                    await cache.update("t1", progress=progress, current_stage="coding")
+                stored = await database.async_db_manager.get_task("t1")
+                pending = cache.pending("t1")
+                await cache.update("t1", status="completed", progress=100)
+                completed = await database.async_db_manager.get_task("t1")
+                return cache, stored, pending, completed
+            finally:
+                await cache.stop()
+                await database.async_db_manager.close()
+        
+        try:
+            cache, stored, pending, completed = run_async(exercise())
+            assert stored.status == "running" and stored.progress == 0
+            assert pending == {"progress": 99, "current_stage": "coding"}
+            print("  ✅ Progress kept in memory, visible through pending()")
+            
+            assert completed.status == "completed" and completed.progress == 100
+            assert cache.stats()["updates"] == 102 and cache.stats()["writes"] == 2
+            assert cache.pending("t1") == {}
+            print("  ✅ Transition wrote the coalesced progress in one write (102 updates, 2 writes)")
+        finally:
+            database.db_manager.engine.dispose()
+            database.db_manager, database.async_db_manager = previous
+    
+    return True
+
+
+def test_task_id_lookup():
+    """Test 25: Verify projects and conversations are found by their indexed task_id."""
+    print("\n🧪 Test 25: Task ID Lookup")
+    
+    import tempfile
+    from sqlalchemy import text
+    from mgx_backend.database import ConversationCreate, DatabaseManager, ProjectCreate, UserCreate
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseManager(f"sqlite:///{tmpdir}/lookup.db")
+        db.create_tables()
+        user = db.create_user(UserCreate(username="u", email="u@example.com", password="pw"), "hash")
+        old = db.create_project(ProjectCreate(name="old", idea="idea"), user.id)
+        db.update_project_extra_data(old.id, task_id="old-task", storage_path="projects/old-task.zip")
+        db.create_conversation(ConversationCreate(user_id=user.id, extra_data={"task_id": "old-task"}))
+        
+        # Simulate a database created before the task_id columns existed
+        with db.engine.begin() as conn:
+            for table in ("projects", "conversation_history"):
+                conn.execute(text(f"DROP INDEX ix_{table}_task_id"))
+                conn.execute(text(f"ALTER TABLE {table} DROP COLUMN task_id"))
+        db.create_tables()
+        assert db.get_project_by_task_id("old-task").id == old.id
+        assert db.get_conversation_by_task_id("old-task").user_id == user.id
+        assert db.get_project_by_task_id("old-task").extra_data["storage_path"] == "projects/old-task.zip"
+        print("  ✅ Existing rows backfilled from extra_data")
+        
+        new = db.create_project(ProjectCreate(name="new", idea="idea"), user.id, task_id="new-task")
+        conv = db.create_conversation(ConversationCreate(user_id=user.id, extra_data={"task_id": "new-task"}))
+        assert db.get_project_by_task_id("new-task").id == new.id
+        assert db.get_conversation_by_task_id("new-task").id == conv.id
+        assert db.get_project_by_task_id("missing") is None
+        print("  ✅ New projects and conversations linked to their task")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_task_locator():
+    """Test 26: Verify task and project ids resolve to cached project locations."""
+    print("\n🧪 Test 26: Task Locator")
+    
+    import tempfile
+    from pathlib import Path
+    from fastapi import HTTPException
+    from mgx_backend import database
+    from mgx_backend.database import ProjectCreate, UserCreate
+    from mgx_backend.task_locator import TaskLocator
+    
+    previous = database.db_manager, database.async_db_manager
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/locator.db"
+        workspace = Path(tmpdir) / "workspace"
+        (workspace / "project_t3").mkdir(parents=True)
+        database.db_manager = db = database.DatabaseManager(url)
+        db.create_tables()
+        user = db.create_user(UserCreate(username="u", email="u@example.com", password="pw"), "hash")
+        db.create_task("t1", "idea", 1.0, 2)
+        db.update_task("t1", status="completed", result={"project_path": f"{tmpdir}/p1"})
+        db.create_task("t2", "idea", 1.0, 2)
+        project = db.create_project(ProjectCreate(name="p", idea="idea"), user.id, task_id="t1")
+        db.update_project_extra_data(project.id, storage_path="projects/custom.zip")
+        
+        async def exercise():
+            database.async_db_manager = database.AsyncDatabaseManager(url)
+            locator = TaskLocator(cache_size=2, workspace=workspace)
+            try:
+                first = await locator.locate("t1")
+                await locator.locate("t1")
+                try:
+                    await locator.locate("t2")
+                    not_ready = None
+                except HTTPException as e:
+                    not_ready = e.status_code
+                by_project = await locator.locate(str(project.id))
+                by_directory = await locator.locate("t3")
+                missing = await locator.locate("t4")
+                locator.invalidate("t1")
+                return locator, first, not_ready, by_project, by_directory, missing
+            finally:
+                await database.async_db_manager.close()
+        
+        try:
+            locator, first, not_ready, by_project, by_directory, missing = run_async(exercise())
+            assert first.project_path == f"{tmpdir}/p1" and first.storage_path == "projects/custom.zip"
+            assert not_ready == 400 and missing is None
+            assert by_project.project_id == project.id
+            assert by_directory.project_path == str(workspace / "project_t3")
+            print("  ✅ Resolved from task result, project id and project directory")
+            
+            assert locator.hits == 1 and locator.misses == 5
+            assert "t1" not in locator._cache and str(project.id) not in locator._cache
+            print("  ✅ Locations cached, forgotten with the deleted task")
+        finally:
+            db.engine.dispose()
+            database.db_manager, database.async_db_manager = previous
+    
+    return True
+
+
+def test_task_listing_pagination():
+    """Test 27: Verify tasks are listed newest first with keyset cursors and filters."""
+    print("\n🧪 Test 27: Task Listing Pagination")
+    
+    import tempfile
+    from datetime import datetime
+    from mgx_backend.database import DatabaseManager, decode_cursor, encode_cursor
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseManager(f"sqlite:///{tmpdir}/listing.db")
+        db.create_tables()
+        created_at = datetime(2024, 1, 1)
+        for i in range(5):
+            db.create_task(f"t{i}", "idea", 1.0, 2, user_id=i % 2)
+            db.update_task(f"t{i}", created_at=created_at, result={"files": ["a"] * 100})
+        db.update_task("t4", status="completed")
+        
+        pages, after = [], None
+        while True:
+            rows = db.list_tasks(limit=2, after=after)
+            pages.append([row.task_id for row in rows])
+            if len(rows) < 2:
+                break
+            after = decode_cursor(encode_cursor(rows[-1].created_at, rows[-1].id))
+        assert pages == [["t4", "t3"], ["t2", "t1"], ["t0"]]
+        print("  ✅ Pages follow each other without gaps on equal created_at")
+        
+        assert [row.task_id for row in db.list_tasks(statuses=["completed"])] == ["t4"]
+        assert [row.task_id for row in db.list_tasks(user_id=1)] == ["t3", "t1"]
+        assert "result" not in db.list_tasks()[0]._fields
+        assert db.list_tasks(include_result=True)[0].result == {"files": ["a"] * 100}
+        print("  ✅ Status and user filters, result only loaded on request")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_conversation_messages():
+    """Test 28: Verify conversation messages are stored as rows, appended and paged."""
+    print("\n🧪 Test 28: Conversation Messages")
+    
+    import json
+    import tempfile
+    from sqlalchemy import text
+    from mgx_backend.database import (
+        ConversationCreate, ConversationMessageModel, ConversationUpdate, DatabaseManager, UserCreate
+    )
+    
+    def message(i):
+        return {"role": "user", "content": f"m{i}", "timestamp": f"t{i}"}
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseManager(f"sqlite:///{tmpdir}/messages.db")
+        db.create_tables()
+        user = db.create_user(UserCreate(username="u", email="u@example.com", password="pw"), "hash")
+        
+        # Simulate a conversation saved as a JSON array before conversation_messages existed
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP TABLE conversation_messages"))
+            conn.execute(text("INSERT INTO conversation_history (user_id, title, messages) VALUES (:u, 'old', :m)"),
+                         {"u": user.id, "m": json.dumps([message(0), message(1)])})
+        db.create_tables()
+        assert db.list_conversation_messages(1) == ([message(0), message(1)], None)
+        assert db.get_conversation(1).message_count == 2
+        print("  ✅ Existing JSON messages migrated to rows")
+        
+        conv = db.create_conversation(ConversationCreate(user_id=user.id, messages=[message(i) for i in range(3)]))
+        assert db.append_conversation_messages(conv.id, [message(3), message(4)]) == 5
+        page, after = db.list_conversation_messages(conv.id, limit=2)
+        assert page == [message(0), message(1)] and after == 1
+        page, after = db.list_conversation_messages(conv.id, after=after, limit=2)
+        assert page == [message(2), message(3)]
+        print("  ✅ Messages appended and paged by cursor")
+        
+        # Mark stored rows so rewritten ones can be told apart
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE conversation_messages SET created_at = '2000-01-01 00:00:00'"))
+        edited = [message(i) for i in range(4)] + [{**message(4), "content": "edited"}, message(5)]
+        db.update_conversation(conv.id, ConversationUpdate(messages=edited))
+        rows = db.get_session().query(ConversationMessageModel).filter_by(conversation_id=conv.id).order_by(ConversationMessageModel.position).all()
+        assert db.list_conversation_messages(conv.id)[0] == edited
+        assert [row.created_at.year == 2000 for row in rows] == [True] * 4 + [False] * 2
+        print("  ✅ Full updates rewrite only from the first changed message")
+        
+        assert db.delete_conversation(conv.id, user.id)
+        assert db.list_conversation_messages(conv.id) == ([], None)
+        db.engine.dispose()
+    
+    return True
+
+
+def test_conversation_summaries():
+    """Test 29: Verify conversation lists use the denormalized count and preview."""
+    print("\n🧪 Test 29: Conversation Summaries")
+    
+    import tempfile
+    from sqlalchemy import text
+    from mgx_backend.database import (
+        ConversationCreate, ConversationSummary, ConversationUpdate, DatabaseManager, UserCreate
+    )
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseManager(f"sqlite:///{tmpdir}/summaries.db")
+        db.create_tables()
+        user = db.create_user(UserCreate(username="u", email="u@example.com", password="pw"), "hash")
+        first = db.create_conversation(ConversationCreate(user_id=user.id, title="first", messages=[{"role": "user", "content": "hello"}]))
+        second = db.create_conversation(ConversationCreate(user_id=user.id, title="second"))
+        db.append_conversation_messages(first.id, [{"role": "assistant", "content": "x" * 500}])
+        db.update_conversation(second.id, ConversationUpdate(messages=[{"role": "user", "content": "hi"}]))
+        
+        summaries = {c.title: ConversationSummary.model_validate(c) for c in db.list_conversations(user.id)}
+        assert summaries["first"].message_count == 2 and summaries["first"].last_message_preview == "x" * 200
+        assert summaries["second"].message_count == 1 and summaries["second"].last_message_preview == "hi"
+        print("  ✅ Count and preview kept up to date on create, append and update")
+        
+        # Simulate a database created before the summary columns existed
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE conversation_history DROP COLUMN message_count"))
+            conn.execute(text("ALTER TABLE conversation_history DROP COLUMN last_message_preview"))
+        db.create_tables()
+        assert db.get_conversation(first.id).message_count == 2
+        assert db.get_conversation(second.id).last_message_preview == "hi"
+        print("  ✅ Existing conversations backfilled")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_sqlite_profile():
+    """Test 30: Verify SQLite connections are tuned and async writes serialized."""
+    print("\n🧪 Test 30: SQLite Profile")
+    
+    import tempfile
+    from sqlalchemy import text
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/profile.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        with db.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        print("  ✅ WAL, synchronous=NORMAL and busy timeout set on connections")
+        
+        async def exercise():
+            adb = AsyncDatabaseManager(url)
+            try:
+                async with adb.session() as session:
+                    journal_mode = (await session.execute(text("PRAGMA journal_mode"))).scalar()
+                await adb.create_task("t1", "idea", 1.0, 2)
+                await asyncio.gather(*(adb.update_task("t1", progress=i) for i in range(20)))
+                await adb.get_task("t1")
+                return journal_mode, adb.writes
+            finally:
+                await adb.close()
+        
+        journal_mode, writes = run_async(exercise())
+        assert journal_mode == "wal" and writes == 21
+        print("  ✅ Async writes go through the single writer, reads do not")
+        
+        async def write_concurrently(task_ids, rounds=25):
+            """Update tasks concurrently from one event loop with its own manager, like a worker process."""
+            adb = AsyncDatabaseManager(url)
+            try:
+                await asyncio.gather(*(
+                    adb.update_task(task_id, progress=i) for i in range(rounds) for task_id in task_ids
+                ))
+            finally:
+                await adb.close()
+        
+        task_ids = [f"w{i}" for i in range(4)]
+        for task_id in task_ids:
+            db.create_task(task_id, "idea", 1.0, 2)
+        busy_timeout = os.environ.get("MGX_SQLITE_BUSY_TIMEOUT_MS")
+        os.environ["MGX_SQLITE_BUSY_TIMEOUT_MS"] = "0"
+        try:
+            # Within one event loop the single writer alone keeps writes from colliding
+            run_async(write_concurrently(task_ids, rounds=50))
+        finally:
+            if busy_timeout is None:
+                os.environ.pop("MGX_SQLITE_BUSY_TIMEOUT_MS")
+            else:
+                os.environ["MGX_SQLITE_BUSY_TIMEOUT_MS"] = busy_timeout
+        print("  ✅ 200 concurrent writes of one event loop without \"database is locked\"")
+        
+        # Across event loops (worker processes, other nodes) only busy_timeout makes writers wait
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = [pool.submit(asyncio.run, write_concurrently(task_ids)) for _ in range(4)]
+            for i in range(25):
+                db.update_task("w0", current_stage=f"sync {i}")
+            for result in results:
+                result.result()
+        assert {db.get_task(task_id).progress for task_id in task_ids} == {24}
+        print("  ✅ Writes from 4 event loops and a sync manager at once wait on busy_timeout instead of failing")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_cost_ledger():
+    """Test 31: Verify LLM calls are recorded in batches with incremental rollups."""
+    print("\n🧪 Test 31: Cost Ledger")
+    
+    import tempfile
+    from mgx_backend import database
+    from mgx_backend.cost_ledger import CostLedger
+    from mgx_backend.cost_manager import CostManager, current_action
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, ProjectCreate, UserCreate
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/costs.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        user = db.create_user(UserCreate(username="spender", email="spender@example.com", password="pw"), "hash")
+        
+        async def exercise():
+            saved = database.db_manager, database.async_db_manager
+            database.async_db_manager = AsyncDatabaseManager(url)
+            try:
+                ledger = CostLedger(flush_interval=60, batch_size=10)
+                cost_manager = CostManager(task_id="t1", user_id=user.id, ledger=ledger)
+                current_action.set("WriteCode")
+                for _ in range(25):
+                    cost_manager.update_cost(1000, 500, "gpt-4o-mini")
+                await ledger.stop()
+                
+                adb = database.async_db_manager
+                project = await adb.create_project(ProjectCreate(name="p", idea="idea"), user.id, task_id="t1")
+                assigned = await adb.assign_task_costs("t1", project.id)
+                return (
+                    ledger.stats(), project.id, assigned, await adb.get_total_cost(project.id),
+                    await adb.get_cost_summary(user.id), cost_manager.total_cost
+                )
+            finally:
+                await database.async_db_manager.close()
+                database.db_manager, database.async_db_manager = saved
+        
+        stats, project_id, assigned, project_total, summary, total_cost = run_async(exercise())
+        assert stats["written"] == 25 and stats["batches"] == 3 and stats["buffered"] == 0
+        print(f"  ✅ 25 calls inserted in {stats['batches']} batches")
+        assert assigned == 25 and abs(project_total - total_cost) < 1e-9
+        assert summary["totals"]["calls"] == 25 and summary["totals"]["prompt_tokens"] == 25000
+        assert len(summary["daily"]) == 1 and abs(summary["daily"][0]["total_cost"] - total_cost) < 1e-9
+        print("  ✅ Project, user and daily rollups match the recorded calls")
+        records = db.get_project_costs(project_id)
+        assert all(r.action_type == "WriteCode" and r.task_id == "t1" and r.user_id == user.id for r in records)
+        print("  ✅ Records carry task, user and action")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_unit_of_work():
+    """Test 32: Verify a unit of work shares one connection and one commit."""
+    print("\n🧪 Test 32: Unit of Work")
+    
+    import tempfile
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, ProjectCreate, UserCreate
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/uow.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        user = db.create_user(UserCreate(username="owner", email="owner@example.com", password="pw"), "hash")
+        db.create_task("t1", "idea", 1.0, 2)
+        
+        async def exercise():
+            adb = AsyncDatabaseManager(url)
+            try:
+                before = adb.pool_usage.stats()
+                async with adb.transaction() as uow:
+                    await uow.update_task("t1", status="completed")
+                    project = await uow.create_project(ProjectCreate(name="p", idea="idea"), user.id, task_id="t1")
+                    await uow.update_project_status(project.id, "completed", project_path="/tmp/p")
+                    await uow.update_project_cost(project.id, 1.5)
+                after = adb.pool_usage.stats()
+                
+                try:
+                    async with adb.transaction() as uow:
+                        await uow.create_project(ProjectCreate(name="rolled back", idea="idea"), user.id)
+                        raise RuntimeError("abort")
+                except RuntimeError:
+                    pass
+                return project, after["checkouts"] - before["checkouts"], after["commits"] - before["commits"], await adb.list_projects()
+            finally:
+                await adb.close()
+        
+        project, checkouts, commits, projects = run_async(exercise())
+        assert checkouts == 1 and commits == 1
+        print("  ✅ Four writes used one connection and one commit")
+        assert project.status == "completed" and project.total_cost == 1.5
+        assert [p.name for p in projects] == ["p"]
+        print("  ✅ Objects stay loaded after commit; a raising block is rolled back")
+        
+        with db.transaction() as uow:
+            task = uow.get_task("t1")
+            uow.update_task("t1", progress=100)
+        assert task.status == "completed" and db.get_task("t1").progress == 100
+        print("  ✅ Synchronous transaction() commits on exit")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_user_cache():
+    """Test 33: Verify authenticated requests reuse cached users and token claims."""
+    print("\n🧪 Test 33: User Cache")
+    
+    import tempfile
+    from mgx_backend import auth, database
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, UserCreate, UserUpdate
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/users.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        user = db.create_user(UserCreate(username="cached", email="cached@example.com", password="pw"), "hash")
+        token = auth.create_access_token({"sub": str(user.id)})
+        
+        async def exercise():
+            saved = database.db_manager, database.async_db_manager, auth.user_cache, auth.TOKEN_USER_CLAIMS
+            adb = database.async_db_manager = AsyncDatabaseManager(url)
+            auth.user_cache = auth.UserCache(ttl=60)
+            try:
+                queries = []
+                for _ in range(3):
+                    before = adb.pool_usage.queries
+                    await auth.get_current_user(token)
+                    queries.append(adb.pool_usage.queries - before)
+                
+                await auth.update_user(user.id, UserUpdate(avatar_url="new.png"))
+                updated = await auth.get_current_user(token)
+                
+                auth.TOKEN_USER_CLAIMS = True
+                claims_token = auth.create_access_token(auth.user_claims(updated))
+                before = adb.pool_usage.queries
+                token_user = await auth.get_token_user(claims_token)
+                return queries, updated, token_user, adb.pool_usage.queries - before
+            finally:
+                await adb.close()
+                database.db_manager, database.async_db_manager, auth.user_cache, auth.TOKEN_USER_CLAIMS = saved
+        
+        queries, updated, token_user, claim_queries = run_async(exercise())
+        assert queries == [1, 0, 0]
+        print("  ✅ Only the first authenticated request looks the user up")
+        assert updated.avatar_url == "new.png"
+        print("  ✅ update_user invalidates the cached user")
+        assert claim_queries == 0 and token_user.id == user.id and token_user.avatar_url == "new.png"
+        print("  ✅ Token claims identify the user without a query")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_password_hashing():
+    """Test 34: Verify bcrypt runs off the event loop, bounded, with rehash on login."""
+    print("\n🧪 Test 34: Password Hashing")
+    
+    import tempfile
+    import time
+    import bcrypt
+    from fastapi import HTTPException
+    from mgx_backend import auth, database
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, UserCreate
+    
+    async def max_loop_gap(hasher: auth.PasswordHasher) -> float:
+        """Longest the event loop went without running a ticker while two hashes ran."""
+        gaps, running = [], True
+        
+        async def ticker():
+            last = time.perf_counter()
+            while running:
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+        
+        tick = asyncio.create_task(ticker())
+        await asyncio.gather(hasher.hash("secret"), hasher.hash("secret"))
+        running = False
+        await tick
+        return max(gaps)
+    
+    async def rejected_when_full() -> bool:
+        hasher = auth.PasswordHasher(workers=1, queue_limit=0)
+        try:
+            results = await asyncio.gather(hasher.hash("a"), hasher.hash("b"), return_exceptions=True)
+            return any(isinstance(r, HTTPException) and r.status_code == 503 for r in results) and hasher.rejected == 1
+        finally:
+            hasher.shutdown()
+    
+    hasher = auth.PasswordHasher(workers=2)
+    try:
+        gap = run_async(max_loop_gap(hasher))
+    finally:
+        hasher.shutdown()
+    assert gap < 0.1, gap
+    print(f"  ✅ Event loop kept running while hashing (longest gap {gap * 1000:.0f} ms)")
+    assert run_async(rejected_when_full())
+    print("  ✅ Requests beyond the queue limit are rejected with 503")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/auth.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        old_hash = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4)).decode()
+        db.create_user(UserCreate(username="rehash", email="rehash@example.com", password="secret"), old_hash)
+        
+        async def login():
+            saved = database.db_manager, database.async_db_manager, auth.BCRYPT_ROUNDS
+            database.async_db_manager = AsyncDatabaseManager(url)
+            auth.BCRYPT_ROUNDS = 5
+            try:
+                wrong = await auth.authenticate_user("rehash", "wrong")
+                user = await auth.authenticate_user("rehash", "secret")
+                again = await auth.authenticate_user("rehash", "secret")
+                return wrong, user, again
+            finally:
+                await database.async_db_manager.close()
+                database.db_manager, database.async_db_manager, auth.BCRYPT_ROUNDS = saved
+        
+        wrong, user, again = run_async(login())
+        stored = db.get_user_by_username("rehash").password_hash
+        assert wrong is None and user is not None and again is not None
+        assert stored.startswith("$2b$05$") and not auth.needs_rehash(old_hash.replace("$04$", f"${auth.BCRYPT_ROUNDS:02d}$"))
+        print("  ✅ Hash rehashed with the new work factor on login")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_stream_cancellation():
+    """Test 35: Verify cancelling a task closes its LLM stream and records the partial cost."""
+    print("\n🧪 Test 35: Stream Cancellation")
+    
+    import tempfile
+    from mgx_backend import api, database
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, UserCreate
+    from mgx_backend.scheduler import WeightedRateLimiter
+    
+    class RecordingRateLimiter(WeightedRateLimiter):
+        """Rate limiter remembering the tokens charged after calls."""
+        
+        def __init__(self):
+            super().__init__(tokens_per_minute=1_000_000)
+            self.consumed = []
+        
+        def consume(self, priority_class, tokens):
+            self.consumed.append((priority_class, tokens))
+            super().consume(priority_class, tokens)
+    
+    with tempfile.TemporaryDirectory() as tmpdir, fake_generation(tmpdir) as streams:
+        url = f"sqlite:///{tmpdir}/cancel.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        user = db.create_user(UserCreate(username="canceller", email="canceller@example.com", password="pw"), "hash")
+        
+        async def cancel_running_task():
+            saved = database.db_manager, database.async_db_manager, api.llm_rate_limiter
+            database.async_db_manager = AsyncDatabaseManager(url)
+            api.llm_rate_limiter = limiter = RecordingRateLimiter()
+            try:
+                adb = database.async_db_manager
+                await adb.create_task("cancel-1", "idea", 3.0, user_id=user.id)
+                run = asyncio.create_task(api.run_generation_task("cancel-1", "idea", 3.0, 1, user_id=user.id))
+                api.worker_pool.running["cancel-1"] = run
+                while not (streams and streams[0].started.is_set()):
+                    await asyncio.sleep(0.05)
+                task = await api.cancel_task("cancel-1")
+                await api.cost_ledger.stop()
+                return task, run.cancelled(), await adb.get_cost_summary(user.id), limiter.consumed
+            finally:
+                api.worker_pool.running.pop("cancel-1", None)
+                api.worker_pool.cancel_requested.discard("cancel-1")
+                await api.task_state.stop()
+                await database.async_db_manager.close()
+                database.db_manager, database.async_db_manager, api.llm_rate_limiter = saved
+        
+        task, run_cancelled, summary, consumed = run_async(cancel_running_task())
+        assert run_cancelled and streams[0].closed
+        print("  ✅ Provider stream closed when the task was cancelled")
+        assert summary["totals"]["calls"] == 1 and summary["totals"]["completion_tokens"] == 3
+        assert summary["totals"]["total_cost"] > 0
+        print("  ✅ Tokens streamed before cancellation billed")
+        assert consumed == [("interactive", 3)]
+        print("  ✅ Tokens streamed before cancellation charged to the rate limiter")
+        assert task["status"] == "cancelled" and abs(task["cost"] - summary["totals"]["total_cost"]) < 1e-9
+        print(f"  ✅ Task ended cancelled with its partial cost (${task['cost']:.6f})")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_process_executor():
+    """Test 36: Verify progress forwarding, cancellation and stopping of tasks run by the process executor."""
+    print("\n🧪 Test 36: Process Executor")
+    
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from mgx_backend import api, database, worker_process
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager, UserCreate
+    from mgx_backend.worker_process import ProcessExecutor
+    
+    with tempfile.TemporaryDirectory() as tmpdir, fake_generation(tmpdir) as streams:
+        url = f"sqlite:///{tmpdir}/workers.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        user = db.create_user(UserCreate(username="worker", email="worker@example.com", password="pw"), "hash")
+        for task_id in ("proc-cancel", "proc-stop"):
+            db.create_task(task_id, "idea", 3.0, n_round=1, user_id=user.id)
+        
+        async def run_and_interrupt(executor: ProcessExecutor, task_id: str, cancelled_by_user: bool):
+            """Run a task until its LLM stream started, then cancel the run."""
+            started = len(streams)
+            run = asyncio.create_task(executor.run(db.get_task(task_id), lambda _: cancelled_by_user))
+            while len(streams) == started or not streams[-1].started.is_set():
+                await asyncio.sleep(0.05)
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+            return run.cancelled()
+        
+        async def exercise():
+            saved = database.db_manager, database.async_db_manager, api.progress_forwarder
+            database.async_db_manager = AsyncDatabaseManager(url)
+            delivered = []
+            
+            async def deliver(task_id: str, data: dict):
+                delivered.append((task_id, data))
+            
+            executor = ProcessExecutor(processes=1)
+            await executor.start(deliver)
+            # Run the worker side in a thread of this process, where the LLM client is faked;
+            # progress and cancel flags still cross the Manager's queue and dict
+            await asyncio.to_thread(executor._executor.shutdown)
+            executor._executor = ThreadPoolExecutor(
+                max_workers=1,
+                initializer=worker_process._init_worker,
+                initargs=(executor._progress_queue, executor._cancel_flags)
+            )
+            try:
+                cancelled = await run_and_interrupt(executor, "proc-cancel", True)
+                stopped = await run_and_interrupt(executor, "proc-stop", False)
+                flags_left = dict(executor._cancel_flags)
+            finally:
+                await executor.stop()
+                database.db_manager, database.async_db_manager, api.progress_forwarder = saved
+            return cancelled, stopped, flags_left, delivered
+        
+        cancelled, stopped, flags_left, delivered = run_async(exercise())
+        events = {task_id: [data for t, data in delivered if t == task_id] for task_id in ("proc-cancel", "proc-stop")}
+        assert any(data.get("type") == "stream_chunk" for data in events["proc-cancel"])
+        assert all(data.get("seq") for data in events["proc-cancel"])
+        print(f"  ✅ {len(delivered)} progress events delivered through the worker queue")
+        
+        task = db.get_task("proc-cancel")
+        assert cancelled and task.status == "cancelled" and task.cost > 0
+        assert events["proc-cancel"][-1]["type"] == "cancelled"
+        print("  ✅ \"cancel\" flag ends the task as cancelled with its partial cost")
+        
+        task = db.get_task("proc-stop")
+        assert stopped and task.status == "running"
+        assert not any(data.get("type") == "cancelled" for data in events["proc-stop"])
+        # The worker pool then releases the lease with requeue=True, as on shutdown
+        db.claim_task("pool", 60)
+        db.release_task("proc-stop", "pool", requeue=True)
+        assert db.get_task("proc-stop").status == "pending"
+        assert all(stream.closed for stream in streams) and not flags_left
+        print("  ✅ \"stop\" flag unwinds the task without cancelling it, leaving it to be requeued")
+        db.engine.dispose()
+    
+    return True
+
+
+def test_worker_pool_db_failures():
+    """Test 37: Verify queue workers survive database errors while renewing and releasing leases."""
+    print("\n🧪 Test 37: Worker Pool Database Failures")
+    
+    import tempfile
+    import time
+    from mgx_backend import database
+    from mgx_backend.database import AsyncDatabaseManager, DatabaseManager
+    from mgx_backend.task_queue import WorkerPool
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{tmpdir}/pool.db"
+        db = DatabaseManager(url)
+        db.create_tables()
+        for task_id in ("flaky", "down", "after"):
+            db.create_task(task_id, "idea", 1.0, 1)
+            time.sleep(0.01)  # Claimed in this order
+        
+        async def exercise():
+            saved = database.db_manager, database.async_db_manager
+            adb = database.async_db_manager = AsyncDatabaseManager(url)
+            renew_lease, release_task = adb.renew_lease, adb.release_task
+            renew_calls = {"flaky": 0, "down": 0}
+            
+            async def failing_renew_lease(task_id, worker_id, lease_seconds):
+                renew_calls[task_id] += 1
+                # "flaky" fails twice within its lease, "down" never renews
+                if task_id == "down" or renew_calls[task_id] <= 2:
+                    raise RuntimeError("database is locked")
+                return await renew_lease(task_id, worker_id, lease_seconds)
+            
+            async def failing_release_task(task_id, worker_id, requeue=False):
+                if task_id == "down":
+                    raise RuntimeError("connection dropped")
+                return await release_task(task_id, worker_id, requeue=requeue)
+            
+            adb.renew_lease, adb.release_task = failing_renew_lease, failing_release_task
+            outcomes = {}
+            
+            async def runner(task):
+                try:
+                    await asyncio.sleep({"flaky": 1.5, "down": 10}.get(task.task_id, 0.1))
+                    outcomes[task.task_id] = "completed"
+                except asyncio.CancelledError:
+                    outcomes[task.task_id] = "stopped"
+                    await adb.update_task(task.task_id, status="failed")
+                    raise
+                await adb.update_task(task.task_id, status="completed")
+            
+            pool = WorkerPool(runner, concurrency=1, lease_seconds=1, poll_interval=0.1)
+            await pool.start()
+            try:
+                started = time.monotonic()
+                while "after" not in outcomes and time.monotonic() - started < 15:
+                    await asyncio.sleep(0.1)
+                return outcomes, dict(pool.running), all(not worker.done() for worker in pool._workers)
+            finally:
+                await pool.stop()
+                await adb.close()
+                database.db_manager, database.async_db_manager = saved
+        
+        outcomes, running, workers_alive = run_async(exercise())
+        assert outcomes["flaky"] == "completed" and db.get_task("flaky").lease_owner is None
+        print("  ✅ Failed lease renewals retried while the lease holds")
+        assert outcomes["down"] == "stopped"
+        print("  ✅ Task stopped once its lease could not be renewed before expiring")
+        assert outcomes["after"] == "completed" and workers_alive and not running
+        print("  ✅ Worker kept claiming tasks after a failed release")
+        db.engine.dispose()
+    
+    return True
+
+
 async def run_all_tests():
     """Run all tests."""
     print("=" * 60)
@@ -260,6 +1634,32 @@ async def run_all_tests():
         ("Team", test_team, True),
         ("Project Repository", test_project_repo, False),
         ("Full Workflow", test_full_workflow, True),
+        ("Checkpoint & Resume", test_checkpoint_resume, False),
+        ("Amend Mapping", test_amend_mapping, False),
+        ("Task Queue Claims", test_task_queue_claim, False),
+        ("Admission Control", test_admission_control, False),
+        ("Fair Scheduler", test_fair_scheduler, False),
+        ("Event Bus", test_event_bus, False),
+        ("Multiple Subscribers", test_multiple_subscribers, False),
+        ("Event Log Replay", test_event_log_replay, False),
+        ("Event Buffer Budgets", test_event_buffer_budgets, False),
+        ("SSE Subscriber", test_sse_subscriber, False),
+        ("Slow Consumer Backpressure", test_slow_consumer_backpressure, False),
+        ("Async Database Manager", test_async_database_manager, False),
+        ("Task State Write-Behind", test_task_state_cache, False),
+        ("Task ID Lookup", test_task_id_lookup, False),
+        ("Task Locator", test_task_locator, False),
+        ("Task Listing Pagination", test_task_listing_pagination, False),
+        ("Conversation Messages", test_conversation_messages, False),
+        ("Conversation Summaries", test_conversation_summaries, False),
+        ("SQLite Profile", test_sqlite_profile, False),
+        ("Cost Ledger", test_cost_ledger, False),
+        ("Unit of Work", test_unit_of_work, False),
+        ("User Cache", test_user_cache, False),
+        ("Password Hashing", test_password_hashing, False),
+        ("Stream Cancellation", test_stream_cancellation, False),
+        ("Process Executor", test_process_executor, False),
+        ("Worker Pool Database Failures", test_worker_pool_db_failures, False),
     ]
     
     results = []